@@ -0,0 +1,227 @@
+"""
+decode.py
+
+Micro-benchmark of response decoding (_GetParser._parse_entry_get_response) on a
+synthetic table with many actions and data fields. It compares the indexed id -> name
+lookups and memoized field lookups of _TableInfo against the linear scans they replaced.
+
+With --register it decodes a paired register read instead, laid out like the switch
+returns it (one stream field per pipe, all with the field id of the register field),
+with RegisterReader and with the baseline parser, and fails if the values differ.
+
+No switch is needed: the ReadResponse is built in memory.
+
+    python benchmarks/decode.py --entries 65536 --actions 64 --fields 16
+    python benchmarks/decode.py --register --entries 65536 --pipes 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+from bfrt_controller.bfrt_grpc import client as gc
+from bfrt_controller.bfrt_grpc.info_parse import BfRtInfoParser
+from bfrt_controller.readers import RegisterReader
+
+TABLE_NAME = "pipe.Ingress.bench_table"
+TABLE_ID = 1000
+REGISTER_NAME = "pipe.Ingress.bench_reg"
+REGISTER_ID = 2000
+
+
+def synthetic_schema(n_actions, n_fields):
+    """bf-rt.json with one exact match table, n_actions actions of n_fields fields
+    each and a couple of common data fields.
+    """
+    actions = []
+    for a in range(n_actions):
+        actions.append({
+            "id": 100 + a,
+            "name": "Ingress.action_{}".format(a),
+            "data": [{"id": f + 1, "name": "param_{}".format(f), "repeated": False, "mandatory": False,
+                      "read_only": False, "type": {"type": "bytes", "width": 32}} for f in range(n_fields)],
+        })
+    table = {
+        "name": TABLE_NAME, "id": TABLE_ID, "table_type": "MatchAction_Direct", "size": 1 << 20,
+        "attributes": [], "supported_operations": [],
+        "key": [{"id": 1, "name": "meta.index", "match_type": "Exact", "mandatory": True,
+                 "type": {"type": "bytes", "width": 32}}],
+        "action_specs": actions,
+        "data": [{"mandatory": False, "read_only": False,
+                  "singleton": {"id": 65553 + i, "name": name, "repeated": False, "type": {"type": "uint64"}}}
+                 for i, name in enumerate(["$COUNTER_SPEC_BYTES", "$COUNTER_SPEC_PKTS"])],
+    }
+    return json.dumps({"tables": [table]}).encode(), json.dumps({"tables": []}).encode()
+
+
+def synthetic_response(n_entries, n_actions, n_fields):
+    """ReadResponse with n_entries entries spread over all actions, every action
+    parameter and counter field set.
+    """
+    resp = bfruntime_pb2.ReadResponse()
+    for i in range(n_entries):
+        entry = resp.entities.add().table_entry
+        entry.table_id = TABLE_ID
+        key_field = entry.key.fields.add()
+        key_field.field_id = 1
+        key_field.exact.value = i.to_bytes(4, "big")
+        entry.data.action_id = 100 + i % n_actions
+        for f in range(n_fields):
+            field = entry.data.fields.add()
+            field.field_id = f + 1
+            field.stream = (i + f).to_bytes(4, "big")
+        for field_id in (65553, 65554):
+            field = entry.data.fields.add()
+            field.field_id = field_id
+            field.stream = i.to_bytes(8, "big")
+    return resp
+
+
+def register_schema(size):
+    """bf-rt.json with one paired register of 32 bit cells."""
+    fields = [{"mandatory": False, "read_only": False,
+               "singleton": {"id": i + 1, "name": "Ingress.bench_reg.{}".format(name), "repeated": False,
+                             "annotations": [{"name": "$bfrt_field_class", "value": "register_data"}],
+                             "type": {"type": "bytes", "width": 32}}}
+              for i, name in enumerate(["first", "second"])]
+    table = {
+        "name": REGISTER_NAME, "id": REGISTER_ID, "table_type": "Register", "size": size,
+        "attributes": [], "supported_operations": ["Sync"],
+        "key": [{"id": 65556, "name": "$REGISTER_INDEX", "match_type": "Exact", "mandatory": True,
+                 "type": {"type": "uint32"}}],
+        "data": fields,
+    }
+    return json.dumps({"tables": [table]}).encode(), json.dumps({"tables": []}).encode()
+
+
+def register_value(i, field_id, pipe):
+    return (i * 16 + field_id * 4 + pipe) & 0xffffffff
+
+
+def register_response(n_entries, pipes):
+    """ReadResponse of a whole paired register, every field repeated once per pipe."""
+    resp = bfruntime_pb2.ReadResponse()
+    for i in range(n_entries):
+        entry = resp.entities.add().table_entry
+        entry.table_id = REGISTER_ID
+        key_field = entry.key.fields.add()
+        key_field.field_id = 65556
+        key_field.exact.value = i.to_bytes(4, "big")
+        for field_id in (1, 2):
+            for pipe in range(pipes):
+                field = entry.data.fields.add()
+                field.field_id = field_id
+                field.stream = register_value(i, field_id, pipe).to_bytes(4, "big")
+    return resp
+
+
+def check_register(n_entries, pipes):
+    """Decodes a register read with RegisterReader and the baseline parser.
+
+    Returns:
+        True if both return the values of register_value for every pipe
+    """
+    table = gc._Table(BfRtInfoParser(*register_schema(n_entries)).table_info_dict_get()[REGISTER_NAME], None)
+    resp = register_response(n_entries, pipes)
+
+    start = time.perf_counter()
+    arrays = RegisterReader(table, None).read([resp])
+    reader_s = time.perf_counter() - start
+    start = time.perf_counter()
+    entries = [data.to_dict() for data, key in table.get_parser._parse_entry_get_response([resp])]
+    parser_s = time.perf_counter() - start
+    print("reader   {} entries in {:.3f}s".format(len(arrays), reader_s))
+    print("parser   {} entries in {:.3f}s".format(len(entries), parser_s))
+
+    ok = len(arrays) == len(entries) == n_entries
+    for field_id, name in ((1, "first"), (2, "second")):
+        expected = [[register_value(i, field_id, p) for p in range(pipes)] for i in range(n_entries)]
+        ok = ok and arrays.fields[name].tolist() == expected
+        ok = ok and [e["Ingress.bench_reg." + name] for e in entries] == expected
+        pipe_one = RegisterReader(table, None, pipe=pipes - 1).read([resp]).fields[name].tolist()
+        ok = ok and pipe_one == [row[-1] for row in expected]
+    return ok
+
+
+# The linear scans used before the id -> name indexes, kept for comparison
+
+def _scan_action_name_get(self, action_id):
+    for action_name_, action_ in list(self.action_dict.items()):
+        if action_id == action_.id:
+            return action_.name
+    raise KeyError("Action ID %d doesn't exist" % (action_id))
+
+
+def _scan_data_field_name_get(self, field_id, action_name=None):
+    def helper(dict_to_search, ret_list):
+        if dict_to_search is None:
+            return False
+        for field_name_, data_ in list(dict_to_search.items()):
+            if data_.id == field_id:
+                ret_list.append(data_.name)
+                return True
+        found = False
+        for field_name_, field_ in list(dict_to_search.items()):
+            found |= helper(field_.container_dict, ret_list)
+        return found
+
+    ret_list = []
+    if action_name is not None and helper(self.action_dict[self.action_dict_allname[action_name]].data_dict, ret_list):
+        return ret_list[0]
+    if helper(self.data_dict, ret_list):
+        return ret_list[0]
+    raise KeyError("Failed to find field %d in table %s" % (field_id, self.name))
+
+
+def _scan_key_field_name_get(self, field_id):
+    for field_name_, key_ in list(self.key_dict.items()):
+        if key_.id == field_id:
+            return key_.name
+    raise KeyError("Failed to find %d as key in table %s" % (field_id, self.name))
+
+
+def make_table(schema, scan=False):
+    info = BfRtInfoParser(*schema).table_info_dict_get()[TABLE_NAME]
+    if scan:
+        info.action_name_get = types.MethodType(_scan_action_name_get, info)
+        info.data_field_name_get = types.MethodType(_scan_data_field_name_get, info)
+        info.key_field_name_get = types.MethodType(_scan_key_field_name_get, info)
+        info._data_field_get = info._data_field_search
+    return gc._Table(info, None)
+
+
+def decode(table, resp):
+    start = time.perf_counter()
+    n = sum(1 for _ in table.get_parser._parse_entry_get_response([resp]))
+    return n, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark decoding of a large synthetic table.")
+    parser.add_argument("--entries", type=int, default=16384, help="Number of entries in the response")
+    parser.add_argument("--actions", type=int, default=64, help="Number of actions of the table")
+    parser.add_argument("--fields", type=int, default=16, help="Number of data fields per action")
+    parser.add_argument("--register", action="store_true", help="Check and time register decoding instead")
+    parser.add_argument("--pipes", type=int, default=4, help="Number of pipes of the register read")
+    args = parser.parse_args()
+
+    if args.register:
+        ok = check_register(args.entries, args.pipes)
+        print("register values {}".format("match" if ok else "DIFFER"))
+        sys.exit(0 if ok else 1)
+
+    schema = synthetic_schema(args.actions, args.fields)
+    resp = synthetic_response(args.entries, args.actions, args.fields)
+
+    results = {}
+    for label, scan in (("scan", True), ("indexed", False)):
+        n, elapsed = decode(make_table(schema, scan=scan), resp)
+        results[label] = elapsed
+        print("{:<8} {} entries in {:.3f}s ({:.0f} entries/s)".format(label, n, elapsed, n / elapsed))
+    print("speedup  {:.2f}x".format(results["scan"] / results["indexed"]))
@@ -0,0 +1,248 @@
+"""
+suite.py
+
+Benchmark suite of the client hot paths, on synthetic exact, ternary, LPM and range
+tables of a configurable number of key and data fields:
+
+    make_key      KeyTuple lists -> _Key
+    make_data     DataTuple lists -> _Data
+    write_req     _Table._entry_write_req_make of the _Key/_Data lists
+    parse         _GetParser._parse_entry_get_response of a ReadResponse of all entries
+    to_dict       _Key.to_dict and _Data.to_dict of the parsed entries
+    print_entry   Controller._print_entry of the to_dict results
+    program       Controller.program_table against a local StandInServer
+    get_entries   Controller.get_entries against the same server
+
+No switch is needed. Results are printed and, with --output, written as JSON together
+with the commit and Python version; --compare prints the ratio against an earlier file:
+
+    python benchmarks/suite.py --entries 1000,10000,100000 --output bench.json
+    python benchmarks/suite.py --compare bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+from bfrt_controller.bfrt_grpc import client as gc
+from bfrt_controller.bfrt_grpc.info_parse import BfRtInfoParser
+from bfrt_controller.controller import Controller
+from bfrt_controller.logger import log
+from bfrt_controller.standin import StandInServer, port_tables_json
+
+MATCH_TYPES = ("Exact", "Ternary", "LPM", "Range")
+ACTION_NAME = "Ingress.set"
+ACTION_ID = 0x20000001
+FIELD_BITS = 32
+FULL_MASK = (1 << FIELD_BITS) - 1
+
+OFFLINE = ("make_key", "make_data", "write_req", "parse", "to_dict", "print_entry")
+ONLINE = ("program", "get_entries")
+
+
+def table_name(match_type):
+    return "pipe.Ingress.bench_{}".format(match_type.lower())
+
+
+def key_match_types(match_type, n_keys):
+    """Match type of every key field. A table has at most one LPM field, the others
+    are exact."""
+    if match_type == "LPM":
+        return ["LPM"] + ["Exact"] * (n_keys - 1)
+    return [match_type] * n_keys
+
+
+def synthetic_program(n_keys, n_fields, size):
+    """bf-rt.json with one table per match type, n_keys 32 bit key fields (plus
+    $MATCH_PRIORITY for ternary and range) and one action of n_fields 32 bit fields.
+    """
+    tables = []
+    for t, match_type in enumerate(MATCH_TYPES):
+        keys = [{"id": i + 1, "name": "hdr.f{}".format(i), "repeated": False, "annotations": [], "mandatory": False,
+                 "match_type": mt, "type": {"type": "bytes", "width": FIELD_BITS}}
+                for i, mt in enumerate(key_match_types(match_type, n_keys))]
+        if match_type in ("Ternary", "Range"):
+            keys.append({"id": 65537, "name": "$MATCH_PRIORITY", "repeated": False, "annotations": [],
+                         "mandatory": True, "match_type": "Exact", "type": {"type": "uint32"}})
+        tables.append({
+            "name": table_name(match_type), "id": 0x02000001 + t, "table_type": "MatchAction_Direct", "size": size,
+            "annotations": [], "depends_on": [], "has_const_default_action": False, "supported_operations": [],
+            "attributes": [], "key": keys, "data": [],
+            "action_specs": [{"id": ACTION_ID, "name": ACTION_NAME, "action_scope": "TableAndDefault",
+                              "annotations": [],
+                              "data": [{"id": f + 1, "name": "p{}".format(f), "repeated": False, "mandatory": True,
+                                        "read_only": False, "annotations": [],
+                                        "type": {"type": "bytes", "width": FIELD_BITS}}
+                                       for f in range(n_fields)]}],
+        })
+    return {"tables": tables}
+
+
+def key_tuples(match_type, n_keys, i):
+    """program_table key tuples of entry i, unique per entry."""
+    keys = []
+    for f, mt in enumerate(key_match_types(match_type, n_keys)):
+        name = "hdr.f{}".format(f)
+        value = (i * 7 + f) & FULL_MASK if f else i
+        if mt == "Exact":
+            keys.append((name, value))
+        elif mt == "Ternary":
+            keys.append((name, value, FULL_MASK))
+        elif mt == "LPM":
+            keys.append((name, value, None, FIELD_BITS))
+        else:
+            keys.append((name, None, None, None, value, value))
+    if match_type in ("Ternary", "Range"):
+        keys.append(("$MATCH_PRIORITY", 1))
+    return keys
+
+
+def entries(match_type, n_entries, n_keys, n_fields):
+    return [(key_tuples(match_type, n_keys, i), ACTION_NAME,
+             [("p{}".format(f), (i + f) & FULL_MASK) for f in range(n_fields)])
+            for i in range(n_entries)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+def run_offline(table, rows, print_entry):
+    """Times the client-only stages on rows; returns {stage: seconds}."""
+    times = {}
+    key_lists = [[gc.KeyTuple(*k) for k in row[0]] for row in rows]
+    data_lists = [[gc.DataTuple(*d) for d in row[2]] for row in rows]
+
+    keys, times["make_key"] = timed(lambda: [table.make_key(k) for k in key_lists])
+    datas, times["make_data"] = timed(lambda: [table.make_data(d, ACTION_NAME) for d in data_lists])
+
+    def write_req():
+        req = bfruntime_pb2.WriteRequest()
+        return table._entry_write_req_make(req, keys, datas, bfruntime_pb2.Update.INSERT)
+
+    req, times["write_req"] = timed(write_req)
+
+    resp = bfruntime_pb2.ReadResponse()
+    for update in req.updates:
+        resp.entities.add().CopyFrom(update.entity)
+    parsed, times["parse"] = timed(lambda: list(table.get_parser._parse_entry_get_response([resp])))
+    dicts, times["to_dict"] = timed(lambda: [(k.to_dict(), d.to_dict()) for d, k in parsed])
+    _, times["print_entry"] = timed(lambda: [print_entry(k, d) for k, d in dicts])
+    return times
+
+
+def run_online(controller, server, name, rows, chunk_size):
+    """Times a full program_table and get_entries through the stand-in server."""
+    times = {}
+    controller.setup_tables([name])
+    _, times["program"] = timed(lambda: controller.program_table(name, rows, chunk_size=chunk_size, upsert=False))
+    got, times["get_entries"] = timed(lambda: controller.get_entries(name))
+    if len(got) != len(rows):
+        raise RuntimeError("Read back {} of {} entries of {}".format(len(got), len(rows), name))
+    server.servicer.table(name).entries.clear()
+    return times
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Prints the throughput of results relative to a JSON file of an earlier run."""
+    with open(baseline_path) as f:
+        baseline = {(r["match_type"], r["entries"], r["fields"], r["stage"]): r for r in json.load(f)["results"]}
+    print("\nvs {} (>1 is faster)".format(baseline_path))
+    for r in results:
+        old = baseline.get((r["match_type"], r["entries"], r["fields"], r["stage"]))
+        if old is not None and r["seconds"] > 0:
+            print("{:<8} {:>7} {:>3} {:<12} {:6.2f}x".format(r["match_type"], r["entries"], r["fields"], r["stage"],
+                                                          old["seconds"] / r["seconds"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the encode/decode paths of the BFRT client.")
+    parser.add_argument("--entries", default="1000,10000,100000", help="Comma separated entry counts")
+    parser.add_argument("--fields", default="2,8", help="Comma separated numbers of action data fields")
+    parser.add_argument("--keys", type=int, default=2, help="Number of key fields")
+    parser.add_argument("--match-types", default=",".join(MATCH_TYPES), help="Comma separated match types")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is kept")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Entries per WriteRequest of program")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stand-in server delay per RPC in seconds")
+    parser.add_argument("--offline", action="store_true", help="Skip the stages going through the server")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    entry_counts = [int(n) for n in args.entries.split(",")]
+    field_counts = [int(n) for n in args.fields.split(",")]
+    match_types = [m for m in args.match_types.split(",") if m]
+    size = max(entry_counts)
+    log.setLevel(logging.WARNING)
+    logging.getLogger("bfruntime_grpc_client").setLevel(logging.WARNING)
+
+    results = []
+    print("{:<8} {:>7} {:>3} {:<12} {:>9} {:>12}".format("match", "entries", "fld", "stage", "seconds",
+                                                          "entries/s"))
+    for n_fields in field_counts:
+        program = synthetic_program(args.keys, n_fields, size)
+        p4_json = json.dumps(program).encode()
+        info = BfRtInfoParser(p4_json, port_tables_json())
+        server = controller = None
+        if not args.offline:
+            server = StandInServer(program, latency=args.latency).start()
+            controller = Controller("127.0.0.1", server.port, schema_cache_dir=None)
+        print_entry = Controller.__new__(Controller)._print_entry
+        try:
+            for match_type in match_types:
+                name = table_name(match_type)
+                table = gc._Table(info.table_info_get(name), None)
+                for n_entries in entry_counts:
+                    rows = entries(match_type, n_entries, args.keys, n_fields)
+                    best = {}
+                    for _ in range(args.repeat):
+                        times = run_offline(table, rows, print_entry)
+                        if controller is not None:
+                            times.update(run_online(controller, server, name, rows, args.chunk_size))
+                        for stage, seconds in times.items():
+                            best[stage] = min(seconds, best.get(stage, seconds))
+                    for stage in OFFLINE + ONLINE:
+                        if stage not in best:
+                            continue
+                        seconds = best[stage]
+                        results.append({"match_type": match_type, "entries": n_entries, "fields": n_fields,
+                                        "keys": args.keys, "stage": stage, "seconds": seconds,
+                                        "entries_per_s": n_entries / seconds if seconds else None})
+                        print("{:<8} {:>7} {:>3} {:<12} {:9.4f} {:12.0f}".format(
+                            match_type, n_entries, n_fields, stage, seconds, n_entries / seconds))
+        finally:
+            if controller is not None:
+                controller.tear_down()
+            if server is not None:
+                server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": git_revision(), "python": platform.python_version(),
+                       "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "latency": args.latency, "chunk_size": args.chunk_size, "results": results}, f, indent=2)
+        print("Results written to {}".format(args.output))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,4 @@
 from .controller import Controller
 from .ports import PortManager
 from .logger import log
+from .async_controller import AsyncController
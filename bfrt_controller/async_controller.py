@@ -0,0 +1,131 @@
+# bfrt_controller/async_controller.py
+
+"""
+async_controller.py
+
+asyncio counterpart of Controller, built on AsyncClientInterface.
+
+Every method doing I/O is a coroutine, so one event loop can program tables, poll
+registers and consume port status or digest notifications of one or many switches at
+the same time, without threads:
+
+    c = await AsyncController.connect("10.0.0.1")
+    c.setup_tables(["pipe.Ingress.ipv4_host", "Ingress.QoSMeter.drop_count_register"])
+    await asyncio.gather(
+        c.program_table("pipe.Ingress.ipv4_host", entries),
+        c.read_register_arrays("Ingress.QoSMeter.drop_count_register"))
+    await c.tear_down()
+"""
+
+from bfrt_controller.bfrt_grpc import client as gc
+from bfrt_controller.bfrt_grpc.aio_client import AsyncClientInterface
+
+from .bulk import AsyncBulkWriter, DEFAULT_CHUNK_SIZE
+from .encoder import TableEncoder
+from .readers import CounterReader, RegisterReader, read_request
+from .schema_cache import SchemaCache, DEFAULT_CACHE_DIR
+from .logger import log
+
+# Number of WriteRequests of one program_table call outstanding at once
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class AsyncController:
+    # Create with: c = await AsyncController.connect(...). The arguments are the
+    # same as for Controller.
+    def __init__(self, bfrt_ip="localhost", bfrt_port="50052", pipe_id=0xFFFF, schema_cache_dir=DEFAULT_CACHE_DIR):
+        self.log = log
+        self.bfrt_ip = bfrt_ip
+        self.bfrt_port = bfrt_port
+        self.device_id = 0
+        self.pipe_id = pipe_id
+        self.schema_cache = SchemaCache(schema_cache_dir) if schema_cache_dir is not None else None
+        self.interface = None
+        self.bfrt_info = None
+        self.target = gc.Target(self.device_id, pipe_id=pipe_id)
+        self.p4_name = None
+        self.tables = {}
+        self.encoders = {}
+
+    @classmethod
+    async def connect(cls, bfrt_ip="localhost", bfrt_port="50052", pipe_id=0xFFFF,
+                      schema_cache_dir=DEFAULT_CACHE_DIR, lazy_tables=True):
+        c = cls(bfrt_ip, bfrt_port, pipe_id, schema_cache_dir)
+        c.interface = await AsyncClientInterface.connect(f"{bfrt_ip}:{bfrt_port}", client_id=0, device_id=0)
+        c.bfrt_info = await c.interface.bfrt_info_get(schema_cache=c.schema_cache, lazy=lazy_tables)
+        c.p4_name = c.bfrt_info.p4_name_get()
+        c.log.info(f"Connected to {c.p4_name}")
+        await c.interface.bind_pipeline_config(c.p4_name)
+        return c
+
+    def setup_tables(self, table_names):
+        self.tables = {}
+        self.encoders = {}
+        for t in table_names:
+            self.tables[t] = self.bfrt_info.table_get(t)
+            self.encoders[t] = TableEncoder(self.tables[t].table)
+
+    def table_exists(self, table_name):
+        return table_name in self.tables
+
+    async def get_entries(self, table_name):
+        """List of (key dict, data dict) of all entries of a table."""
+        entries = []
+        async for d, k in self.tables[table_name].entry_get(self.target):
+            entries.append((k.to_dict(), d.to_dict()))
+        return entries
+
+    async def program_table(self, table_name, entries, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None, upsert=True,
+                            max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """Same as Controller.program_table, with up to max_in_flight chunks in flight."""
+        table = self.tables[table_name].table
+        writer = AsyncBulkWriter(table, self.target, chunk_size=chunk_size, encoder=self.encoders[table_name],
+                                 on_chunk=on_chunk, max_in_flight=max_in_flight)
+        return await writer.write(entries, upsert=upsert)
+
+    async def program_table_rows(self, table_name, key_fields, action_name, data_fields, rows,
+                                 chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None, upsert=True,
+                                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """Same as Controller.program_table_rows, with up to max_in_flight chunks in flight."""
+        table = self.tables[table_name].table
+        layout = self.encoders[table_name].layout(key_fields, action_name, data_fields)
+        writer = AsyncBulkWriter(table, self.target, chunk_size=chunk_size, encoder=layout, on_chunk=on_chunk,
+                                 max_in_flight=max_in_flight)
+        return await writer.write(rows, upsert=upsert)
+
+    async def read_counter(self, table_name, from_hw=True):
+        """All counters of a counter table as CounterArrays (see Controller.read_counter)."""
+        if not self.table_exists(table_name):
+            log.warning(f"Table {table_name} is not setup!")
+            return None
+        table = self.tables[table_name]
+        reader = CounterReader(table.table, self.target, from_hw=from_hw)
+        acc = reader.accumulator()
+        # Decode every message as it arrives instead of holding the whole response
+        async for rep in table.read_stream(read_request(table.table, self.target, reader.flags)):
+            acc.add(rep)
+        return acc.result()
+
+    async def read_register_arrays(self, reg_name, pipe=None, from_hw=True):
+        """A whole register as RegisterArrays (see Controller.read_register_arrays)."""
+        if not self.table_exists(reg_name):
+            log.warning(f"Table {reg_name} is not setup!")
+            return None
+        table = self.tables[reg_name]
+        reader = RegisterReader(table.table, self.target, pipe=pipe, from_hw=from_hw)
+        acc = reader.accumulator()
+        async for rep in table.read_stream(read_request(table.table, self.target, reader.flags)):
+            acc.add(rep)
+        return acc.result()
+
+    def port_status_notifications(self):
+        """Async iterator over the port status change notifications."""
+        return self.interface.notifications("port_status_change_notification")
+
+    def digests(self):
+        """Async iterator over the received DigestList messages."""
+        return self.interface.notifications("digest")
+
+    # ALWAYS call tear down at the end
+    async def tear_down(self):
+        await self.interface.close()
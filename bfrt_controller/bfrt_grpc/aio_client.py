@@ -0,0 +1,438 @@
+"""@brief asyncio counterpart of ClientInterface built on grpc.aio.
+    Requests are built and responses parsed by the regular _Table/_GetParser code of
+    client.py; only the transport is asynchronous. Every RPC is a coroutine, so a
+    single event loop can keep many writes and reads in flight on one or many
+    channels, and the StreamChannel is read by a task instead of a thread.
+"""
+
+import asyncio
+import logging
+
+import grpc
+import grpc.aio
+import google.rpc.code_pb2 as code_pb2
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2_grpc as bfruntime_pb2_grpc
+from bfrt_controller.bfrt_grpc import bfruntime_pb2 as bfruntime_pb2
+from . import client as gc
+
+logger = logging.getLogger('bfruntime_grpc_client')
+
+
+class _AsyncReaderWriterInterface:
+    """@brief (Internal). Same role as ClientInterface._ReaderWriterInterface, but
+        _write is a coroutine and _read returns an async iterator of ReadResponse.
+    """
+    def __init__(self, stub, client_id):
+        self.client_id = client_id
+        self.stub = stub
+        # Same as ClientInterface._ReaderWriterInterface.instrumentation
+        self.instrumentation = None
+
+    async def _write(self, req, metadata=None):
+        """@brief Internal Send Write req and wait for the response
+            @param req WriteRequest
+            @param metadata : optional metadata to send with write request
+        """
+        req.client_id = self.client_id
+        instrumentation = self.instrumentation
+        token = instrumentation.rpc_start("Write", req) if instrumentation is not None else None
+        try:
+            resp = await self.stub.Write(req, metadata=metadata)
+        except grpc.RpcError as e:
+            if token is not None:
+                instrumentation.rpc_end(token, e.code().name)
+            raise gc.BfruntimeReadWriteRpcException(e)
+        if token is not None:
+            instrumentation.rpc_response(token, resp)
+            instrumentation.rpc_end(token, "OK")
+        return resp
+
+    async def _read(self, req, metadata=None):
+        """@brief Internal Send Read req and yield the ReadResponse msgs as they arrive
+            @param req ReadRequest
+            @param metadata : optional metadata to send with read request
+        """
+        req.client_id = self.client_id
+        instrumentation = self.instrumentation
+        token = instrumentation.rpc_start("Read", req) if instrumentation is not None else None
+        code = "OK"
+        received = False
+        try:
+            async for rep in self.stub.Read(req, metadata=metadata):
+                received = True
+                if token is not None:
+                    instrumentation.rpc_response(token, rep)
+                yield rep
+        except grpc.RpcError as e:
+            code = e.code().name
+            raise gc.BfruntimeReadWriteRpcException(e)
+        except GeneratorExit:
+            if not received:
+                code = "CANCELLED"
+            raise
+        finally:
+            if token is not None:
+                instrumentation.rpc_end(token, code)
+
+
+class AsyncTable:
+    """@brief Awaitable interface to a table. Wraps the _Table of the table, which is
+        still used for make_key/make_data and the table metadata (info).
+    """
+    def __init__(self, table):
+        self.table = table
+        self.info = table.info
+        self.reader_writer_interface = table.reader_writer_interface
+        self.get_parser = table.get_parser
+
+    def make_key(self, key_field_list_in):
+        return self.table.make_key(key_field_list_in)
+
+    def make_data(self, data_field_list_in=[], action_name=None, get=False):
+        return self.table.make_data(data_field_list_in, action_name, get)
+
+    async def _write(self, target, key_list, data_list, update_type, modify_inc_type=None, flags=None,
+            atomicity=None, p4_name=None, metadata=None, entry_tgt_list=None):
+        req = bfruntime_pb2.WriteRequest()
+        if p4_name:
+            req.p4_name = p4_name
+        gc._cpy_target(req, target)
+        if atomicity is not None:
+            req.atomicity = atomicity
+        req = self.table._entry_write_req_make(req, key_list, data_list, update_type, modify_inc_type,
+                flags=flags, entry_tgt_list=entry_tgt_list)
+        resp = await self.reader_writer_interface._write(req, metadata)
+        self.get_parser._parse_entry_write_response(resp, metadata=metadata)
+
+    async def entry_add(self, target, key_list=None, data_list=None,
+            atomicity=bfruntime_pb2.WriteRequest.CONTINUE_ON_ERROR, p4_name=None,
+            metadata=None, entry_tgt_list=None):
+        """@brief Insert table entries. Same parameters as _Table.entry_add
+        """
+        await self._write(target, key_list, data_list, bfruntime_pb2.Update.INSERT, atomicity=atomicity,
+                p4_name=p4_name, metadata=metadata, entry_tgt_list=entry_tgt_list)
+
+    async def entry_mod(self, target, key_list=None, data_list=None,
+            flags={"reset_ttl":True}, p4_name=None, metadata=None, entry_tgt_list=None):
+        """@brief Modify table entries. Same parameters as _Table.entry_mod
+        """
+        await self._write(target, key_list, data_list, bfruntime_pb2.Update.MODIFY, flags=flags,
+                p4_name=p4_name, metadata=metadata, entry_tgt_list=entry_tgt_list)
+
+    async def entry_mod_inc(self, target, key_list=None, data_list=None,
+            modify_inc_type=bfruntime_pb2.TableModIncFlag.MOD_INC_ADD,
+            p4_name=None, metadata=None, entry_tgt_list=None):
+        """@brief Incrementally modify table entries. Same parameters as _Table.entry_mod_inc
+        """
+        await self._write(target, key_list, data_list, bfruntime_pb2.Update.MODIFY_INC, modify_inc_type,
+                p4_name=p4_name, metadata=metadata, entry_tgt_list=entry_tgt_list)
+
+    async def entry_del(self, target, key_list=None, p4_name=None, metadata=None, entry_tgt_list=None):
+        """@brief Delete table entries, all of them if key_list is empty. Same parameters
+            as _Table.entry_del
+        """
+        if key_list == None or key_list == []:
+            key_list = [None]
+        await self._write(target, key_list, None, bfruntime_pb2.Update.DELETE,
+                p4_name=p4_name, metadata=metadata, entry_tgt_list=entry_tgt_list)
+
+    async def entry_get(self, target, key_list=None, flags={"from_hw":True}, required_data=None,
+            handle=None, p4_name=None, metadata=None, entry_tgt_list=None):
+        """@brief Get table entries. Same parameters as _Table.entry_get
+            @return async iterator of (Data, Key) pairs, yielded as the ReadResponse
+            msgs arrive
+        """
+        req = bfruntime_pb2.ReadRequest()
+        if p4_name:
+            req.p4_name = p4_name
+        gc._cpy_target(req, target)
+        req = self.table._entry_read_req_make(req, key_list, flags, required_data, False, handle,
+                entry_tgt_list=entry_tgt_list)
+        async for rep in self.reader_writer_interface._read(req, metadata):
+            for entry in self.get_parser._parse_entry_get_response([rep], metadata=metadata):
+                yield entry
+
+    def read_stream(self, req, metadata=None):
+        """@brief Send an already built ReadRequest. Async iterator over the ReadResponse
+            msgs as they arrive
+        """
+        return self.reader_writer_interface._read(req, metadata)
+
+    async def read_responses(self, req, metadata=None):
+        """@brief Send an already built ReadRequest and collect the ReadResponse msgs
+        """
+        return [rep async for rep in self.read_stream(req, metadata)]
+
+    async def operations_execute(self, target, table_op, p4_name=None, metadata=None):
+        """@brief Apply table operations. Same parameters as _Table.operations_execute
+        """
+        req = bfruntime_pb2.WriteRequest()
+        if p4_name:
+            req.p4_name = p4_name
+        gc._cpy_target(req, target)
+        update = req.updates.add()
+        update.type = bfruntime_pb2.Update.INSERT
+        table_operation = update.entity.table_operation
+        table_operation.table_id = self.info.id_get()
+        table_operation.table_operations_type = table_op
+        resp = await self.reader_writer_interface._write(req, metadata)
+        self.get_parser._parse_entry_write_response(resp, metadata=metadata)
+
+
+class AsyncBfRtInfo:
+    """@brief _BfRtInfo whose table_get returns AsyncTable objects. The _BfRtInfo is
+        available as info for everything else (table_dict, learn_get, ...).
+    """
+    def __init__(self, info):
+        self.info = info
+        self.tables = {}
+
+    def p4_name_get(self):
+        return self.info.p4_name_get()
+
+    def table_get(self, name):
+        """@brief Get AsyncTable by name
+            @exception KeyError If table not found
+        """
+        table = self.info.table_get(name)
+        full_name = table.info.name_get()
+        async_table = self.tables.get(full_name)
+        if async_table is None:
+            async_table = self.tables[full_name] = AsyncTable(table)
+        return async_table
+
+    def learn_get(self, name):
+        return self.info.learn_get(name)
+
+
+class AsyncClientInterface:
+    """@brief asyncio version of ClientInterface. Create it with
+        interface = await AsyncClientInterface.connect(grpc_addr, client_id, device_id),
+        and close it with await interface.close().
+    """
+    def __init__(self, grpc_addr, client_id, device_id,
+            stream_queue_size=gc.DEFAULT_STREAM_QUEUE_SIZE):
+        """@brief Create the channel and the per msg type stream queues. Does not
+            connect; use connect() or call subscribe() in a coroutine.
+        """
+        self.grpc_addr = grpc_addr
+        self.client_id = client_id
+        self.device_id = device_id
+        self.is_independent = True
+        gigabyte = 1024 ** 3
+        self.channel = grpc.aio.insecure_channel(grpc_addr, options=[
+            ('grpc.max_send_message_length', gigabyte),
+            ('grpc.max_receive_message_length', gigabyte),
+            ('grpc.max_metadata_size', gigabyte)])
+        self.stub = bfruntime_pb2_grpc.BfRuntimeStub(self.channel)
+        self.reader_writer_interface = _AsyncReaderWriterInterface(self.stub, self.client_id)
+        self.stream = None
+        self.stream_recv_task = None
+        self.stream_in_qs = {type_: asyncio.Queue(stream_queue_size) for type_ in gc.STREAM_MSG_TYPES}
+        self.stream_overflow = {type_: 0 for type_ in gc.STREAM_MSG_TYPES}
+        self.exception_q = asyncio.Queue()
+
+    @classmethod
+    async def connect(cls, grpc_addr, client_id, device_id, notifications=None, timeout=1, num_tries=5,
+            perform_subscribe=True, stream_queue_size=gc.DEFAULT_STREAM_QUEUE_SIZE):
+        """@brief Create an AsyncClientInterface, open the stream and subscribe
+            @exception RuntimeError If failed to subscribe within num_tries
+        """
+        if not perform_subscribe and notifications:
+            raise RuntimeError("Notifications should not be provided if subscribe not requested")
+        interface = cls(grpc_addr, client_id, device_id, stream_queue_size)
+        if perform_subscribe:
+            interface.set_up_stream()
+            success = await interface.subscribe(notifications=notifications, timeout=timeout,
+                    num_tries=num_tries)
+            if not success:
+                await interface.close()
+                raise RuntimeError("Failed to subscribe to server at %s" % grpc_addr)
+        return interface
+
+    async def close(self):
+        """@brief Tear down the stream and close the channel
+        """
+        await self.tear_down_stream()
+        await self.channel.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def set_up_stream(self):
+        self.is_independent = False
+        self.stream = self.stub.StreamChannel()
+        self.stream_recv_task = asyncio.ensure_future(self._stream_recv())
+
+    async def tear_down_stream(self):
+        if self.stream is None:
+            return
+        self.stream.cancel()
+        if self.stream_recv_task is not None:
+            await asyncio.gather(self.stream_recv_task, return_exceptions=True)
+        self.stream = self.stream_recv_task = None
+        self.is_independent = True
+
+    async def _stream_recv(self):
+        try:
+            async for msg in self.stream:
+                self._put_stream_message(msg)
+        except asyncio.CancelledError:
+            pass
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED:
+                self.exception_q.put_nowait(gc.BfruntimeSubscribeRpcException(e))
+
+    def _put_stream_message(self, msg):
+        """@brief Internal. Put a received msg in the queue of its type, dropping the
+            oldest msg of a full queue
+        """
+        type_ = msg.WhichOneof("update")
+        in_q = self.stream_in_qs.get(type_)
+        if in_q is None:
+            logger.debug("Ignoring stream msg of unknown type %s", type_)
+            return
+        if in_q.full():
+            in_q.get_nowait()
+            if self.stream_overflow[type_] == 0:
+                logger.warning("Stream queue for %s full, dropping oldest msgs", type_)
+            self.stream_overflow[type_] += 1
+        in_q.put_nowait(msg)
+
+    def stream_overflow_get(self):
+        """@brief Get the number of msgs dropped because their queue was full
+        """
+        return dict(self.stream_overflow)
+
+    async def _get_stream_message(self, type_, timeout=1):
+        try:
+            return await asyncio.wait_for(self.stream_in_qs[type_].get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def subscribe(self, notifications=None, timeout=1, num_tries=5):
+        """@brief Send subscribe requests until one succeeds, at most num_tries times
+            @return bool subscribe was successful or not
+        """
+        if notifications is None:
+            notifications = gc.Notifications()
+        for cur_tries in range(num_tries):
+            req = bfruntime_pb2.StreamMessageRequest()
+            req.client_id = self.client_id
+            req.subscribe.device_id = self.device_id
+            req.subscribe.notifications.enable_learn_notifications = \
+                notifications.enable_learn_notifications
+            req.subscribe.notifications.enable_idletimeout_notifications = \
+                notifications.enable_idletimeout_notifications
+            req.subscribe.notifications.enable_port_status_change_notifications = \
+                notifications.enable_port_status_change_notifications
+            logger.info("Subscribe attempt #%d", cur_tries + 1)
+            await self.stream.write(req)
+            msg = await self._get_stream_message("subscribe", timeout)
+            if msg is None:
+                logger.info("Subscribe timeout exceeded %ds", timeout)
+                continue
+            logger.info("Subscribe response received %d", msg.subscribe.status.code)
+            if msg.subscribe.status.code == code_pb2.OK:
+                return True
+            logger.info("Subscribe failed")
+        return False
+
+    async def bind_pipeline_config(self, p4_name):
+        """@brief Bind to a Program on the device
+            @exception ValueError If empty p4-name is passed
+        """
+        if not p4_name:
+            logger.error("Cannot bind with empty p4_name")
+            raise ValueError("Cannot bind with empty p4_name")
+        req = bfruntime_pb2.SetForwardingPipelineConfigRequest()
+        req.client_id = self.client_id
+        req.action = bfruntime_pb2.SetForwardingPipelineConfigRequest.BIND
+        config = req.config.add()
+        config.p4_name = p4_name
+        logger.info("Binding with p4_name " + p4_name)
+        try:
+            await self.stub.SetForwardingPipelineConfig(req)
+        except grpc.RpcError as e:
+            raise gc.BfruntimeForwardingRpcException(e)
+        logger.info("Binding with p4_name %s successful!!", p4_name)
+
+    async def bfrt_info_get(self, p4_name=None, schema_cache=None, lazy=False):
+        """@brief Get bf-rt info json with GetForwardingPipelineConfig and parse it.
+            Parsing runs in the default executor so the event loop is not blocked.
+            Same parameters as ClientInterface.bfrt_info_get
+            @return AsyncBfRtInfo object
+            @exception RuntimeError On not receiving bf-rt-info.json when expecting it
+        """
+        req = bfruntime_pb2.GetForwardingPipelineConfigRequest()
+        req.device_id = self.device_id
+        req.client_id = self.client_id
+        try:
+            msg = await self.stub.GetForwardingPipelineConfig(req)
+        except grpc.RpcError as e:
+            raise gc.BfruntimeForwardingRpcException(e)
+
+        for config in msg.config:
+            logger.info("Received %s on GetForwarding on client %d, device %d", config.p4_name,
+                    req.client_id, req.device_id)
+            if not p4_name or p4_name == config.p4_name:
+                loop = asyncio.get_running_loop()
+                info = await loop.run_in_executor(None, self._bfrt_info_make, config.p4_name,
+                        config.bfruntime_info, msg.non_p4_config.bfruntime_info, schema_cache, lazy)
+                return AsyncBfRtInfo(info)
+        raise RuntimeError("BF_RT_INFO not received")
+
+    def _bfrt_info_make(self, p4_name, p4_json_data, non_p4_json_data, schema_cache, lazy=False):
+        """@brief Internal. Same as ClientInterface._bfrt_info_make with the async
+            reader/writer interface
+        """
+        parsed_info = None
+        if schema_cache is not None:
+            parsed_info = schema_cache.load(p4_name, p4_json_data, non_p4_json_data)
+        bfrt_info = gc._BfRtInfo(p4_name, p4_json_data, non_p4_json_data, self.reader_writer_interface,
+                parsed_info, lazy)
+        if schema_cache is not None and parsed_info is None:
+            schema_cache.store(p4_name, p4_json_data, non_p4_json_data, bfrt_info.parsed_info)
+        return bfrt_info
+
+    async def digest_get(self, timeout=1):
+        """@brief Get a digest entry from the StreamChannel
+           @exception RuntimeError Upon not receiving a msg within timeout
+        """
+        msg = await self._get_stream_message("digest", timeout)
+        if msg is None:
+            raise RuntimeError("Digest list not received.")
+        return msg.digest
+
+    async def idletime_notification_get(self, timeout=1):
+        """@brief Get an idletimeout notification from the StreamChannel
+           @exception RuntimeError Upon not receiving a msg within timeout
+        """
+        msg = await self._get_stream_message("idle_timeout_notification", timeout)
+        if msg is None:
+            raise RuntimeError("Idletime notification not received")
+        return msg.idle_timeout_notification
+
+    async def portstatus_notification_get(self, timeout=1):
+        """@brief Get a portstatus change notification from the StreamChannel
+           @exception RuntimeError Upon not receiving a msg within timeout
+        """
+        msg = await self._get_stream_message("port_status_change_notification", timeout)
+        if msg is None:
+            raise RuntimeError("port_status_change_notification not received.")
+        return msg.port_status_change_notification
+
+    async def notifications(self, type_):
+        """@brief Async iterator over the msgs of one stream msg type, e.g.
+            async for digest in interface.notifications("digest"). Runs until cancelled
+            @param type_ One of STREAM_MSG_TYPES
+            @return the inner msg (DigestList, IdleTimeoutNotification, ...)
+        """
+        in_q = self.stream_in_qs[type_]
+        while True:
+            msg = await in_q.get()
+            yield getattr(msg, type_)
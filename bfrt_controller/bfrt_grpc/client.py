@@ -20,7 +20,6 @@
 #More details.
 
 import six
-import time
 import grpc
 from bfrt_controller.bfrt_grpc import bfruntime_pb2_grpc as bfruntime_pb2_grpc
 from bfrt_controller.bfrt_grpc import bfruntime_pb2 as bfruntime_pb2
@@ -43,12 +42,22 @@ import google.rpc.status_pb2 as status_pb2
 import google.rpc.code_pb2 as code_pb2
 
 from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 from functools import total_ordering
 import codecs
 import binascii
 
 logger = logging.getLogger('bfruntime_grpc_client')
 
+# StreamMessageResponse update types, each received into its own queue
+STREAM_MSG_TYPES = ("subscribe", "digest", "idle_timeout_notification",
+        "port_status_change_notification", "set_forwarding_pipeline_config_response")
+# Default bound of each stream queue. When a queue is full the oldest msg is dropped
+DEFAULT_STREAM_QUEUE_SIZE = 65536
+
 def is_python2():
     return sys.version_info < (3, 0)
 
@@ -368,13 +377,31 @@ class ClientInterface:
     class _ReaderWriterInterface:
         """@brief (Internal). It wraps the read/write implementation for a specific client.
         """
-        def __init__(self, stub, client_id):
+        def __init__(self, stub, client_id, channel=None):
             """@brief Internal Initialize the Interface
                 @param stub The internal stub object which will be used to write/read to
                 @param client_id Client-ID
+                @param channel Optional channel of the stub, needed by
+                _write_serialized_async
             """
             self.client_id = client_id
             self.stub = stub
+            # Write taking an already serialized WriteRequest
+            self._write_raw = None
+            if channel is not None:
+                self._write_raw = channel.unary_unary(
+                    '/bfrt_proto.BfRuntime/Write',
+                    request_serializer=None,
+                    response_deserializer=bfruntime_pb2.WriteResponse.FromString)
+            # p4_name set on requests which have none. Needed by independent
+            # clients, which are not bound to a program
+            self.p4_name = None
+            # Optional object with rpc_start(rpc, req) -> token,
+            # rpc_response(token, resp) and rpc_end(token, code), told about
+            # every Write and Read (see bfrt_controller.metrics). Writes of
+            # _write_serialized_async use rpc_start_serialized(rpc, data, labels)
+            # instead of rpc_start when the object has it
+            self.instrumentation = None
 
         def _write(self, req, metadata=None):
             """@brief Internal Send Write req to the client
@@ -382,8 +409,89 @@ class ClientInterface:
                 @param metadata : optional metadata to send with write request
             """
             req.client_id = self.client_id
+            if self.p4_name and not req.p4_name:
+                req.p4_name = self.p4_name
+            instrumentation = self.instrumentation
+            if instrumentation is None:
+                try:
+                    return self.stub.Write(req, metadata=metadata)
+                except grpc.RpcError as e:
+                    raise BfruntimeReadWriteRpcException(e)
+            token = instrumentation.rpc_start("Write", req)
+            try:
+                resp = self.stub.Write(req, metadata=metadata)
+            except grpc.RpcError as e:
+                instrumentation.rpc_end(token, e.code().name)
+                raise BfruntimeReadWriteRpcException(e)
+            instrumentation.rpc_response(token, resp)
+            instrumentation.rpc_end(token, "OK")
+            return resp
+
+        def _write_async(self, req, metadata=None):
+            """@brief Internal Send Write req to the client without waiting for
+                the response. The caller can keep encoding the next request while
+                this one is in flight.
+                @param Request to be sent
+                @param metadata : optional metadata to send with write request
+                @return grpc Future. Pass it to _write_wait to get the response
+            """
+            req.client_id = self.client_id
+            if self.p4_name and not req.p4_name:
+                req.p4_name = self.p4_name
+            instrumentation = self.instrumentation
+            if instrumentation is None:
+                return self.stub.Write.future(req, metadata=metadata)
+            token = instrumentation.rpc_start("Write", req)
+            future = self.stub.Write.future(req, metadata=metadata)
+
+            def done(future):
+                if future.cancelled():
+                    instrumentation.rpc_end(token, "CANCELLED")
+                elif future.exception() is not None:
+                    instrumentation.rpc_end(token, future.code().name)
+                else:
+                    instrumentation.rpc_response(token, future.result())
+                    instrumentation.rpc_end(token, "OK")
+            future.add_done_callback(done)
+            return future
+
+        def _write_serialized_async(self, data, metadata=None, labels=None):
+            """@brief Internal Send an already serialized WriteRequest without
+                waiting for the response. client_id and p4_name are not filled in,
+                data must already carry them
+                @param data Serialized WriteRequest bytes
+                @param metadata : optional metadata to send with write request
+                @param labels (table_id, update type, number of updates) of the
+                request, passed to the instrumentation
+                @return grpc Future. Pass it to _write_wait to get the response
+            """
+            if self._write_raw is None:
+                raise RuntimeError("Serialized writes need the channel of the client")
+            instrumentation = self.instrumentation
+            start = getattr(instrumentation, "rpc_start_serialized", None)
+            if start is None:
+                return self._write_raw.future(data, metadata=metadata)
+            token = start("Write", data, labels)
+            future = self._write_raw.future(data, metadata=metadata)
+
+            def done(future):
+                if future.cancelled():
+                    instrumentation.rpc_end(token, "CANCELLED")
+                elif future.exception() is not None:
+                    instrumentation.rpc_end(token, future.code().name)
+                else:
+                    instrumentation.rpc_response(token, future.result())
+                    instrumentation.rpc_end(token, "OK")
+            future.add_done_callback(done)
+            return future
+
+        def _write_wait(self, future):
+            """@brief Internal Wait for a Write req sent by _write_async
+                @param future Future returned by _write_async
+                @return WriteResponse
+            """
             try:
-                return self.stub.Write(req, metadata=metadata)
+                return future.result()
             except grpc.RpcError as e:
                 raise BfruntimeReadWriteRpcException(e)
 
@@ -393,13 +501,52 @@ class ClientInterface:
                 @param metadata : optional metadata to send with write request
             """
             req.client_id = self.client_id
+            if self.p4_name and not req.p4_name:
+                req.p4_name = self.p4_name
+            instrumentation = self.instrumentation
+            token = None
+            if instrumentation is not None:
+                token = instrumentation.rpc_start("Read", req)
             try:
-                return self.stub.Read(req, metadata=metadata)
+                resp = self.stub.Read(req, metadata=metadata)
             except grpc.RpcError as e:
+                if token is not None:
+                    instrumentation.rpc_end(token, e.code().name)
                 raise BfruntimeReadWriteRpcException(e)
+            if token is None:
+                return resp
+            return self._read_instrumented(instrumentation, token, resp)
+
+        @staticmethod
+        def _read_instrumented(instrumentation, token, resp):
+            """@brief Internal Yield the ReadResponse msgs of resp, telling
+                instrumentation about each of them and about the end of the stream
+            """
+            code = "OK"
+            received = False
+            try:
+                for rep in resp:
+                    received = True
+                    instrumentation.rpc_response(token, rep)
+                    yield rep
+            except grpc.RpcError as e:
+                code = e.code().name
+                raise
+            except GeneratorExit:
+                # Reader stopped early, e.g. after the first entry of a
+                # single key read. Only an RPC without any answer yet counts
+                # as cancelled
+                if not resp.done():
+                    resp.cancel()
+                    if not received:
+                        code = "CANCELLED"
+                raise
+            finally:
+                instrumentation.rpc_end(token, code)
 
     def __init__(self, grpc_addr, client_id, device_id,
-            notifications=None, timeout=1, num_tries=5, perform_subscribe=True):
+            notifications=None, timeout=1, num_tries=5, perform_subscribe=True,
+            stream_queue_size=DEFAULT_STREAM_QUEUE_SIZE, channel=None):
         """@brief The ClientInterface object requires both of the endpoints' info like
             remote-switch address and self's client_id, device_id . Init will lay the
             groundwork to connect to a remote-switch like creating an insecure_channel
@@ -416,6 +563,11 @@ class ClientInterface:
             Default = 5
             @param perform_subscribe If the client wants to subscribe for
             notifications Default = True
+            @param stream_queue_size Max number of msgs kept per msg type received
+            on the stream. On overflow the oldest msg of that type is dropped and
+            counted, see stream_overflow_get. Default = DEFAULT_STREAM_QUEUE_SIZE
+            @param channel (optional) Existing grpc.Channel to use instead of creating
+            one, e.g. a channel shared with other clients. It is not closed by this object
             @param timeout Max timeout to wait for for subscribe message to succeed
             @exception RuntimeError If failed to subscribe within num_tries
         """
@@ -429,14 +581,20 @@ class ClientInterface:
         self.device_id = device_id
         self.stream = None
         gigabyte = 1024 ** 3
-        self.channel = grpc.insecure_channel(grpc_addr, options=[
-            ('grpc.max_send_message_length', gigabyte), (
-                'grpc.max_receive_message_length', gigabyte),
-                ('grpc.max_metadata_size', gigabyte)])
+        if channel is None:
+            channel = grpc.insecure_channel(grpc_addr, options=[
+                ('grpc.max_send_message_length', gigabyte), (
+                    'grpc.max_receive_message_length', gigabyte),
+                    ('grpc.max_metadata_size', gigabyte)])
+        self.channel = channel
 
         self.stub = bfruntime_pb2_grpc.BfRuntimeStub(self.channel)
-        self.reader_writer_interface = self._ReaderWriterInterface(self.stub, self.client_id)
+        self.reader_writer_interface = self._ReaderWriterInterface(self.stub, self.client_id, self.channel)
         self.stream_out_q = q.Queue()
+        # One queue per msg type so that a getter never has to skip over msgs of
+        # other types. stream_in_q only gets msgs of unknown types
+        self.stream_in_qs = {type_: q.Queue(stream_queue_size) for type_ in STREAM_MSG_TYPES}
+        self.stream_overflow = {type_: 0 for type_ in STREAM_MSG_TYPES}
         self.stream_in_q = q.Queue()
         self.exception_q = q.Queue()
         # Subscribe
@@ -475,12 +633,17 @@ class ClientInterface:
             raise BfruntimeForwardingRpcException(e)
         logger.info("Binding with p4_name %s successful!!", p4_name)
 
-    def bfrt_info_get(self, p4_name=None):
+    def bfrt_info_get(self, p4_name=None, schema_cache=None, lazy=False):
         """@brief Get bf-rt info json from the client as part of GetForwardingPipelineConfig
             and then parse it locally to create a _BfRtInfo object.
             @param p4_name Name of the P4 program this client wishes to get the bf-rt json for.
             If no p4_name is given, then this function returns a _BfRtInfo object made from the
             device's first current P4 program.
+            @param schema_cache (optional) Object with load(p4_name, p4_json, non_p4_json) and
+            store(p4_name, p4_json, non_p4_json, parsed_info). A cached BfRtInfoParser for the
+            same json is used instead of parsing it again.
+            @param lazy (optional) Parse tables and create their _Table objects only when they
+            are first looked up
             @return _BfRtInfo object.
             @exception RuntimeError On not receiving bf-rt-info.json when expecting it
         """
@@ -500,13 +663,25 @@ class ClientInterface:
             for config in msg.config:
                 logger.info("Received %s on GetForwarding on client %d, device %d", config.p4_name, req.client_id, req.device_id)
             if not p4_name:
-                return _BfRtInfo(msg.config[0].p4_name, msg.config[0].bfruntime_info, msg.non_p4_config.bfruntime_info, self.reader_writer_interface)
+                return self._bfrt_info_make(msg.config[0].p4_name, msg.config[0].bfruntime_info, msg.non_p4_config.bfruntime_info, schema_cache, lazy)
             for config in msg.config:
                 if (p4_name == config.p4_name):
-                    return _BfRtInfo(config.p4_name, config.bfruntime_info, msg.non_p4_config.bfruntime_info, self.reader_writer_interface)
+                    return self._bfrt_info_make(config.p4_name, config.bfruntime_info, msg.non_p4_config.bfruntime_info, schema_cache, lazy)
 
             raise RuntimeError("BF_RT_INFO not received")
 
+    def _bfrt_info_make(self, p4_name, p4_json_data, non_p4_json_data, schema_cache, lazy=False):
+        """@brief Internal. Create the _BfRtInfo, using and filling schema_cache if given
+        """
+        parsed_info = None
+        if schema_cache is not None:
+            parsed_info = schema_cache.load(p4_name, p4_json_data, non_p4_json_data)
+        bfrt_info = _BfRtInfo(p4_name, p4_json_data, non_p4_json_data, self.reader_writer_interface, parsed_info,
+                lazy)
+        if schema_cache is not None and parsed_info is None:
+            schema_cache.store(p4_name, p4_json_data, non_p4_json_data, bfrt_info.parsed_info)
+        return bfrt_info
+
     def get_packet_in(self, timeout=1):
         """@brief Not supported right now
         """
@@ -679,6 +854,25 @@ class ClientInterface:
             yield msg.digest
             msg = self._get_stream_message("digest", timeout)
 
+    def digest_get_batch(self, max_count, timeout=1):
+        """@brief Get up to max_count digests from the StreamChannel at once. Waits at most
+           timeout for the first one, then only takes the digests already received.
+           @param max_count Max number of DigestList msgs to return
+           @param timeout Timeout to wait for the first digest in seconds. default = 1
+           @return List of Digest in arrival order. Empty if timeout exceeds
+        """
+        msg = self._get_stream_message("digest", timeout)
+        if msg is None:
+            return []
+        digests = [msg.digest]
+        in_q = self.stream_in_qs["digest"]
+        try:
+            while len(digests) < max_count:
+                digests.append(in_q.get_nowait().digest)
+        except q.Empty:
+            pass
+        return digests
+
     def idletime_notification_get(self, timeout=1):
         """@brief Get an idletimeout notification from the StreamChannel
            @param timeout Timeout to wait for in seconds. default = 1
@@ -714,25 +908,43 @@ class ClientInterface:
         self.stream_recv_thread.join()
         self.is_independent = True
 
+    def stream_overflow_get(self):
+        """@brief Get the number of msgs dropped because their queue was full
+            @return dict msg type -> number of dropped msgs
+        """
+        return dict(self.stream_overflow)
+
     def _get_stream_message(self, type_, timeout=1):
-        """@brief Get a msg of a certain type from the in_queue
+        """@brief Get the oldest msg of a certain type from its in_queue
         """
-        start = time.time()
         try:
-            while True:
-                remaining = timeout - (time.time() - start)
-                if remaining < 0:
-                    break
-                msg = self.stream_in_q.get(timeout=remaining)
-                if not msg.HasField(type_):
-                    # Put the msg back in for someone else to read
-                    # TODO make separate queues for each msg type
-                    self.stream_in_q.put(msg)
-                    continue
-                return msg
-        except:  # timeout expired
-            pass
-        return None
+            return self.stream_in_qs[type_].get(timeout=max(timeout, 0))
+        except q.Empty:  # timeout expired
+            return None
+
+    def _put_stream_message(self, msg):
+        """@brief Internal. Put a received msg in the in_queue of its type. Called
+            only by the stream receive thread, which must never block: if the queue is
+            full its oldest msg is dropped
+        """
+        type_ = msg.WhichOneof("update")
+        in_q = self.stream_in_qs.get(type_)
+        if in_q is None:
+            self.stream_in_q.put(msg)
+            return
+        while True:
+            try:
+                in_q.put_nowait(msg)
+                return
+            except q.Full:
+                pass
+            try:
+                in_q.get_nowait()
+            except q.Empty:
+                continue
+            if self.stream_overflow[type_] == 0:
+                logger.warning("Stream queue for %s full, dropping oldest msgs", type_)
+            self.stream_overflow[type_] += 1
 
     def get_and_set_pipeline_config(self):
         req = bfruntime_pb2.GetForwardingPipelineConfigRequest()
@@ -798,7 +1010,7 @@ class ClientInterface:
         def _stream_recv(stream):
             try:
                 for p in stream:
-                    self.stream_in_q.put(p)
+                    self._put_stream_message(p)
             except grpc.RpcError as e:
                 self.exception_q.put(BfruntimeSubscribeRpcException(e))
 
@@ -2705,15 +2917,93 @@ class _Learn:
             data_list.append(self.get_parser._parse_data(data_entry, False))
         return data_list
 
+class _LazyTableDict(Mapping):
+    """@brief (Internal) Dictionary of table name -> _Table used by _BfRtInfo in lazy mode.
+        Every unique name of a table resolves through a name index (name -> fully qualified
+        name) built from the table names alone. The _TableInfo of a table is parsed and
+        its _Table object created the first time it is looked up.
+    """
+    def __init__(self, parsed_info, reader_writer_interface):
+        self.parsed_info = parsed_info
+        self.reader_writer_interface = reader_writer_interface
+        self.objs = {}
+        self.objs_lock = threading.Lock()
+        self.name_index = {}
+        names_to_remove = set()
+        for full_name in parsed_info.table_name_list_get():
+            for prospective_name in info_parse._generate_unique_names(full_name):
+                if prospective_name in self.name_index:
+                    names_to_remove.add(prospective_name)
+                else:
+                    self.name_index[prospective_name] = full_name
+        for name in names_to_remove:
+            self.name_index.pop(name, None)
+
+    def obj_get(self, full_name):
+        """@brief Get (creating it if needed) the _Table of a fully qualified name
+        """
+        obj = self.objs.get(full_name)
+        if obj is None:
+            table_info = self.parsed_info.table_info_get(full_name)
+            with self.objs_lock:
+                # Only one _Table per name, even if several threads look it up first
+                obj = self.objs.get(full_name)
+                if obj is None:
+                    obj = _Table(table_info, self.reader_writer_interface)
+                    self.objs[full_name] = obj
+        return obj
+
+    def __getitem__(self, name):
+        return self.obj_get(self.name_index[name])
+
+    def __contains__(self, name):
+        return name in self.name_index
+
+    def __iter__(self):
+        return iter(self.name_index)
+
+    def __len__(self):
+        return len(self.name_index)
+
+
+class _LazyTableIdDict(Mapping):
+    """@brief (Internal) Dictionary of table ID -> _Table on top of a _LazyTableDict
+    """
+    def __init__(self, table_dict):
+        self.table_dict = table_dict
+        self.id_index = {}
+        for full_name in table_dict.parsed_info.table_name_list_get():
+            self.id_index[table_dict.parsed_info.table_id_get(full_name)] = full_name
+
+    def __getitem__(self, obj_id):
+        return self.table_dict.obj_get(self.id_index[obj_id])
+
+    def __contains__(self, obj_id):
+        return obj_id in self.id_index
+
+    def __iter__(self):
+        return iter(self.id_index)
+
+    def __len__(self):
+        return len(self.id_index)
+
+
 class _BfRtInfo:
     """@brief Class _BfRtInfo (Partially internal). An object of this class is created when bfrt_info_get is called on the
         ClientInterface. It internally parses bf-rt.json and keeps _Table and _Learn objects inside which can
         be queried using table_get or learn_get. It wraps over class BfRtInfoParser and keeps an object
         of it internally
     """
-    def __init__(self, p4_name, p4_json_data, non_p4_json_data, reader_writer_interface):
-
-        self.parsed_info = info_parse.BfRtInfoParser(p4_json_data, non_p4_json_data)
+    def __init__(self, p4_name, p4_json_data, non_p4_json_data, reader_writer_interface, parsed_info=None,
+            lazy=False):
+        """@brief Parse the json data, unless an already parsed BfRtInfoParser of the same
+            json data is given in parsed_info (e.g. loaded from a schema cache)
+            @param lazy (optional) If True, tables are parsed and their _Table objects created
+            only when first looked up by table_get or table_from_id_get
+        """
+        if parsed_info is None:
+            parsed_info = info_parse.BfRtInfoParser(p4_json_data, non_p4_json_data, lazy=lazy)
+        self.parsed_info = parsed_info
         self.p4_name = p4_name
         self.table_dict = {}
         self.learn_dict = {}
@@ -2725,48 +3015,56 @@ class _BfRtInfo:
 
         self.reader_writer_interface = reader_writer_interface
 
-        _BfRtInfo._insert_objs_in_dict(
-                self.parsed_info.table_info_dict_get(),
-                self.table_dict,
-                self.reader_writer_interface,
-                True)
+        if lazy:
+            self.table_dict = _LazyTableDict(self.parsed_info, self.reader_writer_interface)
+            self.table_id_dict = _LazyTableIdDict(self.table_dict)
+        else:
+            _BfRtInfo._insert_objs_in_dict(
+                    self.parsed_info.table_info_dict_get(),
+                    self.table_dict,
+                    self.reader_writer_interface,
+                    True)
         _BfRtInfo._insert_objs_in_dict(
                 self.parsed_info.learn_info_dict_get(),
                 self.learn_dict,
                 self.reader_writer_interface,
                 False)
         # Create a map for tables and learn objects from id<->object too
-        _BfRtInfo._create_id_map(self.table_dict, self.table_id_dict)
+        if not lazy:
+            _BfRtInfo._create_id_map(self.table_dict, self.table_id_dict)
         _BfRtInfo._create_id_map(self.learn_dict, self.learn_id_dict)
 
         # Create a sorted table list which is primarily topologically sorted according
         # to depends_on of the table and secondarily sorted lexicographically.
         # So MAT would come first, then related ActSel and then ActProf.
         # If MAT1 and MAT2 are sharing same ActProf, then
-        # MAT1, MAT2, ActProf will be the order where MAT1< MAT2 lexicographically
+        # MAT1, MAT2, ActProf will be the order where MAT1< MAT2 lexicographically.
+        # Only names and IDs are needed, so this does not parse tables in lazy mode
+        table_names = self.parsed_info.table_name_list_get()
+        id_to_name = {self.parsed_info.table_id_get(name): name for name in table_names}
         self.table_list_sorted = _BfRtInfo._create_sorted_table_list(
-                sorted(list(self.parsed_info.table_info_dict_get().keys()), reverse=True),
-                self.table_dict,
-                self.table_id_dict)
+                sorted(table_names, reverse=True),
+                self.parsed_info.table_depends_on_get,
+                id_to_name)
 
     @staticmethod
-    def _create_sorted_table_list(table_names, table_dict, table_id_dict):
+    def _create_sorted_table_list(table_names, depends_on_get, id_to_name):
         """@brief Util func for recursively topological sorting
         """
-        def topo_sort_util(table_name, visited, stack, table_dict, table_id_dict):
+        def topo_sort_util(table_name, visited, stack):
             visited[table_name] = True
             # Recur for all tables that are dependent on this
-            for dep_id in table_dict[table_name].info.depends_on_get():
-                dep_table = table_id_dict[dep_id]
-                if visited[dep_table.info.name_get()] == False:
-                    topo_sort_util(dep_table.info.name_get(), visited, stack, table_dict, table_id_dict)
+            for dep_id in depends_on_get(table_name):
+                dep_name = id_to_name[dep_id]
+                if visited[dep_name] == False:
+                    topo_sort_util(dep_name, visited, stack)
             stack.append(table_name)
 
         visited = {table_name:False for table_name in table_names}
         stack = []
         for table_name in table_names:
             if visited[table_name] == False:
-                topo_sort_util(table_name, visited, stack, table_dict, table_id_dict)
+                topo_sort_util(table_name, visited, stack)
         return stack[::-1]
 
 
@@ -2776,10 +3074,7 @@ class _BfRtInfo:
     def key_from_idletime_notification(self, idletimeout_notification_message):
         entry = idletimeout_notification_message.table_entry
         table_id = entry.table_id
-        found_table = None
-        for name, table in self.table_dict.items():
-            if table.info.id_get() == table_id:
-                found_table = table
+        found_table = self.table_id_dict.get(table_id)
         if found_table is None:
             raise RuntimeError("%d table ID not found in bfrt info of %s" %(table_id, self.p4_name))
         return found_table.get_parser._parse_key(entry.key)
@@ -17,6 +17,7 @@
 
 import logging
 import json
+import threading
 
 logger = logging.getLogger('bfruntime_parse')
 logger.addHandler(logging.StreamHandler())
@@ -95,6 +96,47 @@ class _TableInfo:
         self.has_const_default_action = has_const_default_action
         self.depends_on = depends_on
 
+        # Reverse (id -> name) indexes used while decoding responses.
+        # Filled by _index_build once the key, action and data dicts are parsed
+        self.action_id_index = {}
+        self.key_id_index = {}
+        self.data_id_index = {}
+        self.action_data_id_index = {}
+        # (field_name, action_name) -> list of _DataInfo, filled by _data_field_get
+        self.data_field_cache = {}
+
+    @staticmethod
+    def _index_data_names(dict_to_index, index):
+        """@brief Adds id -> name of all fields of dict_to_index to index, including the
+            fields within containers. The first name found for an id is kept, in the same
+            order as a depth first search of the dictionaries
+        """
+        if dict_to_index is None:
+            return
+        for field_name_, data_ in list(dict_to_index.items()):
+            index.setdefault(data_.id, data_.name)
+        for field_name_, data_ in list(dict_to_index.items()):
+            _TableInfo._index_data_names(data_.container_dict, index)
+
+    def _index_build(self):
+        """@brief Build the id -> name indexes for actions, key fields and data fields.
+            The index of an action holds its own fields first and the common data
+            fields after them, the same search order as data_field_name_get
+        """
+        self.action_id_index = {action_.id: action_.name for action_ in self.action_dict.values()}
+        self.key_id_index = {}
+        for key_ in self.key_dict.values():
+            self.key_id_index.setdefault(key_.id, key_.name)
+        self.data_id_index = {}
+        _TableInfo._index_data_names(self.data_dict, self.data_id_index)
+        self.action_data_id_index = {}
+        for action_name_, action_ in list(self.action_dict.items()):
+            index = {}
+            _TableInfo._index_data_names(action_.data_dict, index)
+            for field_id, field_name in list(self.data_id_index.items()):
+                index.setdefault(field_id, field_name)
+            self.action_data_id_index[action_name_] = index
+
     def id_get(self):
         """@brief Get Table ID
             @return Table ID
@@ -173,10 +215,10 @@ class _TableInfo:
             @return Action name
             @exception KeyError on Not finding the action ID
         """
-        for action_name_, action_ in list(self.action_dict.items()):
-            if action_id == action_.id:
-                return action_.name
-        raise KeyError("Action ID %n doesn't exist" %(action_id))
+        try:
+            return self.action_id_index[action_id]
+        except KeyError:
+            raise KeyError("Action ID %d doesn't exist" %(action_id))
 
     def data_field_name_get(self, field_id, action_name=None):
         """@brief Get Data Field name from field ID.
@@ -187,28 +229,14 @@ class _TableInfo:
             @return Field name
             @exception KeyError on Not finding the field ID
         """
-        def _data_field_name_get_helper(dict_to_search, field_id, ret_list):
-            if dict_to_search is None:
-                return False
-            for field_name_, data_ in list(dict_to_search.items()):
-                if data_.id == field_id:
-                    ret_list.append(data_.name)
-                    return True
-            found = False
-            for field_name_, field_ in list(dict_to_search.items()):
-                found |= _data_field_name_get_helper(field_.container_dict, field_id, ret_list)
-            return found
-
-        ret_list = []
         if action_name is not None:
-            found = _data_field_name_get_helper(
-                    self.action_dict[self.action_dict_allname[action_name]].data_dict,
-                    field_id, ret_list)
-            if found:
-                return ret_list[0]
-        found = _data_field_name_get_helper(self.data_dict, field_id, ret_list)
-        if found:
-            return ret_list[0]
+            index = self.action_data_id_index[self.action_dict_allname[action_name]]
+        else:
+            index = self.data_id_index
+        try:
+            return index[field_id]
+        except KeyError:
+            pass
         # Error 404
         if (action_name):
             raise KeyError("Failed to find field %d for action %s in table %s"
@@ -219,7 +247,20 @@ class _TableInfo:
 
     def _data_field_get(self, field_name, action_name=None):
         """@brief returns all fields which satisfy field and action name in a
-            list. This is to facilitate duplicate fields in a container scenario
+            list. This is to facilitate duplicate fields in a container scenario.
+            Results are memoized per (field_name, action_name) since make_data
+            looks up every field of every decoded entry several times
+        """
+        try:
+            return self.data_field_cache[(field_name, action_name)]
+        except KeyError:
+            pass
+        field_list = self._data_field_search(field_name, action_name)
+        self.data_field_cache[(field_name, action_name)] = field_list
+        return field_list
+
+    def _data_field_search(self, field_name, action_name=None):
+        """@brief Uncached search behind _data_field_get
         """
         def _data_field_get_helper(dict_to_search, name_dict_to_search, field_name):
             ret_list = []
@@ -458,10 +499,10 @@ class _TableInfo:
             @return Field Name
             @exception KeyError on Not finding the field
         """
-        for field_name_, key_ in list(self.key_dict.items()):
-            if key_.id == field_id:
-                return key_.name
-        raise KeyError("Failed to find %d as key in table %s" % (field_id, self.name))
+        try:
+            return self.key_id_index[field_id]
+        except KeyError:
+            raise KeyError("Failed to find %d as key in table %s" % (field_id, self.name))
 
     def key_field_annotations_get(self, field_name):
         """@brief Get Field annotations
@@ -526,6 +567,15 @@ class _LearnInfo:
         self.id = learn_id
         self.name = learn_name
         self.annotations = annotations
+        # Reverse (id -> name) index of the data fields. Filled by _index_build
+        self.data_id_index = {}
+
+    def _index_build(self):
+        """@brief Build the id -> name index of the data fields
+        """
+        self.data_id_index = {}
+        for data_ in self.data_dict.values():
+            self.data_id_index.setdefault(data_.id, data_.name)
 
     def name_get(self):
         """@brief Get the name of the Learn Object
@@ -545,10 +595,10 @@ class _LearnInfo:
             @return Field name
             @exception KeyError on Not finding the field ID
         """
-        for field_name_, data_ in list(self.data_dict.items()):
-            if data_.id == field_id:
-                return data_.name
-        raise KeyError("Field %d not found in learn obj %s"%(field_id, self.name_get()))
+        try:
+            return self.data_id_index[field_id]
+        except KeyError:
+            raise KeyError("Field %d not found in learn obj %s"%(field_id, self.name_get()))
 
     def _data_field_metadata_get(self, metadata, field_name):
         field = self.data_dict[self.data_dict_allname[field_name]]
@@ -703,25 +753,44 @@ class BfRtInfoParser:
     """@brief Parse bf-rt.json. This object keeps metadata for tables and learn objects as _TableInfo
         and _LearnInfo objects.
     """
-    def __init__(self, p4_json_data, non_p4_json_data):
+    def __init__(self, p4_json_data, non_p4_json_data, lazy=False):
+        """@brief Parse the bf-rt json documents.
+            @param lazy (optional) If True, tables are only parsed into _TableInfo objects
+            when first requested through table_info_get
+        """
         self.table_info_dict = {}
         self.learn_info_dict = {}
+        # json of every table in lazy mode, parsed or not. Entries are never
+        # removed, so lookups racing with a parse still find them
+        self.table_json_dict = {}
+        # Serializes the parsing of lazy tables
+        self._lock = threading.Lock()
 
         # parse tables
         bfrtinfo_json = json.loads(p4_json_data.decode('utf-8'))
         non_p4_json = json.loads(non_p4_json_data.decode('utf-8'))
-        for table_json in bfrtinfo_json["tables"]:
-            self.table_info_dict[table_json["name"]] = BfRtInfoParser._parse_table(table_json)
-        for table_json in non_p4_json["tables"]:
-            self.table_info_dict[table_json["name"]] = BfRtInfoParser._parse_table(table_json)
+        for table_json in bfrtinfo_json["tables"] + non_p4_json["tables"]:
+            if lazy:
+                self.table_json_dict[table_json["name"]] = table_json
+            else:
+                self.table_info_dict[table_json["name"]] = BfRtInfoParser._parse_table(table_json)
         # parse learn
         if "learn_filters" in bfrtinfo_json:
             for learn_json in bfrtinfo_json["learn_filters"]:
                 self.learn_info_dict[learn_json["name"]] = BfRtInfoParser._parse_learn(learn_json)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
     def __str__(self):
         msg = "TABLES->\n"
-        for table_name, table in list(self.table_info_dict.items()):
+        for table_name, table in list(self.table_info_dict_get().items()):
             msg += table_name + ":" + str(table.id) + "\n"
             msg += "\tKEYS->\n"
             for key_name, key in list(table.key_dict.items()):
@@ -745,10 +814,54 @@ class BfRtInfoParser:
         return msg
 
     def table_info_dict_get(self):
-        """@brief Returns the table info dictionary
+        """@brief Returns the table info dictionary. In lazy mode this parses all
+            the tables not parsed yet
         """
+        for table_name in list(self.table_json_dict.keys()):
+            self.table_info_get(table_name)
         return self.table_info_dict
 
+    def table_info_get(self, table_name):
+        """@brief Returns the _TableInfo of a table, parsing it first in lazy mode
+            @param table_name Fully qualified table name
+            @exception KeyError on unknown table name
+        """
+        try:
+            return self.table_info_dict[table_name]
+        except KeyError:
+            pass
+        table_json = self.table_json_dict.get(table_name)
+        if table_json is None:
+            raise KeyError(table_name)
+        with self._lock:
+            # Another thread may have parsed it while this one waited
+            table_info = self.table_info_dict.get(table_name)
+            if table_info is None:
+                table_info = BfRtInfoParser._parse_table(table_json)
+                self.table_info_dict[table_name] = table_info
+        return table_info
+
+    def table_name_list_get(self):
+        """@brief Returns the fully qualified names of all the tables, parsed or not
+        """
+        if self.table_json_dict:
+            return list(self.table_json_dict.keys())
+        return list(self.table_info_dict.keys())
+
+    def table_id_get(self, table_name):
+        """@brief Returns the ID of a table without parsing it
+        """
+        if table_name in self.table_info_dict:
+            return self.table_info_dict[table_name].id_get()
+        return self.table_json_dict[table_name]["id"]
+
+    def table_depends_on_get(self, table_name):
+        """@brief Returns the depends_on list of a table without parsing it
+        """
+        if table_name in self.table_info_dict:
+            return self.table_info_dict[table_name].depends_on_get()
+        return self.table_json_dict[table_name].get("depends_on", [])
+
     def learn_info_dict_get(self):
         """@brief Returns the Learn Object info dictionary
         """
@@ -786,6 +899,7 @@ class BfRtInfoParser:
         for data_json in table_json["data"]:
             BfRtInfoParser._parse_data_helper(table_info.data_dict, data_json)
         _create_allname_dict(table_info.data_dict_allname, table_info.data_dict)
+        table_info._index_build()
         return table_info
 
     @staticmethod
@@ -876,6 +990,7 @@ class BfRtInfoParser:
         for data_json in learn_json["fields"]:
             BfRtInfoParser._parse_data_helper(learn_info.data_dict, data_json)
         _create_allname_dict(learn_info.data_dict_allname, learn_info.data_dict)
+        learn_info._index_build()
         return learn_info
 
     @staticmethod
@@ -0,0 +1,326 @@
+# bfrt_controller/bulk.py
+
+"""
+bulk.py
+
+Chunked, pipelined bulk writes for BFRT tables.
+
+Instead of building one WriteRequest for the whole entry list, the BulkWriter splits
+the entries into chunks and encodes chunk N+1 while chunk N is in flight on the gRPC
+channel. Every chunk reports its size, encode time and round-trip latency so large
+loads show progress and throughput as they stream.
+
+In upsert mode every chunk is sent as INSERT with the ("error_in_resp", "1") metadata,
+so the server reports a status per update instead of failing the whole RPC. Only the
+entries that came back as ALREADY_EXISTS are then re-sent as MODIFY, which makes
+re-provisioning an existing table cost one round trip plus a small delta.
+"""
+
+import asyncio
+import time
+from collections import deque, namedtuple
+from itertools import islice
+
+import google.rpc.code_pb2 as code_pb2
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+from bfrt_controller.bfrt_grpc import client as gc
+
+from .logger import log
+
+DEFAULT_CHUNK_SIZE = 1000
+
+ERROR_IN_RESP = ("error_in_resp", "1")
+
+# Per-chunk report handed to the on_chunk callback. modified is the number of
+# entries of the chunk that were re-sent as MODIFY in upsert mode.
+ChunkStats = namedtuple("ChunkStats", ["index", "entries", "request_bytes", "encode_s", "latency_s", "modified"])
+
+
+class BulkWriteResult:
+    """Summary of a bulk write: per-chunk stats plus totals."""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.chunks = []
+        self.entries = 0
+        self.modified = 0
+        self.request_bytes = 0
+        self.elapsed_s = 0.0
+
+    def add_chunk(self, stats):
+        self.chunks.append(stats)
+        self.entries += stats.entries
+        self.modified += stats.modified
+        self.request_bytes += stats.request_bytes
+
+    @property
+    def entries_per_s(self):
+        return self.entries / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def __str__(self):
+        return "{}: {} entries ({} modified) in {} chunks, {:.3f}s ({:.0f} entries/s, {:.1f} MB)".format(
+            self.table_name, self.entries, self.modified, len(self.chunks), self.elapsed_s,
+            self.entries_per_s, self.request_bytes / 1e6)
+
+
+class EntryTupleEncoder:
+    """Encodes program_table style entries: (key tuples, action name, data tuples)."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def encode(self, req, chunk, update_type):
+        table = self.table
+        key_list = []
+        data_list = []
+        for k, a, d in chunk:
+            key_list.append(table.make_key([gc.KeyTuple(*f) for f in k]))
+            data_list.append(table.make_data([gc.DataTuple(*p) for p in d], a))
+        return table._entry_write_req_make(req, key_list, data_list, update_type)
+
+
+class KeyDataEncoder:
+    """Encodes already built (_Key, _Data) pairs. _Data may be None, e.g. for deletes."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def encode(self, req, chunk, update_type):
+        key_list = [k for k, _ in chunk]
+        data_list = [d for _, d in chunk]
+        if all(d is None for d in data_list):
+            data_list = None
+        return self.table._entry_write_req_make(req, key_list, data_list, update_type)
+
+
+class BulkWriter:
+    """Writes a (possibly very large) stream of entries to one table in chunks.
+
+    Keyword arguments:
+        table -- _Table object to write to
+        target -- gc.Target
+        chunk_size -- number of entries per WriteRequest
+        encoder -- object with encode(req, chunk, update_type); defaults to EntryTupleEncoder
+        on_chunk -- optional callback called with a ChunkStats after each chunk completes
+        max_in_flight -- number of requests allowed on the wire while the next one is encoded
+        metadata -- optional gRPC metadata sent with every request
+    """
+
+    def __init__(self, table, target, chunk_size=DEFAULT_CHUNK_SIZE, encoder=None, on_chunk=None,
+                 max_in_flight=1, metadata=None):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be >= 1")
+        self.table = table
+        self.target = target
+        self.chunk_size = chunk_size
+        self.encoder = encoder if encoder is not None else EntryTupleEncoder(table)
+        self.on_chunk = on_chunk
+        self.max_in_flight = max(1, max_in_flight)
+        self.metadata = metadata
+        self.rw = table.reader_writer_interface
+
+    def _new_request(self):
+        req = bfruntime_pb2.WriteRequest()
+        gc._cpy_target(req, self.target)
+        req.atomicity = bfruntime_pb2.WriteRequest.CONTINUE_ON_ERROR
+        return req
+
+    def _chunks(self, entries):
+        it = iter(entries)
+        while True:
+            chunk = list(islice(it, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _metadata(self, upsert):
+        if not upsert:
+            return self.metadata
+        metadata = tuple(self.metadata or ())
+        if ERROR_IN_RESP not in metadata:
+            metadata += (ERROR_IN_RESP,)
+        return metadata
+
+    def _as_modify(self, req, indexes):
+        """Copy the given updates of a request, turned into MODIFY."""
+        mod_req = self._new_request()
+        for idx in indexes:
+            mod_update = mod_req.updates.add()
+            mod_update.CopyFrom(req.updates[idx])
+            mod_update.type = bfruntime_pb2.Update.MODIFY
+            self.table._set_flags(mod_update.entity.table_entry, {"reset_ttl": True})
+        return mod_req
+
+    @staticmethod
+    def _failed_updates(resp, exc):
+        """List of (idx, p4_error) for the failed updates of a chunk. The errors
+        come either from WriteResponse.status (error_in_resp honoured) or from the
+        binary details of the gRPC error (older servers ignoring it).
+        """
+        if exc is not None:
+            return list(exc.sub_errors_get())
+        return [(idx, error) for idx, error in enumerate(resp.status)
+                if error.canonical_code != code_pb2.OK]
+
+    def _upsert_split(self, resp, exc, offset):
+        """Splits the failed updates of a chunk into the indexes of the entries which
+        already existed and (entry index, p4_error) for the other failures.
+        """
+        failed = self._failed_updates(resp, exc)
+        if exc is not None and not failed:
+            raise exc
+        exists = [idx for idx, error in failed if error.canonical_code == code_pb2.ALREADY_EXISTS]
+        others = [(offset + idx, error) for idx, error in failed
+                  if error.canonical_code != code_pb2.ALREADY_EXISTS]
+        return exists, others
+
+    @staticmethod
+    def _upsert_check(exists, others, mod_resp, offset):
+        """Raises for the failed updates left after the MODIFY of existing entries.
+
+        Returns:
+            number of entries modified
+        """
+        if mod_resp is not None:
+            for mod_idx, error in enumerate(mod_resp.status):
+                if error.canonical_code != code_pb2.OK:
+                    others.append((offset + exists[mod_idx], error))
+        if others:
+            e = gc.BfruntimeErrorInResponseException([])
+            e.errors = sorted(others, key=lambda x: x[0])
+            raise e
+        return len(exists)
+
+    def _upsert_delta(self, req, resp, exc, offset):
+        """Re-send only the entries which already existed as MODIFY.
+
+        Returns:
+            number of entries modified
+        """
+        exists, others = self._upsert_split(resp, exc, offset)
+        mod_resp = None
+        if exists:
+            mod_resp = self.rw._write(self._as_modify(req, exists), self._metadata(True))
+        return self._upsert_check(exists, others, mod_resp, offset)
+
+    def _finish(self, pending, result, upsert):
+        index, offset, req, future, n, encode_s, sent_at = pending
+        modified = 0
+        if upsert:
+            resp = exc = None
+            try:
+                resp = self.rw._write_wait(future)
+            except gc.BfruntimeReadWriteRpcException as e:
+                exc = e
+            if exc is not None or self.table.get_parser._status_has_error(resp.status):
+                modified = self._upsert_delta(req, resp, exc, offset)
+        else:
+            resp = self.rw._write_wait(future)
+            self.table.get_parser._parse_entry_write_response(resp, metadata=self.metadata)
+        self._chunk_done(result, index, n, req.ByteSize(), encode_s, sent_at, modified)
+
+    def _chunk_done(self, result, index, n, request_bytes, encode_s, sent_at, modified):
+        stats = ChunkStats(index, n, request_bytes, encode_s, time.perf_counter() - sent_at, modified)
+        result.add_chunk(stats)
+        log.debug("{} chunk {}: {} entries, {} bytes, encode {:.4f}s, rpc {:.4f}s ({:.0f} entries/s)".format(
+            self.table.info.name_get(), index, n, stats.request_bytes, encode_s, stats.latency_s,
+            n / stats.latency_s if stats.latency_s > 0 else 0.0))
+        if self.on_chunk is not None:
+            self.on_chunk(stats)
+
+    def write(self, entries, update_type=bfruntime_pb2.Update.INSERT, upsert=False):
+        """Write entries in pipelined chunks.
+
+        Keyword arguments:
+            entries -- iterable of entries understood by the encoder
+            update_type -- bfruntime_pb2.Update type (INSERT, MODIFY, DELETE)
+            upsert -- insert the entries, modifying only those which already exist.
+                      Forces update_type to INSERT.
+
+        Returns:
+            BulkWriteResult
+
+        Raises:
+            BfruntimeErrorInResponseException in upsert mode, holding (entry index, p4_error)
+            for every entry that failed for a reason other than already existing
+        """
+        if upsert:
+            update_type = bfruntime_pb2.Update.INSERT
+        metadata = self._metadata(upsert)
+        result = BulkWriteResult(self.table.info.name_get())
+        in_flight = deque()
+        offset = 0
+        start = time.perf_counter()
+        for index, chunk in enumerate(self._chunks(entries)):
+            t0 = time.perf_counter()
+            req = self.encoder.encode(self._new_request(), chunk, update_type)
+            encode_s = time.perf_counter() - t0
+            # Chunk N was sent before chunk N+1 was encoded; only now wait for it
+            while len(in_flight) >= self.max_in_flight:
+                self._finish(in_flight.popleft(), result, upsert)
+            future = self.rw._write_async(req, metadata)
+            in_flight.append((index, offset, req, future, len(chunk), encode_s, time.perf_counter()))
+            offset += len(chunk)
+        while in_flight:
+            self._finish(in_flight.popleft(), result, upsert)
+        result.elapsed_s = time.perf_counter() - start
+        log.debug(str(result))
+        return result
+
+
+class AsyncBulkWriter(BulkWriter):
+    """BulkWriter for tables of an AsyncClientInterface. write() is a coroutine and up to
+    max_in_flight chunks are outstanding on the channel while the next one is encoded.
+    """
+
+    async def _upsert_delta(self, req, resp, exc, offset):
+        exists, others = self._upsert_split(resp, exc, offset)
+        mod_resp = None
+        if exists:
+            mod_resp = await self.rw._write(self._as_modify(req, exists), self._metadata(True))
+        return self._upsert_check(exists, others, mod_resp, offset)
+
+    async def _finish(self, pending, result, upsert):
+        index, offset, req, task, n, encode_s, sent_at = pending
+        modified = 0
+        if upsert:
+            resp = exc = None
+            try:
+                resp = await task
+            except gc.BfruntimeReadWriteRpcException as e:
+                exc = e
+            if exc is not None or self.table.get_parser._status_has_error(resp.status):
+                modified = await self._upsert_delta(req, resp, exc, offset)
+        else:
+            resp = await task
+            self.table.get_parser._parse_entry_write_response(resp, metadata=self.metadata)
+        self._chunk_done(result, index, n, req.ByteSize(), encode_s, sent_at, modified)
+
+    async def write(self, entries, update_type=bfruntime_pb2.Update.INSERT, upsert=False):
+        """Coroutine version of BulkWriter.write."""
+        if upsert:
+            update_type = bfruntime_pb2.Update.INSERT
+        metadata = self._metadata(upsert)
+        result = BulkWriteResult(self.table.info.name_get())
+        in_flight = deque()
+        offset = 0
+        start = time.perf_counter()
+        try:
+            for index, chunk in enumerate(self._chunks(entries)):
+                t0 = time.perf_counter()
+                req = self.encoder.encode(self._new_request(), chunk, update_type)
+                encode_s = time.perf_counter() - t0
+                while len(in_flight) >= self.max_in_flight:
+                    await self._finish(in_flight.popleft(), result, upsert)
+                task = asyncio.ensure_future(self.rw._write(req, metadata))
+                in_flight.append((index, offset, req, task, len(chunk), encode_s, time.perf_counter()))
+                offset += len(chunk)
+            while in_flight:
+                await self._finish(in_flight.popleft(), result, upsert)
+        finally:
+            for pending in in_flight:
+                pending[3].cancel()
+        result.elapsed_s = time.perf_counter() - start
+        log.debug(str(result))
+        return result
@@ -0,0 +1,420 @@
+# bfrt_controller/columns.py
+
+"""
+columns.py
+
+Column-oriented bulk writes: table entries given as one NumPy array (or DataFrame
+column) per field instead of one Python tuple per entry.
+
+Every column is validated once with vectorized range checks against the bit width of
+its field and converted to a (rows, size) matrix of big-endian bytes. Since every
+entry of such a write has the same fields and every field a fixed size, the
+serialized Update of every entry has the same length and the same bytes at the same
+positions, except for the field values. TableColumns therefore builds the protobuf
+wire format of a chunk as a 2D uint8 array, one row per Update: the tags, lengths
+and ids are written once per column of the array and the values are copied from the
+column matrices. The resulting bytes are sent as an already serialized WriteRequest,
+without building a single protobuf message per entry, which is what limits
+program_table and even EntryLayout to a few thousand entries per second with the
+pure Python protobuf runtime.
+
+Key values are given as an array for Exact match fields and as a pair of arrays for
+the other match types: (value, mask), (value, prefix_len), (low, high) or
+(value, is_valid). Any array may be a scalar, which is used for every entry. Since a
+DataFrame column holds a single array, the second array of a pair can also be given
+as its own column named <field>__mask, <field>__prefix_len, <field>__high or
+<field>__is_valid, next to the <field> column holding the value (the low bound of
+Range fields).
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+from bfrt_controller.bfrt_grpc import client as gc
+
+from .bulk import BulkWriter, BulkWriteResult, DEFAULT_CHUNK_SIZE
+from .encoder import INT_TYPES, KeyFieldEncoder, field_converter
+from .logger import log
+
+# Protobuf wire types
+VARINT = 0
+LEN = 2
+
+# Field numbers of the messages written by TableColumns (bfruntime.proto)
+WRITE_REQUEST_UPDATES = 3
+UPDATE_TYPE, UPDATE_ENTITY = 1, 2
+ENTITY_TABLE_ENTRY = 1
+ENTRY_TABLE_ID, ENTRY_KEY, ENTRY_DATA, ENTRY_FLAGS = 1, 2, 3, 9
+KEY_FIELDS = 1
+KEY_FIELD_ID = 1
+KEY_FIELD_MATCH = {"Exact": 2, "Ternary": 3, "LPM": 4, "Range": 5, "Optional": 6}
+DATA_ACTION_ID, DATA_FIELDS = 1, 2
+DATA_FIELD_ID, DATA_FIELD_STREAM, DATA_FIELD_BOOL = 1, 2, 8
+FLAGS_RESET_TTL = 4
+
+# Suffix of the column holding the second value of a non Exact match key field
+KEY_PART_COLUMNS = {"Ternary": "mask", "LPM": "prefix_len", "Range": "high", "Optional": "is_valid"}
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _tag(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _width(part):
+    return len(part) if isinstance(part, bytes) else part.shape[1]
+
+
+def _msg(field, parts):
+    """Parts of a length delimited field holding the given parts."""
+    return [_tag(field, LEN) + _varint(sum(_width(p) for p in parts))] + parts
+
+
+def _bytes_field(field, column):
+    return _msg(field, [column])
+
+
+def _check_rows(arr, n, name):
+    if arr.ndim > 1 or (arr.ndim == 1 and len(arr) != n):
+        raise ValueError("Field {}: expected {} values, got shape {}".format(name, n, arr.shape))
+
+
+def _varint_column(values, n, name, limit):
+    """Column of integers in [0, limit] as a (n, width) varint matrix. Values below 128
+    take one byte; otherwise every value is padded to the same number of bytes with
+    continuation bits, which protobuf parsers accept.
+    """
+    values = np.asarray(values)
+    _check_rows(values, n, name)
+    values = np.atleast_1d(values)
+    if values.dtype.kind not in "iub":
+        raise ValueError("Field {}: expected integers, got {} values".format(name, values.dtype))
+    values = values.astype(np.int64)
+    if values.size and (values.min() < 0 or values.max() > limit):
+        row = int(np.flatnonzero((values < 0) | (values > limit))[0])
+        raise ValueError("Field {}: value {} at row {} is not in [0, {}]".format(name, values[row], row, limit))
+    width = 1
+    while values.size and int(values.max()) >> (7 * width):
+        width += 1
+    out = np.empty((len(values), width), dtype=np.uint8)
+    for i in range(width):
+        out[:, i] = (values >> (7 * i)) & 0x7F
+    out[:, :-1] |= 0x80
+    return np.broadcast_to(out, (n, width))
+
+
+def _byte_column(values, n, name, size, bits, annotations):
+    """Validated (n, size) uint8 matrix of the big-endian values of one field."""
+    arr = np.asarray(values)
+    if arr.ndim == 0:
+        value = field_converter(name, size, annotations)(arr.item())
+        if bits < size * 8 and value[0] >> (bits % 8):
+            raise ValueError("Field {}: value {!r} does not fit in {} bits".format(name, arr.item(), bits))
+        return np.broadcast_to(np.frombuffer(value, dtype=np.uint8), (n, size))
+    _check_rows(arr, n, name)
+
+    if arr.dtype.kind in "iub":
+        if arr.dtype.kind == "b":
+            arr = arr.astype(np.uint8)
+        if n and (arr.min() < 0 or (bits < 64 and int(arr.max()) >> bits)):
+            bad = (arr < 0) | ((arr >> bits) != 0 if bits < 64 else False)
+            row = int(np.flatnonzero(bad)[0])
+            raise ValueError("Field {}: value {} at row {} does not fit in {} bits".format(name, arr[row], row, bits))
+        octets = arr.astype(">u8").view(np.uint8).reshape(n, 8)
+        if size <= 8:
+            return octets[:, 8 - size:]
+        out = np.zeros((n, size), dtype=np.uint8)
+        out[:, size - 8:] = octets
+        return out
+
+    if arr.dtype.kind == "S" and arr.dtype.itemsize == size:
+        out = np.frombuffer(arr.tobytes(), dtype=np.uint8).reshape(n, size)
+    elif arr.dtype.kind in "OUS":
+        # Annotated strings (ipv4, mac, ...), Python ints wider than 64 bits, bytes
+        convert = field_converter(name, size, annotations)
+        out = np.frombuffer(b"".join(convert(v.item() if isinstance(v, np.generic) else v) for v in arr),
+                            dtype=np.uint8).reshape(n, size)
+    else:
+        raise ValueError("Field {}: {} values are not supported".format(name, arr.dtype))
+    if bits < size * 8:
+        bad = out[:, 0] >> (bits % 8)
+        if bad.any():
+            row = int(np.flatnonzero(bad)[0])
+            raise ValueError("Field {}: value {!r} at row {} does not fit in {} bits".format(name, arr[row], row, bits))
+    return out
+
+
+def _bool_column(values, n, name):
+    arr = np.asarray(values)
+    _check_rows(arr, n, name)
+    if arr.dtype.kind not in "iub":
+        raise ValueError("Field {}: expected booleans, got {} values".format(name, arr.dtype))
+    return np.broadcast_to((arr != 0).astype(np.uint8).reshape(-1, 1), (n, 1))
+
+
+def _items(columns):
+    """(name, values) pairs of a dict, a pandas DataFrame or any object with items()."""
+    if columns is None:
+        return []
+    return [(name, values) for name, values in columns.items()]
+
+
+def _key_columns(info, key_items):
+    """(name, values) pairs of the key fields, with the <field>__<part> columns of non
+    Exact match fields joined to the <field> column as (values, part values).
+    """
+    columns = dict(key_items)
+    paired = set()
+    out = []
+    for name, values in key_items:
+        if name not in info.key_dict_allname:
+            continue
+        part = KEY_PART_COLUMNS.get(info.key_dict[info.key_dict_allname[name]].match_type)
+        part_name = "{}__{}".format(name, part)
+        if part is not None and part_name in columns:
+            if isinstance(values, tuple):
+                raise ValueError("Key field {} is given both as a pair and with a {} column".format(name, part_name))
+            values = (values, columns[part_name])
+            paired.add(part_name)
+        out.append((name, values))
+    for name, _ in key_items:
+        if name not in info.key_dict_allname and name not in paired:
+            raise KeyError(name)
+    return out
+
+
+def _rows(values):
+    """Number of values of a column, or None for a scalar."""
+    return len(values) if np.ndim(values) else None
+
+
+class TableColumns:
+    """Columns of one table write, validated at construction and encoded to the
+    protobuf wire format a chunk of rows at a time.
+
+    Keyword arguments:
+        table_info -- _TableInfo of the table
+        keys -- dict (or DataFrame) of key field name -> values; pairs of values for
+                non Exact match fields, or the second values of the pairs in
+                <field>__mask, __prefix_len, __high or __is_valid columns
+        action -- action name, or None for tables without actions
+        data -- dict (or DataFrame) of data field name -> values
+
+    Attributes:
+        rows -- number of entries
+
+    Raises:
+        KeyError on unknown field or action names
+        ValueError if a field is duplicated, a mandatory key field is missing, a field
+        type is not supported (integer, bytes and bool fields are), the columns differ
+        in length or a value does not fit in its field
+    """
+
+    def __init__(self, table_info, keys, action=None, data=None):
+        self.info = table_info
+        self.table_id = table_info.id_get()
+        info = table_info
+        key_items = _key_columns(info, _items(keys))
+        data_items = _items(data)
+
+        key_infos = [info.key_dict[info.key_dict_allname[name]] for name, _ in key_items]
+        names = set(k.name for k in key_infos)
+        if len(names) != len(key_infos):
+            raise ValueError("Duplicate key field in {}".format([name for name, _ in key_items]))
+        for name, key_info in info.key_dict.items():
+            if key_info.mandatory and name not in names:
+                raise ValueError("%s is mandatory and needs to be in input_list" % name)
+        key_encoders = [KeyFieldEncoder(k) for k in key_infos]
+
+        columns = [v for _, v in data_items]
+        for enc, (_, values) in zip(key_encoders, key_items):
+            if enc.match_type == "Exact":
+                columns.append(values)
+            elif not isinstance(values, tuple) or len(values) != 2:
+                raise ValueError("Key field {} is a {} match field: pass a pair of values or a {}__{} column".format(
+                    enc.name, enc.match_type, enc.name, KEY_PART_COLUMNS[enc.match_type]))
+            else:
+                columns.extend(values)
+        counts = set(c for c in map(_rows, columns) if c is not None)
+        if len(counts) > 1:
+            raise ValueError("Columns of different lengths: {}".format(sorted(counts)))
+        if not counts:
+            raise ValueError("At least one column must be an array")
+        self.rows = n = counts.pop()
+
+        key_parts = []
+        for enc, key_info, (_, values) in zip(key_encoders, key_infos, key_items):
+            key_parts += _msg(KEY_FIELDS, self._key_field(enc, key_info, values, n))
+
+        data_parts = []
+        if action is not None:
+            data_parts.append(_tag(DATA_ACTION_ID, VARINT) + _varint(info.action_id_get(action)))
+        field_ids = set()
+        for name, values in data_items:
+            data_info = info._data_field_get(name, action)[0]
+            if data_info.id in field_ids:
+                raise ValueError("Duplicate data field in {}".format([name for name, _ in data_items]))
+            field_ids.add(data_info.id)
+            data_parts += _msg(DATA_FIELDS, self._data_field(data_info, values, n))
+
+        self._entry_parts = [_tag(ENTRY_TABLE_ID, VARINT) + _varint(self.table_id)] + _msg(ENTRY_KEY, key_parts)
+        if data_parts:
+            self._entry_parts += _msg(ENTRY_DATA, data_parts)
+        self._templates = {}
+
+    @staticmethod
+    def _key_field(enc, key_info, values, n):
+        name, size, bits = enc.name, key_info.size[0], enc.bits
+        annotations = key_info.annotations
+        if enc.match_type == "Exact":
+            match = _bytes_field(1, _byte_column(values, n, name, size, bits, annotations))
+        elif enc.match_type == "LPM":
+            prefix = _varint_column(values[1], n, name + " prefix_len", bits)
+            match = _bytes_field(1, _byte_column(values[0], n, name, size, bits, annotations)) + \
+                [_tag(2, VARINT), prefix]
+        elif enc.match_type == "Optional":
+            match = _bytes_field(1, _byte_column(values[0], n, name, size, bits, annotations)) + \
+                [_tag(2, VARINT), _bool_column(values[1], n, name + " is_valid")]
+        else:
+            # Ternary (value, mask) and Range (low, high)
+            match = _bytes_field(1, _byte_column(values[0], n, name, size, bits, annotations)) + \
+                _bytes_field(2, _byte_column(values[1], n, name, size, bits, annotations))
+        return [_tag(KEY_FIELD_ID, VARINT) + _varint(enc.id)] + _msg(KEY_FIELD_MATCH[enc.match_type], match)
+
+    @staticmethod
+    def _data_field(data_info, values, n):
+        head = _tag(DATA_FIELD_ID, VARINT) + _varint(data_info.id)
+        if data_info.repeated:
+            raise ValueError("Data field {} of type {} cannot be compiled".format(data_info.name, data_info.type))
+        if data_info.type == "bool":
+            return [head, _tag(DATA_FIELD_BOOL, VARINT), _bool_column(values, n, data_info.name)]
+        if data_info.type not in INT_TYPES:
+            raise ValueError("Data field {} of type {} cannot be compiled".format(data_info.name, data_info.type))
+        size, bits = data_info.size
+        return [head] + _bytes_field(DATA_FIELD_STREAM, _byte_column(values, n, data_info.name, size, bits,
+                                                                      data_info.annotations))
+
+    def _template(self, update_type, reset_ttl):
+        """Flat list of (offset, bytes or column matrix) of one serialized Update."""
+        key = (update_type, reset_ttl)
+        template = self._templates.get(key)
+        if template is not None:
+            return template
+        entry = list(self._entry_parts)
+        if reset_ttl:
+            entry += _msg(ENTRY_FLAGS, [_tag(FLAGS_RESET_TTL, VARINT) + b"\x01"])
+        update = [_tag(UPDATE_TYPE, VARINT) + _varint(update_type)] + \
+            _msg(UPDATE_ENTITY, _msg(ENTITY_TABLE_ENTRY, entry))
+        parts = _msg(WRITE_REQUEST_UPDATES, update)
+        # Merge the constant parts between two columns
+        template = []
+        offset = 0
+        for part in parts:
+            if isinstance(part, bytes) and template and isinstance(template[-1][1], bytes):
+                template[-1] = (template[-1][0], template[-1][1] + part)
+            else:
+                template.append((offset, part))
+            offset += _width(part)
+        template = self._templates[key] = (offset, template)
+        return template
+
+    def encode(self, rows, update_type=bfruntime_pb2.Update.INSERT, reset_ttl=False):
+        """Serialized WriteRequest.updates of the given rows (a slice or an index array).
+
+        Returns:
+            bytes to append to a serialized WriteRequest without updates
+        """
+        width, template = self._template(update_type, reset_ttl)
+        count = len(range(*rows.indices(self.rows))) if isinstance(rows, slice) else len(rows)
+        out = np.empty((count, width), dtype=np.uint8)
+        for offset, part in template:
+            if isinstance(part, bytes):
+                out[:, offset:offset + len(part)] = np.frombuffer(part, dtype=np.uint8)
+            else:
+                out[:, offset:offset + part.shape[1]] = part[rows]
+        return out.tobytes()
+
+
+class ColumnWriter(BulkWriter):
+    """BulkWriter for TableColumns. Chunks are slices of rows, encoded into serialized
+    WriteRequests and sent with _write_serialized_async, pipelined like BulkWriter.
+    """
+
+    def __init__(self, table, target, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None, max_in_flight=1,
+                 metadata=None):
+        super().__init__(table, target, chunk_size=chunk_size, on_chunk=on_chunk, max_in_flight=max_in_flight,
+                         metadata=metadata)
+        self._header = None
+
+    def _request_header(self):
+        """Serialized WriteRequest with everything but the updates."""
+        if self._header is None:
+            req = self._new_request()
+            req.client_id = self.rw.client_id
+            if self.rw.p4_name:
+                req.p4_name = self.rw.p4_name
+            self._header = req.SerializeToString()
+        return self._header
+
+    def _upsert_delta(self, columns, resp, exc, offset):
+        exists, others = self._upsert_split(resp, exc, offset)
+        mod_resp = None
+        if exists:
+            modify = bfruntime_pb2.Update.MODIFY
+            data = self._request_header() + columns.encode(np.asarray(exists) + offset, modify, reset_ttl=True)
+            future = self.rw._write_serialized_async(data, self._metadata(True),
+                                                     (columns.table_id, modify, len(exists)))
+            mod_resp = self.rw._write_wait(future)
+        return self._upsert_check(exists, others, mod_resp, offset)
+
+    def _finish(self, pending, result, upsert):
+        index, offset, columns, future, n, request_bytes, encode_s, sent_at = pending
+        modified = 0
+        if upsert:
+            resp = exc = None
+            try:
+                resp = self.rw._write_wait(future)
+            except gc.BfruntimeReadWriteRpcException as e:
+                exc = e
+            if exc is not None or self.table.get_parser._status_has_error(resp.status):
+                modified = self._upsert_delta(columns, resp, exc, offset)
+        else:
+            resp = self.rw._write_wait(future)
+            self.table.get_parser._parse_entry_write_response(resp, metadata=self.metadata)
+        self._chunk_done(result, index, n, request_bytes, encode_s, sent_at, modified)
+
+    def write(self, columns, update_type=bfruntime_pb2.Update.INSERT, upsert=False):
+        """Write all rows of a TableColumns in pipelined chunks. Same semantics and
+        return value as BulkWriter.write.
+        """
+        if upsert:
+            update_type = bfruntime_pb2.Update.INSERT
+        metadata = self._metadata(upsert)
+        result = BulkWriteResult(self.table.info.name_get())
+        in_flight = deque()
+        start = time.perf_counter()
+        for index, offset in enumerate(range(0, columns.rows, self.chunk_size)):
+            n = min(self.chunk_size, columns.rows - offset)
+            t0 = time.perf_counter()
+            data = self._request_header() + columns.encode(slice(offset, offset + n), update_type)
+            encode_s = time.perf_counter() - t0
+            while len(in_flight) >= self.max_in_flight:
+                self._finish(in_flight.popleft(), result, upsert)
+            future = self.rw._write_serialized_async(data, metadata, (columns.table_id, update_type, n))
+            in_flight.append((index, offset, columns, future, n, len(data), encode_s, time.perf_counter()))
+        while in_flight:
+            self._finish(in_flight.popleft(), result, upsert)
+        result.elapsed_s = time.perf_counter() - start
+        log.debug(str(result))
+        return result
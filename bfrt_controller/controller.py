@@ -3,32 +3,79 @@
 # import bfrt_grpc.bfruntime_pb2_grpc
 # import bfrt_grpc.client as gc
 
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
 from bfrt_controller.bfrt_grpc import bfruntime_pb2_grpc
 from bfrt_controller.bfrt_grpc import client as gc
 from tabulate import tabulate
 
+from .bulk import BulkWriter, KeyDataEncoder, DEFAULT_CHUNK_SIZE
+from .columns import ColumnWriter, TableColumns
+from .digests import DigestPipeline, DEFAULT_BATCH_SIZE
+from .encoder import TableEncoder
+from .poller import Poller, SYNC_FROM_HW
 from .ports import PortManager
+from .port_stats import DEFAULT_CAPACITY, DEFAULT_FIELDS
+from .provision import Provisioner, DEFAULT_MAX_WORKERS
+from .readers import CounterReader, RegisterReader, DEFAULT_SHARD_SIZE
+from .reconcile import ReconcileReport, desired_entries, diff_entries
+from .schema_cache import SchemaCache, DEFAULT_CACHE_DIR
+from .metrics import RpcMetrics
 from .logger import log
 from .utils import is_valid_ip, format_value
 
 class Controller:
-    def __init__(self, bfrt_ip="localhost", bfrt_port="50052", pipe_id=0xFFFF):
+    # The parsed bf-rt.json is cached in schema_cache_dir (keyed by p4_name and a
+    # hash of the json) so that later scripts skip parsing it. Pass
+    # schema_cache_dir=None to always parse.
+    #
+    # With lazy_tables=True tables are parsed and their objects created only when
+    # first used (setup_tables, table_get), instead of all at connect time.
+    #
+    # schema_cache can be given instead of schema_cache_dir, e.g. a
+    # SharedSchemaCache shared by the controllers of several switches.
+    #
+    # With a ConnectionPool (pool.py), the channel, subscription, bfrt_info and
+    # binding are reused from earlier Controllers of the same process.
+    # read_only=True uses an independent client: no stream, no subscribe and
+    # no bind, for read workers running next to the main Controller.
+    def __init__(self, bfrt_ip="localhost", bfrt_port="50052", pipe_id=0xFFFF, schema_cache_dir=DEFAULT_CACHE_DIR,
+                 lazy_tables=True, schema_cache=None, pool=None, read_only=False):
         self.log = log
         self.bfrt_ip = bfrt_ip
         self.bfrt_port = bfrt_port
         self.device_id = 0
-        self.interface = gc.ClientInterface(f"{self.bfrt_ip}:{self.bfrt_port}", client_id=0, device_id=0)
-        self.bfrt_info = self.interface.bfrt_info_get()
+        self.pool = pool
+        self.read_only = read_only
+        address = f"{self.bfrt_ip}:{self.bfrt_port}"
+        if pool is not None:
+            self.interface = pool.reader(address) if read_only else pool.client(address)
+        else:
+            self.interface = gc.ClientInterface(address, client_id=0, device_id=0, perform_subscribe=not read_only)
+        if schema_cache is None and schema_cache_dir is not None:
+            schema_cache = SchemaCache(schema_cache_dir)
+        self.schema_cache = schema_cache
+        if pool is not None:
+            self.bfrt_info = pool.bfrt_info(self.interface, schema_cache=self.schema_cache, lazy=lazy_tables)
+        else:
+            self.bfrt_info = self.interface.bfrt_info_get(schema_cache=self.schema_cache, lazy=lazy_tables)
         self.target = gc.Target(self.device_id, pipe_id=pipe_id)
         self.p4_name = self.bfrt_info.p4_name_get()
         self.log.info(f"Connected to {self.p4_name}")
-        self.interface.bind_pipeline_config(self.p4_name)
-        self.port_manager = PortManager(self.target, gc, self.bfrt_info)
+        if read_only:
+            # Independent clients name the program in every request instead of binding
+            self.interface.reader_writer_interface.p4_name = self.p4_name
+        elif pool is not None:
+            pool.bind(self.interface, self.p4_name)
+        else:
+            self.interface.bind_pipeline_config(self.p4_name)
+        self.port_manager = PortManager(self.target, gc, self.bfrt_info, interface=self.interface)
 
     def setup_tables(self, table_names):
         self.tables = {}
+        self.encoders = {}
         for t in table_names:
             self.tables[t] = self.bfrt_info.table_get(t)
+            self.encoders[t] = TableEncoder(self.tables[t])
 
     def get_entries(self, table_name, print_entries=False):
         entries = []
@@ -170,22 +217,127 @@ class Controller:
     # self.programTable("ipv4_lpm", [
     #       ([("hdr.ipv4.dst_addr", "192.168.1.0", None, 24)],
     #         "Ingress.send", [("port", 64)]),
+    #
+    # Entries are written in chunks of chunk_size entries; the next chunk is
+    # encoded while the previous one is in flight. on_chunk, if given, is called
+    # with a ChunkStats (entries, request bytes, encode and rpc latency) per chunk.
+    # Returns a BulkWriteResult with the per-chunk stats and overall throughput.
+    #
+    # With upsert=True (default) entries that already exist are modified: the
+    # server reports per-entry status and only the colliding entries are re-sent
+    # as modifies. With upsert=False any existing entry is an error.
+    #
+    # Entries are encoded by the table's compiled TableEncoder: field ids, sizes
+    # and match types are resolved once per combination of field names instead
+    # of once per field of every entry.
 
-    def program_table(self, table_name, entries):
+    def program_table(self, table_name, entries, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None, upsert=True):
         table = self.tables[table_name]
-        key_list = []
-        data_list = []
-        for k, a, d in entries:
-            key_list.append(table.make_key([gc.KeyTuple(*f) for f in k]))
-            data_list.append(table.make_data([gc.DataTuple(*p) for p in d], a))
-        try:
-            table.entry_add(self.target, key_list, data_list)
-        except:
-            table.entry_mod(self.target, key_list, data_list)
+        writer = BulkWriter(table, self.target, chunk_size=chunk_size, encoder=self.encoders[table_name],
+                            on_chunk=on_chunk)
+        return writer.write(entries, upsert=upsert)
+
+    #
+    # Fast path of program_table for entries sharing the same fields. Field names
+    # are given once and every row is a pair of positional tuples
+    # (key_values, data_values). Key values are plain values for exact match
+    # fields and pairs for the other match types: (value, mask),
+    # (value, prefix_len), (low, high) or (value, is_valid).
+    #
+    # Example:
+    # --------------------------------
+    # self.program_table_rows("ipv4_host", ["hdr.ipv4.dst_addr"], "Ingress.send", ["port"], [
+    #         (("192.168.1.1",), (1,)),
+    #         (("192.168.1.2",), (2,)),
+    # ])
+
+    def program_table_rows(self, table_name, key_fields, action_name, data_fields, rows,
+                           chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None, upsert=True):
+        table = self.tables[table_name]
+        layout = self.encoders[table_name].layout(key_fields, action_name, data_fields)
+        writer = BulkWriter(table, self.target, chunk_size=chunk_size, encoder=layout, on_chunk=on_chunk)
+        return writer.write(rows, upsert=upsert)
+
+    #
+    # Column-oriented program_table for large loads: one NumPy array (or pandas
+    # DataFrame column, list or scalar) per field instead of one tuple per entry.
+    # Every column is range checked once against its field width and the chunks
+    # are encoded straight into serialized WriteRequests (see columns.py).
+    # Non exact key fields take a pair of columns: (value, mask),
+    # (value, prefix_len), (low, high) or (value, is_valid).
+    #
+    # Example:
+    # --------------------------------
+    # teids = np.arange(1, 1000001, dtype=np.uint32)
+    # self.program_table_columns("pipe.Ingress.teid_meter",
+    #         keys={"hdr.gtpu.teid": teids, "qfi": np.repeat(9, len(teids))},
+    #         data={"$METER_SPEC_CIR_KBPS": 20000, "$METER_SPEC_PIR_KBPS": 100000,
+    #               "$METER_SPEC_CBS_KBITS": 120, "$METER_SPEC_PBS_KBITS": 360})
+
+    def program_table_columns(self, table_name, keys, action=None, data=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                              on_chunk=None, upsert=True):
+        table = self.tables[table_name]
+        columns = TableColumns(table.info, keys, action, data)
+        writer = ColumnWriter(table, self.target, chunk_size=chunk_size, on_chunk=on_chunk)
+        return writer.write(columns, upsert=upsert)
+
+    #
+    # Reconcile a table against a desired list of entries (same format as
+    # program_table). The table is read once, diffed by key, and only the
+    # missing, changed and (with prune=True) undesired entries are written as
+    # batched inserts, modifies and deletes. With dry_run=True nothing is
+    # written. Returns a ReconcileReport.
+
+    def reconcile_table(self, table_name, entries, dry_run=False, prune=True, chunk_size=DEFAULT_CHUNK_SIZE):
+        table = self.tables[table_name]
+        report = ReconcileReport(table.info.name_get(), dry_run)
+
+        desired = desired_entries(table, entries)
+        current = {}
+        for d, k in table.entry_get(self.target, flags={"from_hw": False}):
+            if k is not None:
+                k.apply_mask()
+                current[k] = d
+        diff_entries(report, current, desired, prune=prune)
+        self.log.info(str(report))
+        if dry_run:
+            return report
+
+        writer = BulkWriter(table, self.target, chunk_size=chunk_size, encoder=KeyDataEncoder(table))
+        # Deletes first so that freed table space is available to the inserts
+        if report.to_delete:
+            report.results["delete"] = writer.write(report.to_delete, bfruntime_pb2.Update.DELETE)
+        if report.to_modify:
+            report.results["modify"] = writer.write(report.to_modify, bfruntime_pb2.Update.MODIFY)
+        if report.to_add:
+            report.results["add"] = writer.write(report.to_add, bfruntime_pb2.Update.INSERT)
+        return report
+
+    #
+    # Program several tables at once. plan is a list of (table_name, entries)
+    # in program_table format, or ProvisionStep(table_name, rows, layout) for
+    # program_table_rows style rows. Independent tables are written
+    # concurrently (max_workers at a time) and a table waits for the tables it
+    # depends on (depends_on in bf-rt.json). Returns a ProvisionReport.
+    #
+    # Example:
+    # --------------------------------
+    # self.provision([
+    #     ("Ingress.Forward.ipv4_host_table", ipv4_entries),
+    #     ("Ingress.QoS.qfi_to_queue_table", qfi_entries),
+    # ])
+
+    def provision(self, plan, max_workers=DEFAULT_MAX_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None):
+        return Provisioner(self, max_workers=max_workers, chunk_size=chunk_size, on_chunk=on_chunk).run(plan)
 
     # ALWAYS call tear down at the end
     def tear_down(self):
-        self.interface.tear_down_stream()
+        if self.port_manager.monitor is not None:
+            self.port_manager.monitor.stop()
+        if self.pool is not None:
+            self.pool.release(self.interface)
+        elif not self.interface.is_independent:
+            self.interface.tear_down_stream()
 
     def add_multicast_node(self, mc_node_id, port_list):
         mc_node_table = self.bfrt_info.table_get("$pre.node")
@@ -241,32 +393,35 @@ class Controller:
             ],
         )
 
-    def read_counter(self, table_name, index=None):
+    def read_counter(self, table_name, index=None, indexes=None, from_hw=True, shard_size=DEFAULT_SHARD_SIZE):
+        """Reads a counter table.
+
+        Keyword arguments:
+            table_name -- counter table name
+            index -- read a single index and return (pkts, bytes)
+            indexes -- read only these indexes, shard_size keys per request. The result is
+                       aligned with indexes
+            from_hw -- read from hardware instead of the software shadow
+
+        Raises:
+            KeyError if index or one of indexes is not returned by the switch
+
+        Returns:
+            (pkts, bytes) if index is given, otherwise CounterArrays with NumPy arrays
+            .index, .packets and .bytes (iterating it yields (idx, pkts, bytes) tuples).
+            Without index and indexes all counters are read with one wildcard read.
+        """
         if not self.table_exists(table_name):
             log.warning(f"Table {table_name} is not setup!")
             return
-        counter_table = self.bfrt_info.table_get(table_name)
-        size = counter_table.info.size
-        # print(f"Counter size: {size}")
-
-        def get_counter_at_index(idx):
-            resp = counter_table.entry_get(
-                self.target, [counter_table.make_key([gc.KeyTuple("$COUNTER_INDEX", idx)])], {"from_hw": True}, None
-            )
-            # parse resp to get the counter
-            data_dict = next(resp)[0].to_dict()
-            pkts = data_dict["$COUNTER_SPEC_PKTS"]
-            bytes = data_dict["$COUNTER_SPEC_BYTES"]
-            return pkts, bytes
+        reader = CounterReader(self.tables[table_name], self.target, from_hw=from_hw, shard_size=shard_size)
 
         if index is not None:
-            return get_counter_at_index(index)
-        else:
-            results = []
-            for idx in range(size):
-                pkts, bytes = get_counter_at_index(idx)
-                results.append((idx, pkts, bytes))
-            return results
+            counters = reader.read_indexes([index])
+            return int(counters.packets[0]), int(counters.bytes[0])
+        if indexes is not None:
+            return reader.read_indexes(indexes)
+        return reader.read_all()
 
     def read_register(self, reg_name, index=None, pipe=0):
         """Note: Slow if index is not passed. Use batched mode instead"""
@@ -326,6 +481,114 @@ class Controller:
 
         return results
 
+    def read_register_arrays(self, reg_name, pipe=None, from_hw=True):
+        """Reads a whole register into NumPy arrays without building per-entry objects.
+
+        Keyword arguments:
+            reg_name -- register table name
+            pipe -- only keep the values of this pipe; by default all pipes are kept
+            from_hw -- read from hardware instead of the software shadow
+
+        Returns:
+            RegisterArrays with .index and .fields ("f1", or "first"/"second" for paired
+            registers), also available as .values / .first / .second
+        """
+        if not self.table_exists(reg_name):
+            log.warning(f"Table {reg_name} is not setup!")
+            return None
+        return RegisterReader(self.tables[reg_name], self.target, pipe=pipe, from_hw=from_hw).read()
+
+    def iter_register_chunks(self, reg_name, pipe=None, from_hw=True):
+        """Like read_register_arrays, but yields a RegisterArrays per response message
+        as it arrives, so a large register can be processed with bounded memory.
+        """
+        if not self.table_exists(reg_name):
+            log.warning(f"Table {reg_name} is not setup!")
+            return iter(())
+        return RegisterReader(self.tables[reg_name], self.target, pipe=pipe, from_hw=from_hw).chunks()
+
+    def poller(self, interval=1.0, sync=SYNC_FROM_HW, sync_every=1, on_change=None, registers=(), counters=()):
+        """Poller reporting only the changed indexes of registers and counters.
+
+        Keyword arguments:
+            interval -- seconds between polls once started
+            sync -- SYNC_FROM_HW, SYNC_OPERATION or SYNC_NONE (see poller.py)
+            sync_every -- with SYNC_OPERATION, run the table Sync every sync_every polls
+            on_change -- callback receiving each non empty ChangeSet
+            registers -- register names to watch (all pipes)
+            counters -- counter table names to watch
+
+        Call poll() for a synchronous poll or start()/stop() to poll in the background.
+        """
+        poller = Poller(self, interval=interval, sync=sync, sync_every=sync_every, on_change=on_change)
+        for name in registers:
+            poller.add_register(name)
+        for name in counters:
+            poller.add_counter(name)
+        return poller
+
+    def port_stats_sampler(self, dev_ports=None, interval=1.0, capacity=DEFAULT_CAPACITY, fields=DEFAULT_FIELDS,
+                           poll_intvl_ms=None, from_hw=False, on_sample=None):
+        """PortStatsSampler keeping the last capacity $PORT_STAT samples of the ports.
+
+        Keyword arguments:
+            dev_ports -- dev ports to sample; the added ports (following the registry) by default
+            interval -- seconds between samples once started
+            capacity -- number of samples kept in the ring buffer
+            fields -- dict of short name -> $PORT_STAT field name (see port_stats.py)
+            poll_intvl_ms -- if set, the driver's port stat poll interval is set to it
+            from_hw -- read the counters from the MACs instead of the driver's copy
+            on_sample -- callback receiving each PortStatsSample
+
+        Call sample() for a synchronous sample or start()/stop() to sample in the
+        background; rates() gives the per second rates of every port.
+        """
+        return self.port_manager.stats_sampler(dev_ports=dev_ports, interval=interval, capacity=capacity,
+                                               fields=fields, poll_intvl_ms=poll_intvl_ms, from_hw=from_hw,
+                                               on_sample=on_sample)
+
+    def port_status_monitor(self, callback=None, dev_ports=None):
+        """Running PortStatusMonitor keeping the link state of the ports from the port
+        status notifications of the stream (see port_monitor.py).
+
+        Keyword arguments:
+            callback -- optional function called with a PortEvent on every port up/down
+            dev_ports -- dev ports the callback is called for, all by default
+
+        The monitor is shared by all calls; stop() it to stop draining notifications.
+        """
+        return self.port_manager.port_status_monitor(callback=callback, dev_ports=dev_ports)
+
+    def digest_pipeline(self, learn_names, callback, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+        """DigestPipeline decoding the digests of the given learn objects in batches.
+
+        Keyword arguments:
+            learn_names -- names of the learn objects (digests) to decode
+            callback -- called with a DigestBatch (one NumPy column per learn field)
+            batch_size -- max number of digest messages decoded together
+            workers -- number of threads running the callback
+
+        Use start()/stop() or a with block to run it.
+        """
+        learns = [self.bfrt_info.learn_get(name) for name in learn_names]
+        return DigestPipeline(self.interface, learns, callback, batch_size=batch_size, workers=workers)
+
+    def instrument(self, metrics=None, callback=None):
+        """Records latency, sizes, entity counts and status codes of every Write and
+        Read of this controller, labeled by table and operation (see metrics.py).
+
+        Keyword arguments:
+            metrics -- RpcMetrics to record into, e.g. one shared by several controllers;
+                       a new one by default
+            callback -- with a new RpcMetrics, called with an RpcRecord after every RPC
+
+        Returns:
+            the RpcMetrics; prometheus() renders it in the Prometheus text format
+        """
+        if metrics is None:
+            metrics = RpcMetrics(callback=callback)
+        return metrics.attach(self)
+
     def clear_register(self, reg_name: str):
         """Clears all entries in the given register by deleting them."""
         if not self.table_exists(reg_name):
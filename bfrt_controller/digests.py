@@ -0,0 +1,225 @@
+# bfrt_controller/digests.py
+
+"""
+digests.py
+
+Batched ingestion of learn digests.
+
+digest_get_iterator yields one DigestList at a time and make_data_list turns every learn
+entry into a _Data object with a DataTuple per field, all on the thread that also has to
+act on the digests. A DigestPipeline drains the digest queue of the
+ClientInterface in batches, decodes the learn data of each batch into one NumPy column
+per field using a field map compiled once from the _LearnInfo, and hands the resulting
+DigestBatch to a callback running on a worker pool, so decoding and stream draining
+never wait for the callback.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .logger import log
+from .readers import dtype_for_bits
+
+DEFAULT_BATCH_SIZE = 1024
+
+
+class DigestBatch:
+    """Learn entries of one or more DigestList messages of the same learn object.
+
+    Attributes:
+        name -- learn object name
+        columns -- OrderedDict of field name -> array with a value per learn entry.
+                   Integer fields up to 64 bits are unsigned integer arrays, wider or
+                   non integer fields are object arrays
+        list_ids -- uint32 array, list_id of the DigestList each entry came from
+    """
+
+    def __init__(self, name, columns, list_ids, record_type):
+        self.name = name
+        self.columns = columns
+        self.list_ids = list_ids
+        self._record_type = record_type
+
+    def __len__(self):
+        return len(self.list_ids)
+
+    def records(self):
+        """Yields a namedtuple per learn entry, with a field per learn field."""
+        columns = [col.tolist() for col in self.columns.values()]
+        return map(self._record_type._make, zip(*columns))
+
+
+class DigestDecoder:
+    """Decodes the DigestLists of one learn object into DigestBatches.
+
+    Keyword arguments:
+        learn -- _Learn object, from bfrt_info.learn_get(name)
+    """
+
+    def __init__(self, learn):
+        info = learn.info
+        self.name = info.name_get()
+        self.id = info.id_get()
+        self.names = []
+        self.dtypes = []
+        # field id -> column position
+        self.positions = {}
+        for field_id, name in sorted(info.data_id_index.items()):
+            field = info.data_dict[info.data_dict_allname[name]]
+            bits = field.size[1]
+            self.positions[field_id] = len(self.names)
+            self.names.append(name)
+            self.dtypes.append(dtype_for_bits(bits) if bits is not None and bits <= 64 else object)
+        self.record_type = namedtuple(
+            "LearnRecord", [name.lstrip("$").replace(".", "_") for name in self.names], rename=True)
+
+    def decode(self, digests):
+        """DigestBatch holding every learn entry of the given DigestLists."""
+        positions = self.positions
+        columns = [[] for _ in self.names]
+        n_columns = len(columns)
+        list_ids = []
+        for digest in digests:
+            for data in digest.data:
+                row = [None] * n_columns
+                for field in data.fields:
+                    pos = positions.get(field.field_id)
+                    if pos is None:
+                        continue
+                    kind = field.WhichOneof("value")
+                    if kind == "stream":
+                        row[pos] = int.from_bytes(field.stream, "big")
+                    elif kind is not None:
+                        row[pos] = getattr(field, kind)
+                for column, value in zip(columns, row):
+                    column.append(value)
+                list_ids.append(digest.list_id)
+        arrays = OrderedDict()
+        for name, dtype, column in zip(self.names, self.dtypes, columns):
+            if dtype is not object and None not in column:
+                arrays[name] = np.array(column, dtype=dtype)
+            else:
+                arrays[name] = np.array(column, dtype=object)
+        return DigestBatch(self.name, arrays, np.array(list_ids, dtype=np.uint32), self.record_type)
+
+
+class DigestPipeline:
+    """Drains digests from a ClientInterface in a thread and passes decoded batches to
+    a callback on a worker pool.
+
+    Keyword arguments:
+        interface -- gc.ClientInterface subscribed with learn notifications
+        learns -- list of _Learn objects whose digests are decoded
+        callback -- called with each DigestBatch
+        batch_size -- max number of DigestList messages decoded together
+        workers -- number of callback threads. With more than one worker, batches
+                   may be handled out of order
+        max_pending -- max number of batches waiting for a worker before the drain
+                       thread stops reading (the stream queue then absorbs the burst)
+    """
+
+    def __init__(self, interface, learns, callback, batch_size=DEFAULT_BATCH_SIZE, workers=1, max_pending=16):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        self.interface = interface
+        self.decoders = {}
+        for learn in learns:
+            decoder = DigestDecoder(learn)
+            self.decoders[decoder.id] = decoder
+        self.callback = callback
+        self.batch_size = batch_size
+        self.workers = workers
+        self.received = 0
+        self.decoded = 0
+        self.unknown = 0
+        self.failed = 0
+        # Guards the counters: failed is updated by the workers
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def _handle(self, batch):
+        try:
+            self.callback(batch)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            log.error("Digest callback failed for {}: {}".format(batch.name, e))
+        finally:
+            self._pending.release()
+
+    def _dispatch(self, digests):
+        """Groups digests by learn object, keeping their order, and submits a batch per
+        learn object."""
+        groups = OrderedDict()
+        for digest in digests:
+            groups.setdefault(digest.digest_id, []).append(digest)
+        for digest_id, group in groups.items():
+            decoder = self.decoders.get(digest_id)
+            if decoder is None:
+                with self._lock:
+                    first = self.unknown == 0
+                    self.unknown += len(group)
+                if first:
+                    log.warning("Ignoring digests of unknown learn id {}".format(digest_id))
+                continue
+            batch = decoder.decode(group)
+            with self._lock:
+                self.decoded += len(batch)
+            self._pending.acquire()
+            self._executor.submit(self._handle, batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                digests = self.interface.digest_get_batch(self.batch_size, timeout=0.1)
+                if digests:
+                    with self._lock:
+                        self.received += len(digests)
+                    self._dispatch(digests)
+            except Exception as e:
+                log.error("Digest decoding failed: {}".format(e))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bfrt-digest")
+        self._thread = threading.Thread(target=self._run, name="bfrt-digest-drain", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops draining and waits for the batches already handed to the workers."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        """Counters of the pipeline and the number of digests dropped by the stream queue."""
+        with self._lock:
+            stats = {
+                "received": self.received,
+                "decoded": self.decoded,
+                "unknown": self.unknown,
+                "failed": self.failed,
+            }
+        stats["dropped"] = self.interface.stream_overflow_get()["digest"]
+        return stats
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
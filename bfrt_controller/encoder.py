@@ -0,0 +1,261 @@
+# bfrt_controller/encoder.py
+
+"""
+encoder.py
+
+Compiled per-table encoders for BFRT write requests.
+
+make_key/make_data look up the size, type, match type and annotations of every field of
+every entry through the _TableInfo name dictionaries, and _set_table_key/_set_table_data
+repeat the id/type lookups at serialization. A TableEncoder resolves all of this once per
+combination of key fields, action and data fields (an EntryLayout) and then maps the
+Python values of each entry straight to protobuf KeyField/DataField bytes, without
+building KeyTuple/DataTuple/_Key/_Data objects.
+
+Entries that cannot be compiled (unknown or duplicate field names, non integer/bytes
+fields, data tuples with more than a value) go through the regular make_key/make_data
+path, so they fail or succeed exactly as before.
+"""
+
+from bfrt_controller.bfrt_grpc import client as gc
+
+from .bulk import EntryTupleEncoder
+
+# Positions of the values used by each match type in a program_table key tuple:
+# (name, value, mask, prefix_len, low, high, is_valid)
+KEY_TUPLE_SLOTS = {
+    "Exact": (1,),
+    "Ternary": (1, 2),
+    "LPM": (1, 3),
+    "Range": (4, 5),
+    "Optional": (1, 6),
+}
+
+INT_TYPES = ("uint64", "uint32", "uint16", "uint8", "bytes")
+
+
+def field_converter(name, size, annotations):
+    """Returns a function converting an int, bytearray or annotated string to exactly
+    size bytes. annotations is kept by reference, so annotations added later with
+    key_field_annotation_add/data_field_annotation_add are honoured.
+    """
+    limit = 1 << (size * 8)
+
+    def convert(value):
+        if type(value) is int and 0 <= value < limit:
+            return value.to_bytes(size, "big")
+        value = gc._convert_to_bytearray(value, name, size, annotations)
+        if value is None or len(value) != size:
+            raise ValueError("expected %d len received %s len for field %s"
+                             % (size, None if value is None else len(value), name))
+        return bytes(value)
+
+    return convert
+
+
+class KeyFieldEncoder:
+    """Pre-resolved id, match type and converter of one key field."""
+
+    __slots__ = ("name", "id", "match_type", "bits", "slots", "convert")
+
+    def __init__(self, key_info):
+        if key_info.type not in INT_TYPES or key_info.match_type not in KEY_TUPLE_SLOTS:
+            raise ValueError("Key field {} of type {} ({}) cannot be compiled".format(
+                key_info.name, key_info.type, key_info.match_type))
+        size, self.bits = key_info.size
+        self.name = key_info.name
+        self.id = key_info.id
+        self.match_type = key_info.match_type
+        self.slots = KEY_TUPLE_SLOTS[key_info.match_type]
+        self.convert = field_converter(key_info.name, size, key_info.annotations)
+
+    def from_tuple(self, field):
+        """Positional value of a program_table key tuple: the value for Exact match,
+        otherwise the pair of values used by the match type.
+        """
+        if sum(v is not None for v in field) != len(self.slots) + 1:
+            raise ValueError("field:%s Passed in values do not match type of keyfield:%s"
+                             % (self.name, self.match_type))
+        try:
+            if len(self.slots) == 1:
+                return field[1]
+            return field[self.slots[0]], field[self.slots[1]]
+        except IndexError:
+            raise ValueError("field:%s Passed in values do not match type of keyfield:%s"
+                             % (self.name, self.match_type))
+
+    def encode(self, key, value):
+        field = key.fields.add()
+        field.field_id = self.id
+        match_type = self.match_type
+        if match_type == "Exact":
+            field.exact.value = self.convert(value)
+        elif match_type == "Ternary":
+            field.ternary.value = self.convert(value[0])
+            field.ternary.mask = self.convert(value[1])
+        elif match_type == "LPM":
+            if not 0 <= value[1] <= self.bits:
+                raise ValueError("Field %s Prefix length %d passed in is > size %d"
+                                 % (self.name, value[1], self.bits))
+            field.lpm.value = self.convert(value[0])
+            field.lpm.prefix_len = value[1]
+        elif match_type == "Range":
+            field.range.low = self.convert(value[0])
+            field.range.high = self.convert(value[1])
+        else:
+            field.optional.value = self.convert(value[0])
+            field.optional.is_valid = bool(value[1])
+
+
+class _DataFieldEncoder:
+    """Pre-resolved id and converter of one (non repeated, integer/bytes) data field."""
+
+    __slots__ = ("id", "convert")
+
+    def __init__(self, data_info):
+        if data_info.type not in INT_TYPES or data_info.repeated:
+            raise ValueError("Data field {} of type {} cannot be compiled".format(data_info.name, data_info.type))
+        self.id = data_info.id
+        self.convert = field_converter(data_info.name, data_info.size[0], data_info.annotations)
+
+    def encode(self, data, value):
+        field = data.fields.add()
+        field.field_id = self.id
+        field.stream = self.convert(value)
+
+
+class EntryLayout:
+    """Compiled encoder for one combination of key fields, action and data fields.
+
+    Used directly as a BulkWriter encoder, every entry of a chunk is a pair
+    (key_values, data_values) of positional tuples in the order of the layout fields.
+    Key values are plain values for Exact match fields and pairs for the other match
+    types: (value, mask), (value, prefix_len), (low, high) or (value, is_valid).
+
+    Key fields are written in the order _Key gives them (sorted by name), whatever the
+    order of the layout, so the requests are the same as through make_key.
+    """
+
+    def __init__(self, table_id, key_encoders, action_id, data_encoders):
+        self.table_id = table_id
+        self.key_encoders = key_encoders
+        self.action_id = action_id
+        self.data_encoders = data_encoders
+        # Positions of the key values in the order they are written
+        self.key_order = sorted(range(len(key_encoders)), key=lambda i: key_encoders[i].name)
+
+    def _new_entry(self, req, update_type):
+        update = req.updates.add()
+        update.type = update_type
+        entry = update.entity.table_entry
+        entry.table_id = self.table_id
+        if self.action_id is not None:
+            entry.data.action_id = self.action_id
+        return entry
+
+    def encode_values(self, req, key_values, data_values, update_type):
+        if len(key_values) != len(self.key_encoders) or len(data_values) != len(self.data_encoders):
+            raise ValueError("Expected {} key and {} data values, got {} and {}".format(
+                len(self.key_encoders), len(self.data_encoders), len(key_values), len(data_values)))
+        entry = self._new_entry(req, update_type)
+        key = entry.key
+        encoders = self.key_encoders
+        for i in self.key_order:
+            encoders[i].encode(key, key_values[i])
+        data = entry.data
+        for enc, value in zip(self.data_encoders, data_values):
+            enc.encode(data, value)
+
+    def encode_tuples(self, req, k, d, update_type):
+        """Encodes one program_table entry whose field names match this layout."""
+        entry = self._new_entry(req, update_type)
+        key = entry.key
+        encoders = self.key_encoders
+        for i in self.key_order:
+            encoders[i].encode(key, encoders[i].from_tuple(k[i]))
+        data = entry.data
+        for enc, field in zip(self.data_encoders, d):
+            enc.encode(data, field[1])
+
+    def encode(self, req, chunk, update_type):
+        for key_values, data_values in chunk:
+            self.encode_values(req, key_values, data_values, update_type)
+        return req
+
+
+class TableEncoder:
+    """Compiles and caches EntryLayouts for one table.
+
+    Used directly as a BulkWriter encoder it takes program_table style entries
+    (key tuples, action name, data tuples); entries which cannot be compiled are
+    encoded through make_key/make_data instead.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.info = table.info
+        self.fallback = EntryTupleEncoder(table)
+        self._layouts = {}
+        self._plans = {}
+
+    def layout(self, key_fields, action=None, data_fields=()):
+        """EntryLayout for the given key field names, action and data field names.
+
+        Raises:
+            KeyError on unknown field or action names
+            ValueError if a field is duplicated, a mandatory key field is missing or
+            a field type is not supported (only non repeated integer/bytes fields are)
+        """
+        sig = (tuple(key_fields), action, tuple(data_fields))
+        layout = self._layouts.get(sig)
+        if layout is None:
+            layout = self._layouts[sig] = self._compile(*sig)
+        return layout
+
+    def _compile(self, key_fields, action, data_fields):
+        info = self.info
+        key_infos = [info.key_dict[info.key_dict_allname[name]] for name in key_fields]
+        names = set(k.name for k in key_infos)
+        if len(names) != len(key_infos):
+            raise ValueError("Duplicate key field in {}".format(key_fields))
+        for name, key_info in info.key_dict.items():
+            if key_info.mandatory and name not in names:
+                raise ValueError("%s is mandatory and needs to be in input_list" % name)
+
+        data_infos = [info._data_field_get(name, action)[0] for name in data_fields]
+        if len(set(d.id for d in data_infos)) != len(data_infos):
+            raise ValueError("Duplicate data field in {}".format(data_fields))
+
+        return EntryLayout(
+            info.id_get(),
+            [KeyFieldEncoder(k) for k in key_infos],
+            info.action_id_get(action) if action is not None else None,
+            [_DataFieldEncoder(d) for d in data_infos])
+
+    def _plan(self, k, a, d):
+        """Cached layout for the field names of a program_table entry, or None if the
+        entry has to go through make_key/make_data.
+        """
+        sig = (tuple(f[0] for f in k), a, tuple(p[0] if len(p) == 2 else None for p in d))
+        try:
+            return self._plans[sig]
+        except KeyError:
+            pass
+        layout = None
+        if None not in sig[2]:
+            try:
+                layout = self.layout(*sig)
+            except (KeyError, ValueError):
+                layout = None
+        self._plans[sig] = layout
+        return layout
+
+    def encode(self, req, chunk, update_type):
+        for entry in chunk:
+            k, a, d = entry
+            layout = self._plan(k, a, d)
+            if layout is None:
+                self.fallback.encode(req, [entry], update_type)
+            else:
+                layout.encode_tuples(req, k, d, update_type)
+        return req
@@ -0,0 +1,182 @@
+# bfrt_controller/fleet.py
+
+"""
+fleet.py
+
+One Controller per switch, driven together.
+
+A FleetController connects to every switch of a list and runs the same call on all of
+them in parallel threads, collecting per-switch results and errors in a FleetResult
+instead of stopping at the first failing switch. Connections whose switches run the
+same program (same p4_name and bf-rt.json hash) share one parsed schema through a
+SharedSchemaCache: the first switch is connected alone to parse (or load) it, the
+others then connect in parallel and reuse it. With lazy_tables, setup_tables likewise
+parses the requested tables once on the first switch before fanning out; the parser
+serializes the parsing of lazy tables anyway, so concurrent lookups stay safe.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .bulk import DEFAULT_CHUNK_SIZE
+from .controller import Controller
+from .logger import log
+from .schema_cache import SchemaCache, SharedSchemaCache, DEFAULT_CACHE_DIR
+
+
+class FleetError(Exception):
+    """Raised by FleetResult.raise_for_errors, errors maps switch -> exception."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Failed on {} switches: {}".format(
+            len(errors), ", ".join("{} ({})".format(s, e) for s, e in errors.items())))
+
+
+class FleetResult:
+    """Per-switch outcome of a fleet call.
+
+    Attributes:
+        results -- OrderedDict of switch -> return value, for the switches that succeeded
+        errors -- OrderedDict of switch -> exception, for the switches that failed
+    """
+
+    def __init__(self):
+        self.results = OrderedDict()
+        self.errors = OrderedDict()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def raise_for_errors(self):
+        if self.errors:
+            raise FleetError(self.errors)
+        return self
+
+    def __getitem__(self, switch):
+        return self.results[switch]
+
+    def __str__(self):
+        return "{} ok, {} failed{}".format(
+            len(self.results), len(self.errors),
+            "".join("\n  {}: {}".format(s, e) for s, e in self.errors.items()))
+
+
+def _address(switch):
+    """(ip, port) of a switch given as "ip", "ip:port" or (ip, port)."""
+    if isinstance(switch, (tuple, list)):
+        return str(switch[0]), str(switch[1])
+    ip, _, port = switch.partition(":")
+    return ip, port or "50052"
+
+
+class FleetController:
+    """Controllers of several switches running the same program.
+
+    Keyword arguments:
+        switches -- list of "ip", "ip:port" or (ip, port)
+        pipe_id -- pipe of the target of every controller
+        schema_cache_dir -- on-disk schema cache under the shared in-memory one, or None
+        lazy_tables -- see Controller
+        max_workers -- number of switches handled at once, all of them by default
+        connect_errors -- "raise" to fail if any switch cannot be connected, "skip"
+                          to go on with the others (see connect_result)
+    """
+
+    def __init__(self, switches, pipe_id=0xFFFF, schema_cache_dir=DEFAULT_CACHE_DIR, lazy_tables=True,
+                 max_workers=None, connect_errors="raise"):
+        if connect_errors not in ("raise", "skip"):
+            raise ValueError("connect_errors must be 'raise' or 'skip'")
+        self.switches = [":".join(_address(s)) for s in switches]
+        if len(set(self.switches)) != len(self.switches):
+            raise ValueError("Duplicate switch in {}".format(self.switches))
+        self.pipe_id = pipe_id
+        self.lazy_tables = lazy_tables
+        self.schema_cache = SharedSchemaCache(SchemaCache(schema_cache_dir) if schema_cache_dir is not None else None)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or max(1, len(self.switches)),
+                                           thread_name_prefix="bfrt-fleet")
+        self.controllers = OrderedDict()
+        self.connect_result = self._connect_all()
+        if connect_errors == "raise" and not self.connect_result.ok:
+            self.tear_down()
+            self.connect_result.raise_for_errors()
+
+    def _connect(self, switch):
+        ip, port = _address(switch)
+        return Controller(ip, port, pipe_id=self.pipe_id, lazy_tables=self.lazy_tables,
+                          schema_cache=self.schema_cache)
+
+    def _connect_all(self):
+        result = FleetResult()
+        remaining = list(self.switches)
+        # Connect switches one at a time until the schema is parsed once, then the rest at once
+        while remaining:
+            switch = remaining.pop(0)
+            try:
+                result.results[switch] = self._connect(switch)
+                break
+            except Exception as e:
+                log.error("Connecting to {} failed: {}".format(switch, e))
+                result.errors[switch] = e
+        rest = self._fan_out(remaining, self._connect)
+        result.results.update(rest.results)
+        result.errors.update(rest.errors)
+        for switch in self.switches:
+            if switch in result.results:
+                self.controllers[switch] = result.results[switch]
+        return result
+
+    def _fan_out(self, switches, fn, *args, **kwargs):
+        """Runs fn(switch, *args, **kwargs) for every switch in parallel."""
+        result = FleetResult()
+        futures = [(switch, self.executor.submit(fn, switch, *args, **kwargs)) for switch in switches]
+        for switch, future in futures:
+            try:
+                result.results[switch] = future.result()
+            except Exception as e:
+                log.error("{} failed on {}: {}".format(getattr(fn, "__name__", fn), switch, e))
+                result.errors[switch] = e
+        return result
+
+    def run(self, fn, *args, **kwargs):
+        """Calls fn(controller, *args, **kwargs) on every connected switch in parallel.
+
+        Returns:
+            FleetResult
+        """
+        return self._fan_out(list(self.controllers), lambda switch: fn(self.controllers[switch], *args, **kwargs))
+
+    def call(self, method, *args, **kwargs):
+        """Calls the Controller method of the given name on every switch in parallel."""
+        return self.run(lambda c: getattr(c, method)(*args, **kwargs))
+
+    def setup_tables(self, table_names):
+        table_names = list(table_names)
+        # Parse the shared lazy tables once instead of racing for them on every switch
+        first = next(iter(self.controllers.values()), None)
+        if first is not None:
+            for name in table_names:
+                try:
+                    first.bfrt_info.table_get(name)
+                except Exception:
+                    # Reported per switch by the fan-out below
+                    pass
+        return self.call("setup_tables", table_names)
+
+    def program_table(self, table_name, entries, chunk_size=DEFAULT_CHUNK_SIZE, upsert=True):
+        """Programs the same entries on every switch. entries must be a list (it is
+        iterated once per switch)."""
+        entries = list(entries)
+        return self.call("program_table", table_name, entries, chunk_size=chunk_size, upsert=upsert)
+
+    def read_register_batched(self, reg_name, pipe=0):
+        return self.call("read_register_batched", reg_name, pipe=pipe)
+
+    def clear_tables(self):
+        return self.call("clear_tables")
+
+    def tear_down(self):
+        result = self.call("tear_down")
+        self.executor.shutdown(wait=True)
+        return result
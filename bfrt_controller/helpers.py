@@ -34,7 +34,7 @@ def setup_ports(c: Controller):
         (21, 0, 100, "none", "disable"),
         (22, 0, 100, "none", "disable"),
     ]
-    c.port_manager.add_ports(port_list=ports)
+    c.port_manager.add_ports(port_list=ports, batched=True)
 
 def configure_multicast(c: Controller, port_list):
     logging.info(f"Configuring multicast for ports: {port_list}")
@@ -0,0 +1,259 @@
+# bfrt_controller/metrics.py
+
+"""
+metrics.py
+
+Per-RPC instrumentation of the table traffic of a client.
+
+All table reads and writes go through _ReaderWriterInterface._write/_write_async/_read
+(or their asyncio counterparts). RpcMetrics plugs into them as their instrumentation
+and records, per (rpc, table, operation):
+
+    - a latency histogram, from sending the request to the last response message
+    - request and response bytes
+    - entities: updates of a Write, entities returned by a Read
+    - calls by gRPC status code, and the per-update error codes returned with the
+      "error_in_resp" metadata
+
+The table is the one of the first entity of the request (the writers and readers of
+this package never mix tables in a request). The operation is the update type of a
+Write (INSERT, MODIFY, ...), READ for entry reads, or the entity kind (ATTRIBUTE,
+OPERATION, USAGE, HANDLE).
+
+The metrics are exposed in the Prometheus text format by prometheus(), and every
+finished RPC can also be passed to a callback as an RpcRecord:
+
+    metrics = c.instrument()
+    c.program_table("pipe.Ingress.ipv4_host", entries)
+    print(metrics.prometheus())
+"""
+
+import bisect
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import google.rpc.code_pb2 as code_pb2
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+
+from .logger import log
+
+# Upper bounds of the latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+UPDATE_TYPES = {v: k for k, v in bfruntime_pb2.Update.Type.items()}
+ENTITY_OPERATIONS = {"table_attribute": "ATTRIBUTE", "table_operation": "OPERATION", "table_usage": "USAGE",
+                     "handle": "HANDLE", "object_id": "OBJECT_ID"}
+
+# One finished RPC, as passed to the callback of RpcMetrics
+RpcRecord = namedtuple("RpcRecord", ["rpc", "table", "operation", "seconds", "request_bytes", "response_bytes",
+                                     "entities", "code"])
+
+
+class _Series:
+    """Aggregates of one (rpc, table, operation)."""
+
+    __slots__ = ("buckets", "sum", "count", "request_bytes", "response_bytes", "entities", "codes",
+                 "update_errors")
+
+    def __init__(self, n_buckets):
+        self.buckets = [0] * (n_buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.entities = 0
+        self.codes = {}
+        self.update_errors = {}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels.items()) + "}"
+
+
+class RpcMetrics:
+    """Instrumentation recording latency, sizes, entity counts and status codes of
+    every Write and Read.
+
+    Keyword arguments:
+        bfrt_info -- _BfRtInfo used to name tables by their id; see add_table_names
+        callback -- optional function called with an RpcRecord after every RPC
+        buckets -- upper bounds of the latency histogram buckets in seconds
+        sizes -- record request and response bytes (ByteSize of every message)
+    """
+
+    def __init__(self, bfrt_info=None, callback=None, buckets=DEFAULT_BUCKETS, sizes=True):
+        self.callback = callback
+        self.buckets = tuple(sorted(buckets))
+        self.sizes = sizes
+        self.table_names = {}
+        self.series = OrderedDict()
+        self._lock = threading.Lock()
+        if bfrt_info is not None:
+            self.add_table_names(bfrt_info)
+
+    def add_table_names(self, bfrt_info):
+        """Learns the table id -> name mapping of a _BfRtInfo (without parsing lazy tables)."""
+        parsed_info = bfrt_info.parsed_info
+        for name in parsed_info.table_name_list_get():
+            self.table_names[parsed_info.table_id_get(name)] = name
+
+    @staticmethod
+    def _rw(target):
+        """_ReaderWriterInterface of a Controller, AsyncController, client or itself."""
+        interface = getattr(target, "interface", target)
+        return getattr(interface, "reader_writer_interface", interface)
+
+    def attach(self, target):
+        """Instruments the RPCs of a Controller, AsyncController, ClientInterface or
+        AsyncClientInterface. The table names of its bfrt_info are added."""
+        bfrt_info = getattr(target, "bfrt_info", None)
+        # AsyncBfRtInfo wraps the _BfRtInfo as info
+        bfrt_info = getattr(bfrt_info, "info", bfrt_info)
+        if bfrt_info is not None:
+            self.add_table_names(bfrt_info)
+        self._rw(target).instrumentation = self
+        return self
+
+    def detach(self, target):
+        rw = self._rw(target)
+        if rw.instrumentation is self:
+            rw.instrumentation = None
+
+    # Instrumentation interface of _ReaderWriterInterface
+
+    def rpc_start(self, rpc, req):
+        if rpc == "Write":
+            entities = req.updates
+            first = entities[0].entity if len(entities) else None
+        else:
+            entities = req.entities
+            first = entities[0] if len(entities) else None
+        table_id = None
+        operation = rpc.upper()
+        if first is not None:
+            kind = first.WhichOneof("entity")
+            if kind is not None:
+                table_id = getattr(getattr(first, kind), "table_id", None)
+            if kind == "table_entry":
+                if rpc == "Write":
+                    operation = UPDATE_TYPES.get(req.updates[0].type, "UNSPECIFIED")
+            elif kind is not None:
+                operation = ENTITY_OPERATIONS.get(kind, kind.upper())
+        table = self.table_names.get(table_id, table_id if table_id is not None else "")
+        request_bytes = req.ByteSize() if self.sizes else 0
+        n = len(req.updates) if rpc == "Write" else 0
+        # rpc, table, operation, start, request bytes, response bytes, entities, update errors
+        return [rpc, table, operation, time.perf_counter(), request_bytes, 0, n, None]
+
+    def rpc_start_serialized(self, rpc, data, labels):
+        """rpc_start of a request sent as bytes; labels is (table_id, update type, updates)."""
+        table_id, update_type, n = labels if labels is not None else (None, None, 0)
+        table = self.table_names.get(table_id, table_id if table_id is not None else "")
+        operation = UPDATE_TYPES.get(update_type, "UNSPECIFIED") if update_type is not None else rpc.upper()
+        return [rpc, table, operation, time.perf_counter(), len(data) if self.sizes else 0, 0, n, None]
+
+    def rpc_response(self, token, resp):
+        if self.sizes:
+            token[5] += resp.ByteSize()
+        if token[0] == "Read":
+            token[6] += len(resp.entities)
+        elif len(resp.status):
+            errors = token[7] = token[7] or {}
+            for status in resp.status:
+                if status.canonical_code != code_pb2.OK:
+                    code = code_pb2.Code.Name(status.canonical_code)
+                    errors[code] = errors.get(code, 0) + 1
+
+    def rpc_end(self, token, code):
+        seconds = time.perf_counter() - token[3]
+        rpc, table, operation = token[0], token[1], token[2]
+        key = (rpc, table, operation)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = _Series(len(self.buckets))
+            series.buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+            series.sum += seconds
+            series.count += 1
+            series.request_bytes += token[4]
+            series.response_bytes += token[5]
+            series.entities += token[6]
+            series.codes[code] = series.codes.get(code, 0) + 1
+            if token[7]:
+                for error, count in token[7].items():
+                    series.update_errors[error] = series.update_errors.get(error, 0) + count
+        if self.callback is not None:
+            try:
+                self.callback(RpcRecord(rpc, table, operation, seconds, token[4], token[5], token[6], code))
+            except Exception as e:
+                log.error("RPC metrics callback failed: {}".format(e))
+
+    # Export
+
+    def reset(self):
+        with self._lock:
+            self.series = OrderedDict()
+
+    def snapshot(self):
+        """dict of (rpc, table, operation) -> dict of the aggregates."""
+        with self._lock:
+            return OrderedDict((key, {
+                "count": s.count, "seconds": s.sum, "request_bytes": s.request_bytes,
+                "response_bytes": s.response_bytes, "entities": s.entities, "codes": dict(s.codes),
+                "update_errors": dict(s.update_errors),
+                "buckets": OrderedDict(zip(self.buckets + (float("inf"),), s.buckets)),
+            }) for key, s in self.series.items())
+
+    def prometheus(self, prefix="bfrt_rpc"):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            series = [(key, s.buckets[:], s.sum, s.count, s.request_bytes, s.response_bytes, s.entities,
+                       dict(s.codes), dict(s.update_errors)) for key, s in self.series.items()]
+        lines = []
+
+        def header(name, kind, text):
+            lines.append("# HELP {}_{} {}".format(prefix, name, text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+
+        header("duration_seconds", "histogram", "Time from request to last response of BFRT RPCs.")
+        for (rpc, table, operation), buckets, total, count, _, _, _, _, _ in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_duration_seconds_bucket{} {}".format(
+                    prefix, _labels(rpc=rpc, table=table, operation=operation, le=le), cumulative))
+            labels = _labels(rpc=rpc, table=table, operation=operation)
+            lines.append("{}_duration_seconds_sum{} {!r}".format(prefix, labels, total))
+            lines.append("{}_duration_seconds_count{} {}".format(prefix, labels, count))
+
+        for name, index, text in (("request_bytes_total", 4, "Bytes of BFRT requests."),
+                                  ("response_bytes_total", 5, "Bytes of BFRT responses."),
+                                  ("entities_total", 6, "Updates written and entities read.")):
+            header(name, "counter", text)
+            for s in series:
+                rpc, table, operation = s[0]
+                lines.append("{}_{}{} {}".format(prefix, name, _labels(rpc=rpc, table=table, operation=operation),
+                                                 s[index]))
+
+        header("requests_total", "counter", "BFRT RPCs by gRPC status code.")
+        for s in series:
+            rpc, table, operation = s[0]
+            for code, n in sorted(s[7].items()):
+                lines.append("{}_requests_total{} {}".format(
+                    prefix, _labels(rpc=rpc, table=table, operation=operation, code=code), n))
+
+        header("update_errors_total", "counter", "Failed updates reported in WriteResponse status.")
+        for s in series:
+            rpc, table, operation = s[0]
+            for code, n in sorted(s[8].items()):
+                lines.append("{}_update_errors_total{} {}".format(
+                    prefix, _labels(rpc=rpc, table=table, operation=operation, code=code), n))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,270 @@
+# bfrt_controller/poller.py
+
+"""
+poller.py
+
+Periodic delta polling of registers and counters.
+
+Dumping a register every few seconds and comparing the dumps downstream moves the whole
+table through the pipeline on every interval although only a handful of indexes usually
+change. A Poller reads each watched table with the NumPy readers, keeps the previous
+snapshot as arrays and emits a ChangeSet holding only the indexes whose value changed,
+with their new values, the per-interval deltas and the rates per second.
+
+How the values are fetched is controlled by the sync mode:
+    SYNC_FROM_HW -- every poll reads from hardware (flag from_hw), like register.py
+    SYNC_OPERATION -- every sync_every polls the table Sync operation copies the hardware
+                      values into the software shadow in the driver, the reads are served
+                      from the shadow
+    SYNC_NONE -- only read the software shadow, something else keeps it in sync
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .logger import log
+from .readers import CounterReader, RegisterReader
+
+SYNC_FROM_HW = "from_hw"
+SYNC_OPERATION = "operation"
+SYNC_NONE = "none"
+SYNC_MODES = (SYNC_FROM_HW, SYNC_OPERATION, SYNC_NONE)
+
+REGISTER = "register"
+COUNTER = "counter"
+
+
+class ChangeSet:
+    """Changed indexes of one table between two polls.
+
+    Attributes:
+        name -- table name
+        kind -- REGISTER or COUNTER
+        timestamp -- time.time() of the poll
+        interval -- seconds between the previous and this poll
+        index -- uint32 array of the changed indexes
+        values -- OrderedDict of field name -> new values of the changed indexes
+        deltas -- OrderedDict of field name -> int64 change since the previous poll
+        rates -- OrderedDict of field name -> float64 change per second
+
+    Register fields are named like in RegisterArrays ("f1", "first", ...) and have one
+    column per pipe unless the register was added with a pipe. Counter fields are
+    "packets" and "bytes".
+    """
+
+    def __init__(self, name, kind, timestamp, interval, index, values, deltas, rates):
+        self.name = name
+        self.kind = kind
+        self.timestamp = timestamp
+        self.interval = interval
+        self.index = index
+        self.values = values
+        self.deltas = deltas
+        self.rates = rates
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return "ChangeSet({}, {} changed over {:.3f}s)".format(self.name, len(self.index), self.interval)
+
+
+class _Watch:
+    """A watched table, its reader and the previous snapshot."""
+
+    def __init__(self, name, kind, table, reader, sync_op):
+        self.name = name
+        self.kind = kind
+        self.table = table
+        self.reader = reader
+        self.sync_op = sync_op
+        self.index = None
+        self.fields = None
+        self.read_at = None
+
+    def read(self):
+        """Current (index, OrderedDict of fields), sorted by index."""
+        if self.kind == REGISTER:
+            arrays = self.reader.read()
+            index, fields = arrays.index, arrays.fields
+        else:
+            arrays = self.reader.read_all()
+            index, fields = arrays.index, OrderedDict((("packets", arrays.packets), ("bytes", arrays.bytes)))
+        if len(index) > 1 and np.any(index[1:] < index[:-1]):
+            order = np.argsort(index, kind="stable")
+            index = index[order]
+            fields = OrderedDict((name, arr[order]) for name, arr in fields.items())
+        return index, fields
+
+    def diff(self, index, fields, timestamp, read_at):
+        """ChangeSet against the previous snapshot, which is then replaced. Indexes that
+        were not present in the previous snapshot count as changed from 0.
+        """
+        interval = read_at - self.read_at
+        if np.array_equal(index, self.index):
+            previous = self.fields
+        else:
+            previous = OrderedDict((name, np.zeros_like(arr)) for name, arr in fields.items())
+            if len(self.index):
+                pos = np.minimum(np.searchsorted(self.index, index), len(self.index) - 1)
+                known = self.index[pos] == index
+                for name, prev in previous.items():
+                    prev[known] = self.fields[name][pos[known]]
+
+        deltas = OrderedDict()
+        changed = np.zeros(len(index), dtype=bool)
+        for name, arr in fields.items():
+            delta = arr.astype(np.int64) - previous[name].astype(np.int64)
+            if self.kind == COUNTER:
+                # Counters only grow; a smaller value means the counter was cleared
+                reset = delta < 0
+                delta[reset] = arr[reset].astype(np.int64)
+            deltas[name] = delta
+            changed |= (delta != 0).any(axis=1) if delta.ndim > 1 else delta != 0
+
+        self.index, self.fields, self.read_at = index, fields, read_at
+
+        rows = np.flatnonzero(changed)
+        seconds = interval if interval > 0 else float("nan")
+        return ChangeSet(
+            self.name, self.kind, timestamp, interval, index[rows],
+            OrderedDict((name, arr[rows]) for name, arr in fields.items()),
+            OrderedDict((name, d[rows]) for name, d in deltas.items()),
+            OrderedDict((name, d[rows] / seconds) for name, d in deltas.items()))
+
+
+class Poller:
+    """Polls registers and counters and reports their changes.
+
+    Keyword arguments:
+        controller -- Controller whose tables are polled; tables must be set up
+        interval -- seconds between polls when running in the background
+        sync -- SYNC_FROM_HW, SYNC_OPERATION or SYNC_NONE (see the module docstring)
+        sync_every -- with SYNC_OPERATION, run the Sync operation every sync_every polls
+        on_change -- called with every non empty ChangeSet by the background thread
+    """
+
+    def __init__(self, controller, interval=1.0, sync=SYNC_FROM_HW, sync_every=1, on_change=None):
+        if sync not in SYNC_MODES:
+            raise ValueError("sync must be one of {}".format(SYNC_MODES))
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        if sync_every < 1:
+            raise ValueError("sync_every must be >= 1")
+        self.controller = controller
+        self.interval = interval
+        self.sync = sync
+        self.sync_every = sync_every
+        self.on_change = on_change
+        self.watches = OrderedDict()
+        self.polls = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _table(self, name):
+        if not self.controller.table_exists(name):
+            raise KeyError("Table {} is not setup".format(name))
+        return self.controller.tables[name]
+
+    def _sync_op(self, table, kind):
+        """Name of the table operation syncing the software shadow, or None."""
+        if self.sync != SYNC_OPERATION:
+            return None
+        supported = table.info.operations_supported_get()
+        for op in ("Sync", "SyncRegisters" if kind == REGISTER else "SyncCounters"):
+            if op in supported:
+                return op
+        log.warning("Table {} has no Sync operation, reading it from hardware instead".format(table.info.name_get()))
+        return None
+
+    def _add(self, name, kind, make_reader):
+        table = self._table(name)
+        sync_op = self._sync_op(table, kind)
+        from_hw = self.sync == SYNC_FROM_HW or (self.sync == SYNC_OPERATION and sync_op is None)
+        watch = _Watch(name, kind, table, make_reader(table, from_hw), sync_op)
+        with self._lock:
+            self.watches[name] = watch
+
+    def add_register(self, name, pipe=None):
+        """Watches a register, all pipes or only the given one."""
+        self._add(name, REGISTER,
+                  lambda table, from_hw: RegisterReader(table, self.controller.target, pipe=pipe, from_hw=from_hw))
+
+    def add_counter(self, name):
+        """Watches an indirect counter table ($COUNTER_INDEX keyed)."""
+        self._add(name, COUNTER, lambda table, from_hw: CounterReader(table, self.controller.target, from_hw=from_hw))
+
+    def remove(self, name):
+        with self._lock:
+            self.watches.pop(name, None)
+
+    def reset(self):
+        """Forgets the snapshots; the next poll only primes them again."""
+        with self._lock:
+            for watch in self.watches.values():
+                watch.index = watch.fields = watch.read_at = None
+
+    def poll(self):
+        """Reads every watched table once and returns the list of non empty ChangeSets.
+        The first poll of a table only takes its snapshot.
+        """
+        with self._lock:
+            watches = list(self.watches.values())
+            sync = self.sync == SYNC_OPERATION and self.polls % self.sync_every == 0
+            self.polls += 1
+
+        changes = []
+        for watch in watches:
+            if sync and watch.sync_op is not None:
+                watch.table.operations_execute(self.controller.target, watch.sync_op)
+            timestamp = time.time()
+            read_at = time.monotonic()
+            index, fields = watch.read()
+            if watch.index is None:
+                watch.index, watch.fields, watch.read_at = index, fields, read_at
+                continue
+            change = watch.diff(index, fields, timestamp, read_at)
+            if len(change):
+                changes.append(change)
+        return changes
+
+    def _run(self):
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                for change in self.poll():
+                    if self.on_change is not None:
+                        self.on_change(change)
+            except Exception as e:
+                log.error("Poll failed: {}".format(e))
+            # Fixed rate: skip the missed slots instead of polling back to back
+            next_poll += self.interval
+            now = time.monotonic()
+            if next_poll < now:
+                next_poll = now + self.interval - (now - next_poll) % self.interval
+            self._stop.wait(next_poll - now)
+
+    def start(self):
+        """Starts polling every interval seconds in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bfrt-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
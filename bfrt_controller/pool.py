@@ -0,0 +1,212 @@
+# bfrt_controller/pool.py
+
+"""
+pool.py
+
+Process wide pool of gRPC channels and BFRT clients.
+
+Every Controller creates its own channel, subscribes (with up to 5 tries), fetches
+bf-rt.json and binds. Controllers created with the same ConnectionPool instead share:
+
+    - one channel per switch address, created with the ChannelConfig of the pool
+      (keepalive, HTTP/2 flow control, compression, message size limits)
+    - one subscribed ClientInterface per (address, client_id, device_id), with its
+      bfrt_info and binding, kept open while any Controller uses it and reused by
+      the next one after tear_down
+    - independent, read-only clients (perform_subscribe=False) for parallel read
+      workers, which need neither a stream nor a binding
+
+    pool = ConnectionPool(ChannelConfig(keepalive_time_ms=10000))
+    c = Controller(pool=pool)
+    readers = [Controller(pool=pool, read_only=True) for _ in range(4)]
+"""
+
+import threading
+
+import grpc
+
+from bfrt_controller.bfrt_grpc import client as gc
+
+from .logger import log
+
+GIGABYTE = 1024 ** 3
+
+
+class ChannelConfig:
+    """Options of the channels of a pool.
+
+    Keyword arguments:
+        keepalive_time_ms -- interval of HTTP/2 keepalive pings, None to disable
+        keepalive_timeout_ms -- time to wait for a ping ack before closing the connection
+        keepalive_permit_without_calls -- also ping while no RPC is active, so that idle
+                                          pooled channels notice a restarted switch
+        max_pings_without_data -- pings allowed without data frames (0 = unlimited)
+        bdp_probe -- let gRPC size the HTTP/2 flow control windows to the measured
+                     bandwidth-delay product
+        write_buffer_size -- HTTP/2 write buffer size in bytes, None for the gRPC default
+        max_message_length -- max send and receive message size in bytes
+        compression -- grpc.Compression of the channel (e.g. grpc.Compression.Gzip), or None
+    """
+
+    def __init__(self, keepalive_time_ms=30000, keepalive_timeout_ms=10000, keepalive_permit_without_calls=True,
+                 max_pings_without_data=0, bdp_probe=True, write_buffer_size=None, max_message_length=GIGABYTE,
+                 compression=None):
+        self.keepalive_time_ms = keepalive_time_ms
+        self.keepalive_timeout_ms = keepalive_timeout_ms
+        self.keepalive_permit_without_calls = keepalive_permit_without_calls
+        self.max_pings_without_data = max_pings_without_data
+        self.bdp_probe = bdp_probe
+        self.write_buffer_size = write_buffer_size
+        self.max_message_length = max_message_length
+        self.compression = compression
+
+    def options(self):
+        """Channel arguments for grpc.insecure_channel."""
+        options = [
+            ("grpc.max_send_message_length", self.max_message_length),
+            ("grpc.max_receive_message_length", self.max_message_length),
+            ("grpc.max_metadata_size", self.max_message_length),
+            ("grpc.http2.bdp_probe", int(self.bdp_probe)),
+        ]
+        if self.keepalive_time_ms is not None:
+            options += [
+                ("grpc.keepalive_time_ms", self.keepalive_time_ms),
+                ("grpc.keepalive_timeout_ms", self.keepalive_timeout_ms),
+                ("grpc.keepalive_permit_without_calls", int(self.keepalive_permit_without_calls)),
+                ("grpc.http2.max_pings_without_data", self.max_pings_without_data),
+            ]
+        if self.write_buffer_size is not None:
+            options.append(("grpc.http2.write_buffer_size", self.write_buffer_size))
+        return options
+
+    def channel(self, address):
+        return grpc.insecure_channel(address, options=self.options(), compression=self.compression)
+
+
+class _PooledClient:
+    """A subscribed ClientInterface of the pool with what was fetched through it."""
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.refs = 0
+        self.bfrt_info = None
+        self.bound_p4_name = None
+        self.lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Channels and clients shared by the Controllers of a process.
+
+    Keyword arguments:
+        config -- ChannelConfig of the channels; default keepalive settings if None
+    """
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else ChannelConfig()
+        self.channels = {}
+        self.clients = {}
+        # key -> lock held while the client of key is created
+        self._creating = {}
+        self._lock = threading.Lock()
+
+    def channel(self, address):
+        """Shared channel to address ("ip:port")."""
+        with self._lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                log.debug("Opening channel to {}".format(address))
+                channel = self.channels[address] = self.config.channel(address)
+            return channel
+
+    def client(self, address, client_id=0, device_id=0, notifications=None):
+        """Subscribed ClientInterface for (address, client_id, device_id), created on first
+        use. Every call must be paired with a release(interface).
+        """
+        key = (address, client_id, device_id)
+        with self._lock:
+            pooled = self._acquire(key)
+            if pooled is not None:
+                return pooled.interface
+            # One creation per key: a second subscribe with the same client_id could be
+            # rejected by the switch, and tearing it down would end the stream of the first
+            creating = self._creating.setdefault(key, threading.Lock())
+        with creating:
+            with self._lock:
+                pooled = self._acquire(key)
+            if pooled is not None:
+                return pooled.interface
+            interface = gc.ClientInterface(address, client_id=client_id, device_id=device_id,
+                                           notifications=notifications, channel=self.channel(address))
+            with self._lock:
+                pooled = self.clients[key] = _PooledClient(interface)
+                pooled.refs += 1
+                self._creating.pop(key, None)
+        return interface
+
+    def _acquire(self, key):
+        """Pooled client of key with one more reference, or None. Called with _lock held."""
+        pooled = self.clients.get(key)
+        if pooled is not None:
+            pooled.refs += 1
+        return pooled
+
+    def reader(self, address, client_id=0, device_id=0):
+        """Independent (not subscribed) ClientInterface on the shared channel, for read
+        workers. Independent clients are cheap: no stream, no thread, no binding.
+        """
+        return gc.ClientInterface(address, client_id=client_id, device_id=device_id, perform_subscribe=False,
+                                  channel=self.channel(address))
+
+    def _pooled(self, interface):
+        with self._lock:
+            for pooled in self.clients.values():
+                if pooled.interface is interface:
+                    return pooled
+        return None
+
+    def bfrt_info(self, interface, schema_cache=None, lazy=False):
+        """bfrt_info of a pooled client, fetched once. Independent clients fetch it on every
+        call (through schema_cache if given) and get their p4_name set for their requests.
+        """
+        pooled = self._pooled(interface)
+        if pooled is None:
+            bfrt_info = interface.bfrt_info_get(schema_cache=schema_cache, lazy=lazy)
+            interface.reader_writer_interface.p4_name = bfrt_info.p4_name_get()
+            return bfrt_info
+        with pooled.lock:
+            if pooled.bfrt_info is None:
+                pooled.bfrt_info = interface.bfrt_info_get(schema_cache=schema_cache, lazy=lazy)
+            return pooled.bfrt_info
+
+    def bind(self, interface, p4_name):
+        """Binds a pooled client to p4_name unless it already is."""
+        pooled = self._pooled(interface)
+        if pooled is None:
+            interface.bind_pipeline_config(p4_name)
+            return
+        with pooled.lock:
+            if pooled.bound_p4_name != p4_name:
+                interface.bind_pipeline_config(p4_name)
+                pooled.bound_p4_name = p4_name
+
+    def release(self, interface):
+        """Gives a client back. Pooled clients stay connected for the next user."""
+        pooled = self._pooled(interface)
+        if pooled is not None:
+            with self._lock:
+                pooled.refs = max(0, pooled.refs - 1)
+
+    def close(self):
+        """Tears down all streams and closes all channels."""
+        with self._lock:
+            clients = list(self.clients.values())
+            channels = list(self.channels.values())
+            self.clients = {}
+            self.channels = {}
+        for pooled in clients:
+            if pooled.refs:
+                log.warning("Closing client still used by {} controllers".format(pooled.refs))
+            if not pooled.interface.is_independent:
+                pooled.interface.tear_down_stream()
+        for channel in channels:
+            channel.close()
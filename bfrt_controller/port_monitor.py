@@ -0,0 +1,200 @@
+# bfrt_controller/port_monitor.py
+
+"""
+port_monitor.py
+
+Event-driven tracking of the link state of the switch ports.
+
+The driver sends a port_status_change_notification on the StreamChannel whenever a
+port of $PORT goes up or down, once notifications are enabled with
+attribute_port_status_change_set. A PortStatusMonitor drains these notifications in
+a thread, keeps a live dev port -> up table and calls the registered callbacks with
+a PortEvent per notification, translated to front panel port and lane with the cached
+port map of the PortManager. Failover logic then reacts as soon as the notification
+arrives instead of on the next $PORT_UP poll.
+
+The table is seeded with one $PORT_UP read when the monitor starts. A notification
+received while a read is in flight wins over the value read.
+
+While a monitor runs it is the only consumer of the notifications of the client, so
+PortManager.wait_for_link_up waits on the monitor instead of reading the queue.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+from .logger import log
+
+NOTIFICATION = "port_status_change_notification"
+
+# One port status change. fp_port and lane are None for dev ports missing from the
+# port map (e.g. the CPU port)
+PortEvent = namedtuple("PortEvent", ["timestamp", "dev_port", "fp_port", "lane", "up"])
+
+
+class PortStatusMonitor:
+    """Keeps the link state of the ports from the port status notifications.
+
+    Keyword arguments:
+        port_manager -- PortManager of the switch
+        interface -- gc.ClientInterface receiving the notifications of the stream
+
+    Attributes:
+        events -- number of notifications received
+        failed -- number of callback calls which raised
+    """
+
+    def __init__(self, port_manager, interface):
+        self.port_manager = port_manager
+        self.interface = interface
+        self.events = 0
+        self.failed = 0
+        # dev port -> (up, time.time() of the last change or read)
+        self._state = {}
+        # dev port -> number of the last notification of the port
+        self._seq = {}
+        self._callbacks = []
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._enabled = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_callback(self, callback, dev_ports=None):
+        """Calls callback with a PortEvent for every notification of the given dev
+        ports (all ports by default). Callbacks run on the monitor thread, in the order
+        they were added, and should return quickly.
+        """
+        dev_ports = None if dev_ports is None else frozenset(dev_ports)
+        with self._changed:
+            self._callbacks = self._callbacks + [(callback, dev_ports)]
+
+    def remove_callback(self, callback):
+        with self._changed:
+            self._callbacks = [c for c in self._callbacks if c[0] is not callback]
+
+    def link_state(self):
+        """dict of dev port -> True if up, for every known port."""
+        with self._changed:
+            return {dev_port: up for dev_port, (up, _) in self._state.items()}
+
+    def is_up(self, dev_port):
+        """True or False, or None if the state of the port is not known."""
+        with self._changed:
+            state = self._state.get(dev_port)
+        return None if state is None else state[0]
+
+    def changed_at(self, dev_port):
+        """time.time() of the last notification (or read) of the port, or None."""
+        with self._changed:
+            state = self._state.get(dev_port)
+        return None if state is None else state[1]
+
+    def refresh(self, dev_ports=None):
+        """Reads $PORT_UP of the given dev ports (all added ports by default) into the
+        table, except for ports notified while reading.
+
+        Returns:
+            dict of dev port -> True if up, for the ports read
+        """
+        with self._changed:
+            seq = dict(self._seq)
+        up = self.port_manager.read_port_up(dev_ports)
+        now = time.time()
+        with self._changed:
+            for dev_port, value in up.items():
+                if self._seq.get(dev_port) == seq.get(dev_port):
+                    self._state[dev_port] = (value, now)
+                else:
+                    up[dev_port] = self._state[dev_port][0]
+            self._changed.notify_all()
+        return up
+
+    def wait_for_link_up(self, dev_ports, timeout):
+        """Waits until the given ports are up, refreshing them first.
+
+        Returns:
+            dict of dev port -> True if up
+        """
+        dev_ports = list(dev_ports)
+        if not dev_ports:
+            return {}
+        self.refresh(dev_ports)
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                up = {p: self._state.get(p, (False, None))[0] for p in dev_ports}
+                remaining = deadline - time.monotonic()
+                if all(up.values()) or remaining <= 0:
+                    return up
+                self._changed.wait(remaining)
+
+    def _event(self, notification):
+        dev_port = self.port_manager._notification_dev_port(notification)
+        if dev_port is None:
+            return None
+        success, fp_port, lane = self.port_manager.get_fp_port(dev_port)
+        if not success:
+            fp_port = None
+        event = PortEvent(time.time(), dev_port, fp_port, lane, notification.port_up)
+        with self._changed:
+            self.events += 1
+            self._seq[dev_port] = self.events
+            self._state[dev_port] = (event.up, event.timestamp)
+            self._changed.notify_all()
+            callbacks = self._callbacks
+        return event, callbacks
+
+    def _dispatch(self, event, callbacks):
+        for callback, dev_ports in callbacks:
+            if dev_ports is not None and event.dev_port not in dev_ports:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                self.failed += 1
+                log.error("Port status callback failed for dev port {}: {}".format(event.dev_port, e))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                notification = self.interface._get_stream_message(NOTIFICATION, 0.1)
+                if notification is None:
+                    continue
+                handled = self._event(notification.port_status_change_notification)
+                if handled is not None:
+                    self._dispatch(*handled)
+            except Exception as e:
+                log.error("Port status notification failed: {}".format(e))
+
+    def start(self):
+        """Enables the notifications on $PORT (once per monitor), starts draining them
+        and seeds the table with the current state of the added ports."""
+        if self.running:
+            return
+        if not self._enabled:
+            self.port_manager.port_table.attribute_port_status_change_set(self.port_manager.target, enable=True)
+            self._enabled = True
+        self.port_manager.prefetch_port_map()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bfrt-port-status", daemon=True)
+        self._thread.start()
+        self.refresh()
+
+    def stop(self, timeout=None):
+        """Stops draining. Notifications stay enabled on $PORT."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
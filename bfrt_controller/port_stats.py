@@ -0,0 +1,235 @@
+# bfrt_controller/port_stats.py
+
+"""
+port_stats.py
+
+Periodic sampling of the $PORT_STAT counters of the switch ports.
+
+A PortStatsSampler reads the counters of all sampled ports with one batched Read per
+interval, decoding the response straight into NumPy arrays like the readers in
+readers.py, and keeps the last capacity samples in a ring buffer: a time axis plus a
+(capacity, ports, fields) array of counter values. Rates per second of any counter over
+any number of samples are computed from the buffer, so a whole switch can be monitored
+at sub-second resolution with memory fixed at construction.
+
+Reading from_hw makes the driver fetch every counter from the MACs during the Read.
+The default reads the software copy instead, which the driver refreshes every
+poll_intvl_ms milliseconds; set poll_intvl_ms (attribute_port_stat_poll_intvl_set) to
+match the sampling interval.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .logger import log
+from .readers import index_read_request, request_stream
+
+# Sampled counters: short name -> $PORT_STAT field
+DEFAULT_FIELDS = OrderedDict((
+    ("rx_bytes", "$OctetsReceived"),
+    ("tx_bytes", "$OctetsTransmittedTotal"),
+    ("rx_packets", "$FramesReceivedAll"),
+    ("tx_packets", "$FramesTransmittedAll"),
+    ("rx_errors", "$FramesReceivedwithFCSError"),
+    ("tx_errors", "$FramesTransmittedwithError"),
+))
+
+DEFAULT_CAPACITY = 600
+
+# One sample handed to the on_sample callback. values is a (ports, fields) uint64
+# array in the order of dev_ports and of the sampler fields
+PortStatsSample = namedtuple("PortStatsSample", ["timestamp", "dev_ports", "values"])
+
+
+class PortStatsSampler:
+    """Samples $PORT_STAT of a set of ports into a ring buffer.
+
+    Keyword arguments:
+        port_manager -- PortManager of the switch
+        dev_ports -- dev ports to sample; by default the added ports of port_manager,
+                     following its registry as ports are added and removed
+        interval -- seconds between samples when running in the background
+        capacity -- number of samples kept
+        fields -- dict of short name -> $PORT_STAT field name to sample
+        poll_intvl_ms -- if set, the driver's port stat poll interval is set to it
+        from_hw -- read the counters from hardware instead of the driver's copy
+        on_sample -- called with every PortStatsSample by the background thread
+
+    Attributes:
+        dev_ports -- uint32 array of the sampled dev ports
+        fields -- list of the short names of the sampled counters
+    """
+
+    def __init__(self, port_manager, dev_ports=None, interval=1.0, capacity=DEFAULT_CAPACITY,
+                 fields=DEFAULT_FIELDS, poll_intvl_ms=None, from_hw=False, on_sample=None):
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        if capacity < 2:
+            raise ValueError("capacity must be >= 2")
+        self.port_manager = port_manager
+        self.table = port_manager.port_stats_table
+        self.target = port_manager.target
+        self.interval = interval
+        self.capacity = capacity
+        self.flags = {"from_hw": from_hw}
+        self.on_sample = on_sample
+
+        info = self.table.info
+        self.key_id = info.key_field_id_get("$DEV_PORT")
+        self.key_size = info.key_field_size_get("$DEV_PORT")[0]
+        self.fields = list(fields)
+        self.field_ids = [info.data_field_id_get(name) for name in fields.values()]
+        self._column = {field_id: i for i, field_id in enumerate(self.field_ids)}
+
+        if poll_intvl_ms is not None:
+            self.table.attribute_port_stat_poll_intvl_set(self.target, int(poll_intvl_ms))
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._follow = dev_ports is None
+        self._set_ports(port_manager.active_ports if dev_ports is None else dev_ports)
+
+    def set_ports(self, dev_ports):
+        """Changes the sampled ports. The buffered samples are dropped.
+
+        Once called, the sampled ports no longer follow the port registry.
+        """
+        self._follow = False
+        self._set_ports(dev_ports)
+
+    def _set_ports(self, dev_ports):
+        dev_ports = np.unique(np.asarray(list(dev_ports), dtype=np.uint32))
+        req = index_read_request(self.table, self.target, self.flags, self.key_id, self.key_size,
+                                 dev_ports.tolist())
+        # Only ask for the sampled counters
+        for entity in req.entities:
+            for field_id in self.field_ids:
+                entity.table_entry.data.fields.add().field_id = field_id
+        row = {int(p): i for i, p in enumerate(dev_ports)}
+        with self._lock:
+            self.dev_ports = dev_ports
+            self._ports = (dev_ports, row, req)
+            self._times = np.zeros(self.capacity, dtype=np.float64)
+            self._values = np.zeros((self.capacity, len(dev_ports), len(self.fields)), dtype=np.uint64)
+            self._count = 0
+            self._next = 0
+
+    def _read(self, dev_ports, row, req):
+        """Counters of the given ports as a (ports, fields) array."""
+        values = np.zeros((len(dev_ports), len(self.fields)), dtype=np.uint64)
+        column, key_id = self._column, self.key_id
+        for rep in request_stream(self.table, req):
+            for entity in rep.entities:
+                entry = entity.table_entry
+                i = None
+                for key_field in entry.key.fields:
+                    if key_field.field_id == key_id:
+                        i = row.get(int.from_bytes(key_field.exact.value, "big"))
+                if i is None:
+                    continue
+                for field in entry.data.fields:
+                    j = column.get(field.field_id)
+                    if j is not None:
+                        values[i, j] = int.from_bytes(field.stream, "big")
+        return values
+
+    def sample(self):
+        """Reads the counters once and appends them to the buffer.
+
+        Returns:
+            PortStatsSample
+        """
+        if self._follow:
+            registry = self.port_manager.active_ports
+            if len(registry) != len(self.dev_ports) or set(registry) != set(self.dev_ports.tolist()):
+                self._set_ports(registry)
+        ports = self._ports
+        dev_ports = ports[0]
+        values = self._read(*ports) if len(dev_ports) else np.zeros((0, len(self.fields)), dtype=np.uint64)
+        now = time.time()
+        with self._lock:
+            # Dropped if set_ports changed the ports during the read
+            if self._ports is ports:
+                self._times[self._next] = now
+                self._values[self._next] = values
+                self._next = (self._next + 1) % self.capacity
+                self._count = min(self._count + 1, self.capacity)
+        return PortStatsSample(now, dev_ports, values)
+
+    def samples(self, dev_port=None):
+        """Buffered samples, oldest first.
+
+        Returns:
+            (times, values): float64 array of time.time() per sample and uint64 array of
+            (samples, ports, fields), or (samples, fields) for a single dev_port
+        """
+        with self._lock:
+            order = (np.arange(self._count) + self._next - self._count) % self.capacity
+            times = self._times[order]
+            if dev_port is None:
+                return times, self._values[order]
+            return times, self._values[order, self._ports[1][dev_port]]
+
+    def rates(self, window=1):
+        """Counter increase per second of every port over the last window samples.
+
+        Returns:
+            OrderedDict of short field name -> float64 array aligned with dev_ports, or
+            None if fewer than window + 1 samples are buffered
+        """
+        if window < 1 or window >= self.capacity:
+            raise ValueError("window must be in [1, {})".format(self.capacity))
+        with self._lock:
+            if self._count <= window:
+                return None
+            last = (self._next - 1) % self.capacity
+            first = (self._next - 1 - window) % self.capacity
+            seconds = self._times[last] - self._times[first]
+            current = self._values[last]
+            delta = current.astype(np.int64) - self._values[first].astype(np.int64)
+        # A smaller value means the counters were cleared in between
+        reset = delta < 0
+        delta[reset] = current[reset].astype(np.int64)
+        rates = delta / seconds if seconds > 0 else np.full(delta.shape, np.nan)
+        return OrderedDict((name, rates[:, j]) for j, name in enumerate(self.fields))
+
+    def _run(self):
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                sample = self.sample()
+                if self.on_sample is not None:
+                    self.on_sample(sample)
+            except Exception as e:
+                log.error("Port stats sample failed: {}".format(e))
+            # Fixed rate: skip the missed slots instead of sampling back to back
+            next_sample += self.interval
+            now = time.monotonic()
+            if next_sample < now:
+                next_sample = now + self.interval - (now - next_sample) % self.interval
+            self._stop.wait(next_sample - now)
+
+    def start(self):
+        """Starts sampling every interval seconds in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bfrt-port-stats", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,12 +1,92 @@
+from collections import namedtuple
+
+import google.rpc.code_pb2 as code_pb2
+
+from .bulk import BulkWriter, ERROR_IN_RESP
 from .logger import log
+from .port_monitor import PortStatusMonitor
+from .port_stats import PortStatsSampler
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
 from bfrt_controller.bfrt_grpc.client import BfruntimeRpcException
 
+SPEED_CONVERSION_TABLE = {
+    10: 'BF_SPEED_10G',
+    25: 'BF_SPEED_25G',
+    40: 'BF_SPEED_40G',
+    50: 'BF_SPEED_50G',
+    100: 'BF_SPEED_100G'
+}
+
+FEC_CONVERSION_TABLE = {
+    'none': 'BF_FEC_TYP_NONE',
+    'fc': 'BF_FEC_TYP_FC',
+    'rs': 'BF_FEC_TYP_RS'
+}
+
+AN_CONVERSION_TABLE = {
+    'default': 'PM_AN_DEFAULT',
+    'enable': 'PM_AN_FORCE_ENABLE',
+    'disable': 'PM_AN_FORCE_DISABLE'
+}
+
+# Configuration of an added port, in the units of add_port. Values read from the
+# switch without an entry in the conversion tables are kept as the raw strings
+PortConfig = namedtuple('PortConfig', ['speed', 'fec', 'an'])
+
+# Outcome of one port of add_ports_batched. up is the link state after waiting for
+# link-up, or None if not waited for
+PortResult = namedtuple('PortResult', ['fp_port', 'lane', 'dev_port', 'success', 'error', 'up'])
+
+SPEED_FROM_SWITCH = {v: k for k, v in SPEED_CONVERSION_TABLE.items()}
+FEC_FROM_SWITCH = {v: k for k, v in FEC_CONVERSION_TABLE.items()}
+AN_FROM_SWITCH = {v: k for k, v in AN_CONVERSION_TABLE.items()}
+
+
+class PortReconcileReport:
+    ''' Outcome of reconcile_ports (or of a dry run). Every change is a tuple
+        (front panel port, lane, dev port, PortConfig); front panel port and lane
+        are None for ports missing from $PORT_HDL_INFO (e.g. the CPU port).
+
+        Attributes:
+            to_add -- ports to add
+            to_modify -- ports whose FEC or autonegotiation differs, modified in place
+            to_readd -- ports whose speed differs, deleted and added again since
+                        the speed of an added port cannot be changed
+            to_delete -- added ports which are not desired (only with prune)
+            unchanged -- number of desired ports already configured as desired
+            errors -- error messages of the ports which could not be resolved or
+                      written, or were listed twice with different settings
+    '''
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.to_add = []
+        self.to_modify = []
+        self.to_readd = []
+        self.to_delete = []
+        self.unchanged = 0
+        self.errors = []
+
+    @property
+    def changes(self):
+        return len(self.to_add) + len(self.to_modify) + len(self.to_readd) + len(self.to_delete)
+
+    def __str__(self):
+        return '{}ports: {} to add, {} to modify, {} to re-add, {} to delete, {} unchanged, {} errors'.format(
+            '[dry run] ' if self.dry_run else '', len(self.to_add), len(self.to_modify),
+            len(self.to_readd), len(self.to_delete), self.unchanged, len(self.errors))
+
+
 class PortManager:
-    def __init__(self, target, gc, bfrt_info):
+    def __init__(self, target, gc, bfrt_info, interface=None):
         self.log = log
         self.target = target
         self.gc = gc
 
+        # ClientInterface receiving the port status notifications, needed to wait
+        # for link-up
+        self.interface = interface
+
         # get port table
         self.port_table = bfrt_info.table_get('$PORT')
 
@@ -16,22 +96,119 @@ class PortManager:
         # Front-panel port to dev port lookup table
         self.port_hdl_info_table = bfrt_info.table_get('$PORT_HDL_INFO')
 
-        # dev port to FP port reverse lookup table (lazy initialization)
+        # (FP port, lane) -> dev port and dev port -> (FP port, lane) maps,
+        # filled by one read of $PORT_HDL_INFO (lazy initialization, see
+        # prefetch_port_map)
+        self.fp_port_to_dev_port = None
         self.dev_port_to_fp_port = None
 
-        # List of active ports
-        self.active_ports = []
+        # Registry of the added ports: dev port -> PortConfig. Seeded by one
+        # $PORT read on first use, so ports added by other processes are known
+        # (see load_ports)
+        self.ports = None
 
-    def get_dev_port(self, fp_port, lane):
-        ''' Convert front-panel port to dev port.
+        # PortStatusMonitor of the port status notifications, see
+        # port_status_monitor
+        self.monitor = None
+
+    @property
+    def active_ports(self):
+        ''' Dev ports of all added ports. '''
+        return list(self._registry())
+
+    def load_ports(self):
+        ''' Read all entries of $PORT and rebuild the port registry from them.
+
+            Returns:
+                dict of dev port -> PortConfig
+
+            Raises:
+                BfruntimeRpcException if $PORT could not be read; the registry
+                is then left unchanged
+        '''
+        ports = {}
+        resp = self.port_table.entry_get(self.target, [], {'from_hw': False})
+        for v, k in resp:
+            v = v.to_dict()
+            dev_port = k.to_dict()['$DEV_PORT']['value']
+            ports[dev_port] = PortConfig(
+                SPEED_FROM_SWITCH.get(v.get('$SPEED'), v.get('$SPEED')),
+                FEC_FROM_SWITCH.get(v.get('$FEC'), v.get('$FEC')),
+                AN_FROM_SWITCH.get(v.get('$AUTO_NEGOTIATION'), v.get('$AUTO_NEGOTIATION')))
+        self.ports = ports
+        return ports
+
+    def _registry(self):
+        ''' The port registry, seeded from $PORT on first use. If $PORT cannot
+            be read, an empty registry is returned for this call only and the
+            read is retried on the next one.
+        '''
+        if self.ports is None:
+            try:
+                self.load_ports()
+            except BfruntimeRpcException as e:
+                self.log.warning('Could not read $PORT: {}'.format(e))
+                return {}
+        return self.ports
+
+    def prefetch_port_map(self, force=False):
+        ''' Read the whole $PORT_HDL_INFO table once and build both the
+            front-panel -> dev port and the dev port -> front-panel maps.
+            Later get_dev_port/get_fp_port calls are served from memory.
 
             Keyword arguments:
-                fp_port -- front panel port number
-                lane -- lane number
+                force -- read the table again even if the maps are already loaded
 
             Returns:
-                (success flag, dev port or error message)
+                number of (front panel port, lane) pairs
         '''
+        if self.fp_port_to_dev_port is not None and not force:
+            return len(self.fp_port_to_dev_port)
+
+        fp_port_to_dev_port = {}
+        dev_port_to_fp_port = {}
+
+        # Get all ports
+        try:
+            resp = self.port_hdl_info_table.entry_get(self.target, [],
+                                                      {'from_hw': False})
+            for v, k in resp:
+                v = v.to_dict()
+                k = k.to_dict()
+                fp = (k['$CONN_ID']['value'], k['$CHNL_ID']['value'])
+                fp_port_to_dev_port[fp] = v['$DEV_PORT']
+                dev_port_to_fp_port[v['$DEV_PORT']] = fp
+        except BfruntimeRpcException as e:
+            # Lookups fall back to a single-entry read per port
+            self.log.warning('Could not read $PORT_HDL_INFO: {}'.format(e))
+
+        self.fp_port_to_dev_port = fp_port_to_dev_port
+        self.dev_port_to_fp_port = dev_port_to_fp_port
+        return len(fp_port_to_dev_port)
+
+    def invalidate_port_map(self, fp_port=None, lane=None):
+        ''' Forget cached port mappings.
+
+            Keyword arguments:
+                fp_port -- front panel port number, or None to drop both maps
+                           (they are read again on the next lookup)
+                lane -- lane number, or None for all lanes of fp_port; the
+                        forgotten ports are looked up again with a single read
+                        when needed
+        '''
+        if fp_port is None:
+            self.fp_port_to_dev_port = None
+            self.dev_port_to_fp_port = None
+            return
+        if self.fp_port_to_dev_port is None:
+            return
+        for fp in [fp for fp in self.fp_port_to_dev_port
+                   if fp[0] == fp_port and lane in (None, fp[1])]:
+            dev_port = self.fp_port_to_dev_port.pop(fp)
+            self.dev_port_to_fp_port.pop(dev_port, None)
+
+    def _lookup_dev_port(self, fp_port, lane):
+        ''' Single-entry $PORT_HDL_INFO read of one front-panel port. '''
         resp = self.port_hdl_info_table.entry_get(self.target, [
             self.port_hdl_info_table.make_key([
                 self.gc.KeyTuple('$CONN_ID', fp_port),
@@ -40,40 +217,73 @@ class PortManager:
         ], {'from_hw': False})
 
         try:
-            dev_port = next(resp)[0].to_dict()['$DEV_PORT']
+            return next(resp)[0].to_dict()['$DEV_PORT']
         except BfruntimeRpcException:
-            return (False, 'Port {}/{} not found!'.format(fp_port, lane))
-        else:
+            return None
+
+    def get_dev_port(self, fp_port, lane):
+        ''' Convert front-panel port to dev port.
+
+            Keyword arguments:
+                fp_port -- front panel port number
+                lane -- lane number
+
+            Returns:
+                (success flag, dev port or error message)
+        '''
+        self.prefetch_port_map()
+        dev_port = self.fp_port_to_dev_port.get((fp_port, lane))
+        if dev_port is not None:
             return (True, dev_port)
-        
+
+        # Not cached (invalidated, or the prefetch failed): ask the switch
+        dev_port = self._lookup_dev_port(fp_port, lane)
+        if dev_port is None:
+            return (False, 'Port {}/{} not found!'.format(fp_port, lane))
+        self.fp_port_to_dev_port[(fp_port, lane)] = dev_port
+        self.dev_port_to_fp_port[dev_port] = (fp_port, lane)
+        return (True, dev_port)
+
     def get_fp_port(self, dev_port):
         ''' Get front panel port from dev port.
 
             Returns:
                 (success flag, port or error message, lane or None)
         '''
-
-        # If we haven't filled the reverse mapping dict yet, do so
-        if self.dev_port_to_fp_port is None:
-            self.dev_port_to_fp_port = {}
-
-            # Get all ports
-            resp = self.port_hdl_info_table.entry_get(self.target, [],
-                                                      {'from_hw': False})
-
-            # Fill in dictionary
-            for v, k in resp:
-                v = v.to_dict()
-                k = k.to_dict()
-                self.dev_port_to_fp_port[v['$DEV_PORT']] = (
-                    k['$CONN_ID']['value'], k['$CHNL_ID']['value'])
+        self.prefetch_port_map()
 
         # Look up front panel port/lane from dev port
         if dev_port in self.dev_port_to_fp_port:
             return (True,) + self.dev_port_to_fp_port[dev_port]
         else:
             return (False, 'Invalid dev port {}'.format(dev_port), None)
-        
+
+    def stats_sampler(self, **kwargs):
+        ''' PortStatsSampler of the $PORT_STAT counters of the added ports.
+
+            Keyword arguments are those of PortStatsSampler (dev_ports, interval,
+            capacity, fields, poll_intvl_ms, from_hw, on_sample).
+        '''
+        return PortStatsSampler(self, **kwargs)
+
+    def _port_key(self, dev_port):
+        return self.port_table.make_key([self.gc.KeyTuple('$DEV_PORT', dev_port)])
+
+    def _port_data(self, speed, fec, an):
+        return self.port_table.make_data([
+            self.gc.DataTuple('$SPEED', str_val=SPEED_CONVERSION_TABLE[speed]),
+            self.gc.DataTuple('$FEC', str_val=FEC_CONVERSION_TABLE[fec]),
+            self.gc.DataTuple('$AUTO_NEGOTIATION', str_val=AN_CONVERSION_TABLE[an]),
+            self.gc.DataTuple('$PORT_ENABLE', bool_val=True)
+        ])
+
+    def _port_settings_data(self, fec, an):
+        ''' Data of a MODIFY of the settings which can change on an added port. '''
+        return self.port_table.make_data([
+            self.gc.DataTuple('$FEC', str_val=FEC_CONVERSION_TABLE[fec]),
+            self.gc.DataTuple('$AUTO_NEGOTIATION', str_val=AN_CONVERSION_TABLE[an])
+        ])
+
     def add_port(self, front_panel_port, lane, speed, fec, an):
         ''' Add one port.
 
@@ -88,56 +298,36 @@ class PortManager:
                 (success flag, None or error message)
         '''
 
-        speed_conversion_table = {
-            10: 'BF_SPEED_10G',
-            25: 'BF_SPEED_25G',
-            40: 'BF_SPEED_40G',
-            50: 'BF_SPEED_50G',
-            100: 'BF_SPEED_100G'
-        }
-
-        fec_conversion_table = {
-            'none': 'BF_FEC_TYP_NONE',
-            'fc': 'BF_FEC_TYP_FC',
-            'rs': 'BF_FEC_TYP_RS'
-        }
-
-        an_conversion_table = {
-            'default': 'PM_AN_DEFAULT',
-            'enable': 'PM_AN_FORCE_ENABLE',
-            'disable': 'PM_AN_FORCE_DISABLE'
-        }
-
         success, dev_port = self.get_dev_port(front_panel_port, lane)
         if not success:
             return (False, dev_port)
 
-        if dev_port in self.active_ports:
-            msg = 'Port {}/{} already in active ports list'.format(
-                front_panel_port, lane)
+        ports = self._registry()
+        config = PortConfig(speed, fec, an)
+        if dev_port in ports:
+            if ports[dev_port] == config:
+                self.log.info('Port {}/{} already added'.format(front_panel_port, lane))
+                return (True, None)
+            msg = 'Port {}/{} already added as {}G {} {}; use reconcile_ports to change it'.format(
+                front_panel_port, lane, *ports[dev_port])
             self.log.warning(msg)
             return (False, msg)
 
-        self.port_table.entry_add(self.target, [
-            self.port_table.make_key([self.gc.KeyTuple('$DEV_PORT', dev_port)])
-        ], [
-            self.port_table.make_data([
-                self.gc.DataTuple('$SPEED',
-                                  str_val=speed_conversion_table[speed]),
-                self.gc.DataTuple('$FEC', str_val=fec_conversion_table[fec]),
-                self.gc.DataTuple('$AUTO_NEGOTIATION',
-                                  str_val=an_conversion_table[an]),
-                self.gc.DataTuple('$PORT_ENABLE', bool_val=True)
-            ])
-        ])
+        try:
+            self.port_table.entry_add(self.target, [self._port_key(dev_port)],
+                                      [self._port_data(speed, fec, an)])
+        except BfruntimeRpcException:
+            # The cached dev port may be stale
+            self.invalidate_port_map(front_panel_port, lane)
+            raise
         self.log.info('Added port: {}/{} {}G {} {}'.format(
             front_panel_port, lane, speed, fec, an))
 
-        self.active_ports.append(dev_port)
+        ports[dev_port] = config
 
         return (True, None)
     
-    def add_ports(self, port_list):
+    def add_ports(self, port_list, batched=False, link_up_timeout=None):
         ''' Add ports.
 
             Keyword arguments:
@@ -147,11 +337,25 @@ class PortManager:
                  speed is the port bandwidth in Gbps, one of {10, 25, 40, 50, 100}
                  fec (forward error correction) is one of {'none', 'fc', 'rs'}
                  autoneg (autonegotiation) is one of {'default', 'enable', 'disable'}
+                batched -- add all ports with one write (see add_ports_batched)
+                           instead of stopping at the first error
+                link_up_timeout -- with batched, seconds to wait for the added
+                                   ports to come up; a port still down is an error
 
             Returns:
                 (success flag, None or error message)
         '''
 
+        if batched:
+            results = self.add_ports_batched(port_list, link_up_timeout)
+            errors = [r.error for r in results if not r.success]
+            if link_up_timeout is not None:
+                errors += ['Port {}/{} is down after {}s'.format(r.fp_port, r.lane, link_up_timeout)
+                           for r in results if r.success and not r.up]
+            if errors:
+                return (False, '; '.join(errors))
+            return (True, None)
+
         for (front_panel_port, lane, speed, fec, an) in port_list:
             success, error_msg = self.add_port(front_panel_port, lane, speed,
                                                fec, an)
@@ -159,7 +363,170 @@ class PortManager:
                 return (False, error_msg)
 
         return (True, None)
-    
+
+    def add_ports_batched(self, port_list, link_up_timeout=None):
+        ''' Add ports with a single $PORT write. All dev ports are resolved from
+            the cached port map and all entries are sent in one WriteRequest with
+            CONTINUE_ON_ERROR, so one bad port does not stop the others.
+
+            Keyword arguments:
+                port_list -- list of (front panel port, lane, speed, FEC string, autoneg)
+                             tuples, as for add_ports
+                link_up_timeout -- optional seconds to wait for the added ports to
+                                   come up (see wait_for_link_up)
+
+            Returns:
+                list of PortResult, in the order of port_list
+        '''
+        self.prefetch_port_map()
+        ports = self._registry()
+        results = [None] * len(port_list)
+        datas = []
+        pending = []
+        pending_ports = {}
+        # Repeated entries of a pending port, resolved once it is written
+        duplicates = []
+
+        for i, (fp_port, lane, speed, fec, an) in enumerate(port_list):
+            success, dev_port = self.get_dev_port(fp_port, lane)
+            if not success:
+                results[i] = PortResult(fp_port, lane, None, False, dev_port, None)
+                continue
+            config = PortConfig(speed, fec, an)
+            if dev_port in pending_ports:
+                if pending_ports[dev_port][1] == config:
+                    duplicates.append((i, pending_ports[dev_port][0]))
+                    continue
+                msg = 'Port {}/{} listed twice with different settings'.format(fp_port, lane)
+                self.log.warning(msg)
+                results[i] = PortResult(fp_port, lane, dev_port, False, msg, None)
+                continue
+            if dev_port in ports:
+                current = ports[dev_port]
+                if current == config:
+                    self.log.info('Port {}/{} already added'.format(fp_port, lane))
+                    results[i] = PortResult(fp_port, lane, dev_port, True, None, None)
+                    continue
+                msg = 'Port {}/{} already added as {}G {} {}; use reconcile_ports to change it'.format(
+                    fp_port, lane, *current)
+                self.log.warning(msg)
+                results[i] = PortResult(fp_port, lane, dev_port, False, msg, None)
+                continue
+            try:
+                data = self._port_data(speed, fec, an)
+            except KeyError as e:
+                results[i] = PortResult(fp_port, lane, dev_port, False,
+                                        'Port {}/{}: invalid setting {}'.format(fp_port, lane, e), None)
+                continue
+            pending_ports[dev_port] = (i, config)
+            datas.append(data)
+            pending.append((i, fp_port, lane, dev_port, config))
+
+        if pending:
+            errors = self._write_ports(bfruntime_pb2.Update.INSERT, [p[3] for p in pending], datas)
+            for (i, fp_port, lane, dev_port, config), error in zip(pending, errors):
+                if error is None:
+                    self.log.info('Added port: {}/{} {}G {} {}'.format(fp_port, lane, *config))
+                    ports[dev_port] = config
+                    results[i] = PortResult(fp_port, lane, dev_port, True, None, None)
+                else:
+                    msg = 'Port {}/{} not added: {}'.format(fp_port, lane, error)
+                    self.log.warning(msg)
+                    # The cached dev port may be stale
+                    self.invalidate_port_map(fp_port, lane)
+                    results[i] = PortResult(fp_port, lane, dev_port, False, msg, None)
+            for i, first in duplicates:
+                results[i] = results[first]
+
+        if link_up_timeout is not None:
+            up = self.wait_for_link_up([r.dev_port for r in results if r.success], link_up_timeout)
+            results = [r._replace(up=up[r.dev_port]) if r.success else r for r in results]
+        return results
+
+    def _write_ports(self, update_type, dev_ports, datas=None):
+        ''' Write $PORT entries of the given dev ports with one CONTINUE_ON_ERROR
+            WriteRequest.
+
+            Returns:
+                list with an error message, or None on success, per dev port
+        '''
+        req = bfruntime_pb2.WriteRequest()
+        self.gc._cpy_target(req, self.target)
+        req.atomicity = bfruntime_pb2.WriteRequest.CONTINUE_ON_ERROR
+        self.port_table._entry_write_req_make(
+            req, [self._port_key(p) for p in dev_ports], datas, update_type)
+        resp = exc = None
+        try:
+            resp = self.port_table.reader_writer_interface._write(req, [ERROR_IN_RESP])
+        except self.gc.BfruntimeReadWriteRpcException as e:
+            exc = e
+        failed = dict(BulkWriter._failed_updates(resp, exc))
+        if exc is not None and not failed:
+            return [str(exc)] * len(dev_ports)
+        return ['{} {}'.format(code_pb2.Code.Name(failed[idx].canonical_code), failed[idx].message).strip()
+                if idx in failed else None for idx in range(len(dev_ports))]
+
+    def read_port_up(self, dev_ports=None):
+        ''' Read $PORT_UP of the given dev ports, or of all added ports.
+
+            Returns:
+                dict of dev port -> True if up
+        '''
+        keys = [] if dev_ports is None else [self._port_key(p) for p in dev_ports]
+        if dev_ports is not None and not keys:
+            return {}
+        up = {}
+        resp = self.port_table.entry_get(self.target, keys, {'from_hw': False})
+        for v, k in resp:
+            up[k.to_dict()['$DEV_PORT']['value']] = bool(v.to_dict().get('$PORT_UP', False))
+        return up
+
+    def port_status_monitor(self, callback=None, dev_ports=None):
+        ''' Start (once) and return the PortStatusMonitor of the port status
+            notifications, which keeps the link state of the ports and calls
+            callbacks on every port up/down.
+
+            Keyword arguments:
+                callback -- optional function called with a PortEvent per
+                            notification
+                dev_ports -- dev ports the callback is called for, all by default
+
+            Returns:
+                PortStatusMonitor
+        '''
+        if self.interface is None:
+            raise RuntimeError('Monitoring the port status needs the interface of the PortManager')
+        if self.monitor is None:
+            self.monitor = PortStatusMonitor(self, self.interface)
+        if callback is not None:
+            self.monitor.add_callback(callback, dev_ports)
+        self.monitor.start()
+        return self.monitor
+
+    def wait_for_link_up(self, dev_ports, timeout):
+        ''' Wait until the given ports are up. The port status monitor is
+            started if needed (enabling the notifications on $PORT once), the
+            $PORT_UP of the ports is read and their link state is then waited
+            on as the monitor receives the notifications.
+
+            Keyword arguments:
+                dev_ports -- list of dev ports
+                timeout -- max seconds to wait
+
+            Returns:
+                dict of dev port -> True if up
+        '''
+        dev_ports = list(dev_ports)
+        if not dev_ports:
+            return {}
+        return self.port_status_monitor().wait_for_link_up(dev_ports, timeout)
+
+    def _notification_dev_port(self, notification):
+        ''' Dev port of a port status change notification. '''
+        for field in notification.table_entry.key.fields:
+            return int.from_bytes(field.exact.value, 'big')
+        return None
+
     def remove_port(self, front_panel_port, lane):
         ''' Remove one port.
 
@@ -182,8 +549,108 @@ class PortManager:
 
         self.log.info('Removed port: {}/{}'.format(front_panel_port, lane))
 
-        # Remove from our local active port list
-        self.active_ports.remove(dev_port)
+        # Remove from the port registry
+        self._registry().pop(dev_port, None)
+
+        # The port may come back with another channelization; look it up
+        # again next time
+        self.invalidate_port_map(front_panel_port, lane)
 
         return (True, None)
 
+
+    def reconcile_ports(self, desired, prune=False, dry_run=False):
+        ''' Bring the ports of the switch to the desired configuration. $PORT is
+            read once and only the ports whose configuration differs are written:
+            missing ports are added, ports with another FEC or autonegotiation are
+            modified in place, ports with another speed are deleted and added again
+            and, with prune, undesired ports are deleted. Unchanged ports are not
+            touched, so their links do not flap.
+
+            Keyword arguments:
+                desired -- list of (front panel port, lane, speed, FEC string, autoneg)
+                           tuples, as for add_ports. A port listed twice with
+                           different settings is an error and keeps the first ones
+                prune -- delete added ports which are not in desired, including ports
+                         added by other tools (e.g. the CPU port)
+                dry_run -- only compute the changes
+
+            Returns:
+                PortReconcileReport
+
+            Raises:
+                BfruntimeRpcException if $PORT could not be read
+        '''
+        report = PortReconcileReport(dry_run)
+        self.prefetch_port_map()
+        current = self.load_ports()
+
+        wanted = {}
+        for fp_port, lane, speed, fec, an in desired:
+            success, dev_port = self.get_dev_port(fp_port, lane)
+            if not success:
+                report.errors.append(dev_port)
+                continue
+            config = PortConfig(speed, fec, an)
+            if (speed not in SPEED_CONVERSION_TABLE or fec not in FEC_CONVERSION_TABLE
+                    or an not in AN_CONVERSION_TABLE):
+                report.errors.append('Port {}/{}: invalid setting {}G {} {}'.format(fp_port, lane, *config))
+                continue
+            if dev_port in wanted:
+                if wanted[dev_port][3] != config:
+                    report.errors.append('Port {}/{} listed twice with different settings'.format(fp_port, lane))
+                continue
+            wanted[dev_port] = (fp_port, lane, dev_port, config)
+            if dev_port not in current:
+                report.to_add.append(wanted[dev_port])
+            elif current[dev_port] == config:
+                report.unchanged += 1
+            elif current[dev_port].speed == speed:
+                report.to_modify.append(wanted[dev_port])
+            else:
+                report.to_readd.append(wanted[dev_port])
+        if prune:
+            for dev_port, config in current.items():
+                if dev_port not in wanted:
+                    fp_port, lane = self.dev_port_to_fp_port.get(dev_port, (None, None))
+                    report.to_delete.append((fp_port, lane, dev_port, config))
+
+        self.log.info(str(report))
+        if dry_run or not report.changes:
+            return report
+
+        # Deletes first, so that re-added ports come back with their new speed
+        deletes = report.to_delete + report.to_readd
+        failed = set()
+        if deletes:
+            errors = self._write_ports(bfruntime_pb2.Update.DELETE, [p[2] for p in deletes])
+            for (fp_port, lane, dev_port, _), error in zip(deletes, errors):
+                if error is None:
+                    current.pop(dev_port, None)
+                    self.log.info('Removed port: {}/{}'.format(fp_port, lane))
+                else:
+                    failed.add(dev_port)
+                    report.errors.append('Port {}/{} not removed: {}'.format(fp_port, lane, error))
+
+        if report.to_modify:
+            errors = self._write_ports(bfruntime_pb2.Update.MODIFY, [p[2] for p in report.to_modify],
+                                       [self._port_settings_data(p[3].fec, p[3].an) for p in report.to_modify])
+            for (fp_port, lane, dev_port, config), error in zip(report.to_modify, errors):
+                if error is None:
+                    current[dev_port] = config
+                    self.log.info('Modified port: {}/{} {}G {} {}'.format(fp_port, lane, *config))
+                else:
+                    report.errors.append('Port {}/{} not modified: {}'.format(fp_port, lane, error))
+
+        adds = report.to_add + [p for p in report.to_readd if p[2] not in failed]
+        if adds:
+            errors = self._write_ports(bfruntime_pb2.Update.INSERT, [p[2] for p in adds],
+                                       [self._port_data(*p[3]) for p in adds])
+            for (fp_port, lane, dev_port, config), error in zip(adds, errors):
+                if error is None:
+                    current[dev_port] = config
+                    self.log.info('Added port: {}/{} {}G {} {}'.format(fp_port, lane, *config))
+                else:
+                    self.invalidate_port_map(fp_port, lane)
+                    report.errors.append('Port {}/{} not added: {}'.format(fp_port, lane, error))
+        return report
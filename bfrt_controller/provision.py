@@ -0,0 +1,206 @@
+# bfrt_controller/provision.py
+
+"""
+provision.py
+
+Concurrent provisioning of several tables over one channel.
+
+Bring-up scripts program their tables one after the other although most of them are
+independent, so the total time is the sum of all tables. A Provisioner takes a plan of
+table writes and runs the writes of independent tables concurrently, one BulkWriter per
+table on a bounded pool of workers, so at most max_workers WriteRequests are in flight
+at once. A table is only started once every table of the plan it depends on (the
+depends_on of bf-rt.json, e.g. a match table on its action profile) has been written.
+Ready tables are started in the reverse order of _BfRtInfo.table_list_sorted, which
+lists dependents before the tables they depend on.
+
+If a table fails, the tables depending on it are skipped, the others still run.
+"""
+
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .bulk import BulkWriter, DEFAULT_CHUNK_SIZE
+from .encoder import TableEncoder
+from .logger import log
+
+DEFAULT_MAX_WORKERS = 4
+
+# One write of a plan. entries are program_table entries, or program_table_rows rows
+# when layout = (key_fields, action_name, data_fields) is given.
+ProvisionStep = namedtuple("ProvisionStep", ["table_name", "entries", "layout", "upsert"])
+ProvisionStep.__new__.__defaults__ = (None, True)
+
+
+class ProvisionReport:
+    """Outcome of a provisioning plan.
+
+    Attributes:
+        results -- OrderedDict of table name -> list of BulkWriteResult, in completion order
+        errors -- OrderedDict of table name -> exception of the failed tables
+        skipped -- names of the tables not written because a dependency failed
+        elapsed_s -- wall time of the whole plan
+    """
+
+    def __init__(self):
+        self.results = OrderedDict()
+        self.errors = OrderedDict()
+        self.skipped = []
+        self.elapsed_s = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors and not self.skipped
+
+    @property
+    def entries(self):
+        return sum(r.entries for results in self.results.values() for r in results)
+
+    def __str__(self):
+        lines = ["Provisioned {} tables, {} entries in {:.3f}s".format(
+            len(self.results), self.entries, self.elapsed_s)]
+        for results in self.results.values():
+            lines.extend("  " + str(r) for r in results)
+        for name, e in self.errors.items():
+            lines.append("  {}: FAILED {}".format(name, e))
+        for name in self.skipped:
+            lines.append("  {}: skipped, a dependency failed".format(name))
+        return "\n".join(lines)
+
+
+class Provisioner:
+    """Runs a provisioning plan against the tables of a Controller.
+
+    Keyword arguments:
+        controller -- connected Controller; tables not set up are looked up in bfrt_info
+        max_workers -- number of tables written concurrently, which is also the bound
+                       on the WriteRequests in flight
+        chunk_size -- number of entries per WriteRequest
+        on_chunk -- optional callback called with (table_name, ChunkStats) per chunk
+    """
+
+    def __init__(self, controller, max_workers=DEFAULT_MAX_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        self.controller = controller
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+
+    def _table(self, name):
+        """(_Table, TableEncoder) of a table, from the controller if it was set up."""
+        c = self.controller
+        tables = getattr(c, "tables", {})
+        encoders = getattr(c, "encoders", {})
+        if name in tables:
+            table = tables[name]
+            encoder = encoders.get(name)
+        else:
+            table = c.bfrt_info.table_get(name)
+            encoder = None
+        if encoder is None:
+            encoder = TableEncoder(table)
+        return table, encoder
+
+    def _dependencies(self, full_names):
+        """table full name -> set of full names of the plan tables it depends on,
+        following depends_on through tables which are not part of the plan.
+        """
+        parsed_info = self.controller.bfrt_info.parsed_info
+        id_to_name = {parsed_info.table_id_get(name): name for name in parsed_info.table_name_list_get()}
+        in_plan = set(full_names)
+        deps = {}
+        for name in full_names:
+            found = set()
+            seen = set()
+            todo = [name]
+            while todo:
+                current = todo.pop()
+                for dep_id in parsed_info.table_depends_on_get(current):
+                    dep = id_to_name.get(dep_id)
+                    if dep is None or dep in seen:
+                        continue
+                    seen.add(dep)
+                    if dep in in_plan:
+                        found.add(dep)
+                    else:
+                        todo.append(dep)
+            found.discard(name)
+            deps[name] = found
+        return deps
+
+    def _write_table(self, full_name, table, encoder, steps):
+        """Writes all steps of one table in plan order; runs on a worker."""
+        results = []
+        on_chunk = None
+        if self.on_chunk is not None:
+            on_chunk = lambda stats: self.on_chunk(full_name, stats)
+        for step in steps:
+            writer_encoder = encoder.layout(*step.layout) if step.layout is not None else encoder
+            writer = BulkWriter(table, self.controller.target, chunk_size=self.chunk_size, encoder=writer_encoder,
+                                on_chunk=on_chunk)
+            results.append(writer.write(step.entries, upsert=step.upsert))
+        return results
+
+    def run(self, plan):
+        """Executes the plan, an iterable of ProvisionStep or (table_name, entries)
+        tuples. Several steps of the same table are written one after the other.
+
+        Returns:
+            ProvisionReport
+        """
+        report = ProvisionReport()
+        start = time.perf_counter()
+
+        steps = OrderedDict()
+        tables = {}
+        for step in plan:
+            if not isinstance(step, ProvisionStep):
+                step = ProvisionStep(*step)
+            table, encoder = self._table(step.table_name)
+            full_name = table.info.name_get()
+            tables[full_name] = (table, encoder)
+            steps.setdefault(full_name, []).append(step)
+
+        deps = self._dependencies(list(steps))
+        # Dependencies first: reverse of table_list_sorted, unknown names last
+        sorted_names = self.controller.bfrt_info.table_list_sorted
+        rank = {name: i for i, name in enumerate(reversed(sorted_names))}
+        pending = sorted(steps, key=lambda n: rank.get(n, len(rank)))
+        done = set()
+        failed = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bfrt-provision") as pool:
+            while pending or running:
+                for name in list(pending):
+                    if deps[name] & failed:
+                        pending.remove(name)
+                        failed.add(name)
+                        report.skipped.append(name)
+                        log.warning("Skipping {}: a table it depends on failed".format(name))
+                    elif deps[name] <= done:
+                        pending.remove(name)
+                        table, encoder = tables[name]
+                        log.debug("Provisioning {}".format(name))
+                        running[pool.submit(self._write_table, name, table, encoder, steps[name])] = name
+                if not running:
+                    # Only left with tables waiting on each other
+                    for name in pending:
+                        report.errors[name] = RuntimeError("Circular depends_on")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        report.results[name] = future.result()
+                        done.add(name)
+                    except Exception as e:
+                        log.error("Provisioning {} failed: {}".format(name, e))
+                        report.errors[name] = e
+                        failed.add(name)
+
+        report.elapsed_s = time.perf_counter() - start
+        log.info(str(report))
+        return report
@@ -0,0 +1,396 @@
+# bfrt_controller/readers.py
+
+"""
+readers.py
+
+Streaming readers decoding BFRT Read responses straight into NumPy arrays.
+
+entry_get turns every returned entry into _Key/_Data objects (and callers usually call
+to_dict() on them), which for a register with a million cells means millions of Python
+objects. The readers here walk the protobuf messages of the Read response stream and
+write the index and values of every entry into preallocated arrays, one chunk per
+ReadResponse message, so memory stays proportional to the table size in bytes.
+"""
+
+from collections import OrderedDict
+
+import grpc
+import numpy as np
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+from bfrt_controller.bfrt_grpc import client as gc
+
+REGISTER_DATA = "$bfrt_field_class.register_data"
+
+# Maximum number of keys per ReadRequest when reading a list of indexes
+DEFAULT_SHARD_SIZE = 4096
+
+
+def dtype_for_bits(bits):
+    """Smallest unsigned NumPy dtype holding a field of the given width."""
+    if bits is None or bits > 32:
+        return np.uint64
+    if bits > 16:
+        return np.uint32
+    if bits > 8:
+        return np.uint16
+    return np.uint8
+
+
+def read_request(table, target, flags, key_list=None):
+    """ReadRequest for table, all entries if key_list is empty."""
+    req = bfruntime_pb2.ReadRequest()
+    gc._cpy_target(req, target)
+    return table._entry_read_req_make(req, key_list, flags, None, False)
+
+
+def read_stream(table, target, flags, key_list=None):
+    """Sends a ReadRequest for table (all entries if key_list is empty) and yields the
+    raw ReadResponse messages as they arrive.
+    """
+    return request_stream(table, read_request(table, target, flags, key_list))
+
+
+def request_stream(table, req):
+    """Sends an already built ReadRequest and yields the ReadResponse messages."""
+    try:
+        for rep in table.reader_writer_interface._read(req):
+            yield rep
+    except grpc.RpcError as e:
+        raise gc.BfruntimeReadWriteRpcException(e)
+
+
+def index_read_request(table, target, flags, key_id, key_size, indexes):
+    """ReadRequest for the entries of an index keyed table ($COUNTER_INDEX,
+    $REGISTER_INDEX, ...) built straight from the integer indexes.
+    """
+    req = bfruntime_pb2.ReadRequest()
+    gc._cpy_target(req, target)
+    table_id = table.info.id_get()
+    for idx in indexes:
+        table_entry = req.entities.add().table_entry
+        table_entry.table_id = table_id
+        table._set_flags(table_entry, flags)
+        key_field = table_entry.key.fields.add()
+        key_field.field_id = key_id
+        key_field.exact.value = int(idx).to_bytes(key_size, "big")
+    return req
+
+
+class RegisterArrays:
+    """Index and values of (part of) a register.
+
+    Attributes:
+        index -- register indexes, uint32 array of n entries
+        fields -- OrderedDict of field name suffix ("f1", "first", "second", ...) -> array of
+                  shape (n, pipes), or (n,) when a single pipe was selected
+    """
+
+    def __init__(self, index, fields):
+        self.index = index
+        self.fields = fields
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def values(self):
+        """Values of a single field register."""
+        if len(self.fields) != 1:
+            raise AttributeError("Register has fields {}, use fields[name]".format(list(self.fields)))
+        return next(iter(self.fields.values()))
+
+    @property
+    def first(self):
+        return self.fields["first"]
+
+    @property
+    def second(self):
+        return self.fields["second"]
+
+
+class RegisterReader:
+    """Reads a register table into NumPy arrays.
+
+    Keyword arguments:
+        table -- _Table of the register
+        target -- gc.Target
+        pipe -- only keep the values of this pipe; by default all pipes are kept
+        from_hw -- read from hardware instead of the software shadow
+    """
+
+    def __init__(self, table, target, pipe=None, from_hw=True):
+        self.table = table
+        self.target = target
+        self.pipe = pipe
+        self.flags = {"from_hw": from_hw}
+        info = table.info
+        self.index_id = info.key_field_id_get("$REGISTER_INDEX")
+        names = [n for n in info.data_field_name_list_get() if REGISTER_DATA in info.data_field_annotations_get(n)]
+        if not names:
+            names = [n for n in info.data_field_name_list_get() if not n.startswith("$")]
+        # field id -> (suffix, dtype)
+        self.columns = OrderedDict()
+        for name in names:
+            self.columns[info.data_field_id_get(name)] = (
+                name.rsplit(".", 1)[-1], dtype_for_bits(info.data_field_size_get(name)[1]))
+
+    def _decode(self, entities, n):
+        """Decodes n table entries into freshly allocated arrays."""
+        index = np.empty(n, dtype=np.uint32)
+        arrays = {}
+        count = 0
+        pipe = self.pipe
+        index_id = self.index_id
+        columns = self.columns
+        for entity in entities:
+            entry = entity.table_entry
+            if not entry.HasField("key"):
+                continue
+            for key_field in entry.key.fields:
+                if key_field.field_id == index_id:
+                    index[count] = int.from_bytes(key_field.exact.value, "big")
+            # The switch returns one stream field per pipe, all with the field id of the
+            # register field, in pipe order (what _Data._check_for_dups squashes)
+            values = {}
+            for field in entry.data.fields:
+                if field.field_id not in columns:
+                    continue
+                if field.WhichOneof("value") == "int_arr_val":
+                    values.setdefault(field.field_id, []).extend(field.int_arr_val.val)
+                else:
+                    values.setdefault(field.field_id, []).append(int.from_bytes(field.stream, "big"))
+            for field_id, vals in values.items():
+                arr = arrays.get(field_id)
+                if arr is None:
+                    shape = (n,) if pipe is not None else (n, len(vals))
+                    arr = arrays[field_id] = np.zeros(shape, dtype=columns[field_id][1])
+                if pipe is not None:
+                    if pipe >= len(vals):
+                        raise IndexError("Register {} returned {} values, no pipe {}".format(
+                            self.table.info.name_get(), len(vals), pipe))
+                    arr[count] = vals[pipe]
+                else:
+                    arr[count] = vals
+            count += 1
+        fields = OrderedDict()
+        for field_id, (suffix, dtype) in self.columns.items():
+            if field_id in arrays:
+                fields[suffix] = arrays[field_id][:count]
+            else:
+                fields[suffix] = np.zeros((count,) if pipe is not None else (count, 0), dtype=dtype)
+        return RegisterArrays(index[:count], fields)
+
+    def chunks(self, responses=None):
+        """Yields a RegisterArrays per ReadResponse message, as they arrive.
+
+        responses -- already received ReadResponse messages of a wildcard read; by
+                     default the register is read through the table's channel
+        """
+        if responses is None:
+            responses = read_stream(self.table, self.target, self.flags)
+        for rep in responses:
+            if len(rep.entities):
+                yield self._decode(rep.entities, len(rep.entities))
+
+    def accumulator(self):
+        """RegisterAccumulator collecting the ReadResponse messages of a whole register
+        read, e.g. as they arrive on an asyncio channel."""
+        return RegisterAccumulator(self)
+
+    def read(self, responses=None):
+        """Reads the whole register into RegisterArrays, preallocated to the register size."""
+        acc = self.accumulator()
+        for chunk in self.chunks(responses):
+            acc.add_chunk(chunk)
+        return acc.result()
+
+
+class RegisterAccumulator:
+    """Decodes the ReadResponse messages of a register read one by one into arrays
+    preallocated to the register size. Built by RegisterReader.accumulator.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.size = reader.table.info.size_get()
+        self.index = np.empty(self.size, dtype=np.uint32)
+        self.fields = None
+        self.count = 0
+
+    def add(self, rep):
+        """Decodes one ReadResponse message."""
+        if len(rep.entities):
+            self.add_chunk(self.reader._decode(rep.entities, len(rep.entities)))
+
+    def add_chunk(self, chunk):
+        n = len(chunk)
+        count = self.count
+        if count + n > self.size:
+            # Larger than announced, grow instead of failing
+            self.size = max(2 * self.size, count + n)
+            self.index = np.resize(self.index, self.size)
+            if self.fields is not None:
+                for name, arr in self.fields.items():
+                    self.fields[name] = np.resize(arr, (self.size,) + arr.shape[1:])
+        if self.fields is None:
+            self.fields = OrderedDict((name, np.zeros((self.size,) + arr.shape[1:], dtype=arr.dtype))
+                                      for name, arr in chunk.fields.items())
+        self.index[count:count + n] = chunk.index
+        for name, arr in chunk.fields.items():
+            self.fields[name][count:count + n] = arr
+        self.count = count + n
+
+    def result(self):
+        count = self.count
+        if self.fields is None:
+            empty = (0,) if self.reader.pipe is not None else (0, 0)
+            fields = OrderedDict((suffix, np.zeros(empty, dtype=dtype))
+                                 for suffix, dtype in self.reader.columns.values())
+            return RegisterArrays(self.index[:count], fields)
+        return RegisterArrays(self.index[:count],
+                              OrderedDict((name, arr[:count]) for name, arr in self.fields.items()))
+
+
+class CounterArrays:
+    """Packet and byte counts of a counter table, aligned by position.
+
+    Attributes:
+        index -- counter indexes
+        packets -- uint64 array of packet counts
+        bytes -- uint64 array of byte counts
+
+    Iterating yields (index, packets, bytes) tuples.
+    """
+
+    def __init__(self, index, packets, bytes):
+        self.index = index
+        self.packets = packets
+        self.bytes = bytes
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return zip(self.index.tolist(), self.packets.tolist(), self.bytes.tolist())
+
+
+class CounterAccumulator:
+    """Decodes the ReadResponse messages of a counter read one by one into arrays
+    preallocated to size entries. Built by CounterReader.accumulator.
+    """
+
+    def __init__(self, reader, size):
+        self.reader = reader
+        self.size = size
+        self.index = np.empty(size, dtype=np.uint32)
+        self.packets = np.zeros(size, dtype=np.uint64)
+        self.bytes = np.zeros(size, dtype=np.uint64)
+        self.count = 0
+
+    def add(self, rep):
+        """Decodes one ReadResponse message."""
+        n = len(rep.entities)
+        if self.count + n > self.size:
+            self.size = max(2 * self.size, self.count + n)
+            self.index = np.resize(self.index, self.size)
+            self.packets = np.resize(self.packets, self.size)
+            self.bytes = np.resize(self.bytes, self.size)
+        self.count = self.reader._decode(rep.entities, self.index, self.packets, self.bytes, self.count)
+
+    def result(self):
+        count = self.count
+        return CounterArrays(self.index[:count], self.packets[:count], self.bytes[:count])
+
+
+class CounterReader:
+    """Reads counter tables into NumPy arrays.
+
+    Keyword arguments:
+        table -- _Table of the counter
+        target -- gc.Target
+        from_hw -- read from hardware instead of the software shadow
+        shard_size -- maximum number of keys per ReadRequest when reading an index list
+    """
+
+    def __init__(self, table, target, from_hw=True, shard_size=DEFAULT_SHARD_SIZE):
+        if shard_size < 1:
+            raise ValueError("shard_size must be >= 1")
+        self.table = table
+        self.target = target
+        self.flags = {"from_hw": from_hw}
+        self.shard_size = shard_size
+        info = table.info
+        self.index_id = info.key_field_id_get("$COUNTER_INDEX")
+        self.index_size = info.key_field_size_get("$COUNTER_INDEX")[0]
+        data_names = info.data_field_name_list_get()
+        self.pkts_id = info.data_field_id_get("$COUNTER_SPEC_PKTS") if "$COUNTER_SPEC_PKTS" in data_names else None
+        self.bytes_id = info.data_field_id_get("$COUNTER_SPEC_BYTES") if "$COUNTER_SPEC_BYTES" in data_names else None
+
+    def _decode(self, entities, index, packets, bytes, count):
+        """Decodes entities into the arrays from position count. Returns the new count."""
+        index_id, pkts_id, bytes_id = self.index_id, self.pkts_id, self.bytes_id
+        for entity in entities:
+            entry = entity.table_entry
+            if not entry.HasField("key"):
+                continue
+            for key_field in entry.key.fields:
+                if key_field.field_id == index_id:
+                    index[count] = int.from_bytes(key_field.exact.value, "big")
+            for field in entry.data.fields:
+                if field.field_id == pkts_id:
+                    packets[count] = int.from_bytes(field.stream, "big")
+                elif field.field_id == bytes_id:
+                    bytes[count] = int.from_bytes(field.stream, "big")
+            count += 1
+        return count
+
+    def _read(self, responses, size):
+        acc = CounterAccumulator(self, size)
+        for rep in responses:
+            acc.add(rep)
+        return acc.result()
+
+    def accumulator(self):
+        """CounterAccumulator collecting the ReadResponse messages of a wildcard read,
+        e.g. as they arrive on an asyncio channel."""
+        return CounterAccumulator(self, self.table.info.size_get())
+
+    def read_all(self, responses=None):
+        """Reads every counter index with a single wildcard Read, or decodes the given
+        ReadResponse messages of one.
+        """
+        if responses is None:
+            responses = read_stream(self.table, self.target, self.flags)
+        return self._read(responses, self.table.info.size_get())
+
+    def read_indexes(self, indexes):
+        """Reads only the given counter indexes, shard_size keys per Read. The result is
+        aligned with indexes (duplicates allowed).
+
+        Raises:
+            KeyError if the switch did not return some of the indexes
+        """
+        indexes = np.asarray(indexes, dtype=np.int64).ravel()
+        unique, inverse = np.unique(indexes, return_inverse=True)
+        packets = np.zeros(len(unique), dtype=np.uint64)
+        bytes = np.zeros(len(unique), dtype=np.uint64)
+        found = np.zeros(len(unique), dtype=bool)
+        for start in range(0, len(unique), self.shard_size):
+            shard = unique[start:start + self.shard_size]
+            req = index_read_request(self.table, self.target, self.flags, self.index_id, self.index_size,
+                                     shard.tolist())
+            got = self._read(request_stream(self.table, req), len(shard))
+            pos = np.searchsorted(unique, got.index)
+            # Ignore anything returned that was not asked for
+            asked = pos < len(unique)
+            asked[asked] = unique[pos[asked]] == got.index[asked]
+            pos = pos[asked]
+            packets[pos] = got.packets[asked]
+            bytes[pos] = got.bytes[asked]
+            found[pos] = True
+        if not found.all():
+            missing = unique[~found]
+            raise KeyError("Counter {} did not return indexes {}{}".format(
+                self.table.info.name_get(), missing[:10].tolist(), " ..." if len(missing) > 10 else ""))
+        return CounterArrays(indexes.astype(np.uint32), packets[inverse], bytes[inverse])
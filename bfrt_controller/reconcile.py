@@ -0,0 +1,107 @@
+# bfrt_controller/reconcile.py
+
+"""
+reconcile.py
+
+Desired-state reconciliation for BFRT tables.
+
+The current contents of a table are read once and diffed against the desired entries,
+keyed by the hashable _Key objects. Only the differences are written back: entries
+missing on the switch are inserted, entries whose action or data differ are modified,
+and entries that are not desired any more are deleted.
+"""
+
+from bfrt_controller.bfrt_grpc import client as gc
+
+from .logger import log
+
+
+class ReconcileReport:
+    """Outcome of a reconciliation (or of a dry run).
+
+    Attributes:
+        to_add -- list of (_Key, _Data) to insert
+        to_modify -- list of (_Key, _Data) to modify
+        to_delete -- list of (_Key, None) to delete
+        unchanged -- number of desired entries already in place
+        results -- BulkWriteResult per operation that was actually written
+    """
+
+    def __init__(self, table_name, dry_run):
+        self.table_name = table_name
+        self.dry_run = dry_run
+        self.to_add = []
+        self.to_modify = []
+        self.to_delete = []
+        self.unchanged = 0
+        self.results = {}
+
+    @property
+    def changes(self):
+        return len(self.to_add) + len(self.to_modify) + len(self.to_delete)
+
+    def to_dict(self):
+        """Readable form of the planned changes: {"add": [(key_dict, data_dict)], ...}"""
+        return {
+            "add": [(k.to_dict(), d.to_dict()) for k, d in self.to_add],
+            "modify": [(k.to_dict(), d.to_dict()) for k, d in self.to_modify],
+            "delete": [k.to_dict() for k, _ in self.to_delete],
+        }
+
+    def __str__(self):
+        return "{}{}: {} to add, {} to modify, {} to delete, {} unchanged".format(
+            "[dry run] " if self.dry_run else "", self.table_name, len(self.to_add),
+            len(self.to_modify), len(self.to_delete), self.unchanged)
+
+
+def data_matches(current, desired):
+    """True if the current entry data already has the desired action and field values.
+    Fields the caller did not specify (e.g. counters or defaults returned by the
+    switch) are ignored.
+    """
+    if current is None:
+        return False
+    if current.action_name != desired.action_name:
+        return False
+    for name, field in desired.field_dict.items():
+        if name not in current.field_dict or current.field_dict[name] != field:
+            return False
+    return True
+
+
+def diff_entries(report, current, desired, prune=True):
+    """Fill report with the minimal changes turning current into desired.
+
+    Keyword arguments:
+        report -- ReconcileReport to fill
+        current -- dict of _Key -> _Data read from the switch
+        desired -- dict of _Key -> _Data wanted
+        prune -- delete current entries which are not desired
+    """
+    for key, data in desired.items():
+        if key not in current:
+            report.to_add.append((key, data))
+        elif data_matches(current[key], data):
+            report.unchanged += 1
+        else:
+            report.to_modify.append((key, data))
+    if prune:
+        for key in current:
+            if key not in desired:
+                report.to_delete.append((key, None))
+    return report
+
+
+def desired_entries(table, entries):
+    """Build a dict of _Key -> _Data from program_table style entries. Keys are masked
+    the same way the switch returns them (LPM prefix / ternary mask) so that they
+    compare equal to the keys read back.
+    """
+    desired = {}
+    for k, a, d in entries:
+        key = table.make_key([gc.KeyTuple(*f) for f in k])
+        key.apply_mask()
+        if key in desired:
+            log.warning("Duplicate desired entry {} in {}, keeping the last one".format(key, table.info.name_get()))
+        desired[key] = table.make_data([gc.DataTuple(*p) for p in d], a)
+    return desired
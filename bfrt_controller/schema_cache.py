@@ -0,0 +1,198 @@
+# bfrt_controller/schema_cache.py
+
+"""
+schema_cache.py
+
+On-disk cache of parsed bf-rt.json schemas.
+
+Every Controller fetches bf-rt.json and the non-P4 json with GetForwardingPipelineConfig
+and parses all tables (including the hundreds of fixed tf1.tm.*, $PORT* and $pre.*
+tables) through BfRtInfoParser. The SchemaCache stores the parsed BfRtInfoParser pickled
+in a file keyed by the p4_name and a hash of both json documents, so that the next
+script connecting to the same program skips the json parsing and metadata construction.
+A changed program has a different hash and is simply parsed and cached again.
+
+Unpickling runs code named by the file, so a cache file is only as trustworthy as
+everyone who can write it. The SchemaCache therefore only loads a file that is a regular
+file owned by the current user in a directory owned by the current user, neither of them
+writable by group or others; the directory is created with mode 0700. Anything else is
+ignored with a warning and the schema is parsed from the json. Do not point
+BFRT_SCHEMA_CACHE_DIR (or schema_cache_dir) at a directory other users control, and pass
+schema_cache_dir=None to disable the disk cache.
+
+Within one process, a SharedSchemaCache keeps the parsed schemas in memory so that
+several connections to switches running the same program share one BfRtInfoParser.
+"""
+
+import gc
+import hashlib
+import os
+import pickle
+import re
+import stat
+import tempfile
+import threading
+
+from .logger import log
+
+# Bump when the pickled classes change in an incompatible way
+CACHE_FORMAT_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "BFRT_SCHEMA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "bfrt_controller"))
+
+
+def _untrusted(st, what):
+    """Reason why a cache file or directory with the given os.stat_result must not be
+    trusted, or None."""
+    geteuid = getattr(os, "geteuid", None)
+    if geteuid is not None and st.st_uid != geteuid():
+        return "{} is owned by uid {}, not by the current user".format(what, st.st_uid)
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return "{} is writable by group or others".format(what)
+    return None
+
+
+class SchemaCache:
+    """Pickled BfRtInfoParser objects stored in cache_dir.
+
+    Keyword arguments:
+        cache_dir -- directory holding the cache files, created (mode 0700) on first
+                     store. Only used if it is owned by the current user and not
+                     writable by group or others
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _check_dir(self):
+        """Reason why cache_dir must not be used, or None. A missing directory is fine."""
+        try:
+            st = os.stat(self.cache_dir)
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISDIR(st.st_mode):
+            return "{} is not a directory".format(self.cache_dir)
+        return _untrusted(st, self.cache_dir)
+
+    @staticmethod
+    def content_hash(p4_json_data, non_p4_json_data):
+        h = hashlib.sha256()
+        h.update(str(CACHE_FORMAT_VERSION).encode())
+        for data in (p4_json_data, non_p4_json_data):
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+    def path(self, p4_name, p4_json_data, non_p4_json_data):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", p4_name)
+        digest = self.content_hash(p4_json_data, non_p4_json_data)
+        return os.path.join(self.cache_dir, "{}-{}.pickle".format(safe_name, digest[:32]))
+
+    def load(self, p4_name, p4_json_data, non_p4_json_data):
+        """Returns the cached BfRtInfoParser for this schema, or None on a miss, an
+        unreadable cache file or a file or directory which is not trusted.
+        """
+        path = self.path(p4_name, p4_json_data, non_p4_json_data)
+        reason = self._check_dir()
+        if reason is not None:
+            log.warning("Not using schema cache: {}".format(reason))
+            return None
+        # Unpickling creates tens of thousands of small objects; the cyclic garbage
+        # collector running in between them triples the load time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # The checks are made on the opened file, so it cannot be swapped in between
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+            with os.fdopen(fd, "rb") as f:
+                st = os.fstat(f.fileno())
+                reason = ("{} is not a regular file".format(path) if not stat.S_ISREG(st.st_mode)
+                          else _untrusted(st, path))
+                if reason is not None:
+                    log.warning("Not using schema cache: {}".format(reason))
+                    return None
+                parsed_info = pickle.load(f)
+        except FileNotFoundError:
+            log.debug("Schema cache miss for {}".format(p4_name))
+            return None
+        except Exception as e:
+            log.warning("Ignoring unreadable schema cache {}: {}".format(path, e))
+            return None
+        finally:
+            if gc_enabled:
+                gc.enable()
+        log.debug("Schema cache hit for {} ({})".format(p4_name, path))
+        return parsed_info
+
+    def store(self, p4_name, p4_json_data, non_p4_json_data, parsed_info):
+        """Writes parsed_info to the cache. Failures are logged and otherwise ignored."""
+        path = self.path(p4_name, p4_json_data, non_p4_json_data)
+        reason = self._check_dir()
+        if reason is not None:
+            log.warning("Not writing schema cache: {}".format(reason))
+            return
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            # Write to a temporary file first so concurrent scripts never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(parsed_info, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            log.warning("Could not write schema cache {}: {}".format(path, e))
+            return
+        log.debug("Stored schema cache for {} ({})".format(p4_name, path))
+
+    def clear(self):
+        """Removes all cache files."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pickle"):
+                os.unlink(os.path.join(self.cache_dir, name))
+
+
+class SharedSchemaCache:
+    """In-memory cache of BfRtInfoParser objects, in front of an optional SchemaCache.
+
+    Every connection loading the same p4_name and json contents gets the same parsed
+    object, so its _TableInfo objects (and the annotations added to them) are shared.
+
+    Keyword arguments:
+        disk_cache -- SchemaCache consulted on a memory miss, or None
+    """
+
+    def __init__(self, disk_cache=None):
+        self.disk_cache = disk_cache
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(p4_name, p4_json_data, non_p4_json_data):
+        return p4_name, SchemaCache.content_hash(p4_json_data, non_p4_json_data)
+
+    def load(self, p4_name, p4_json_data, non_p4_json_data):
+        key = self.key(p4_name, p4_json_data, non_p4_json_data)
+        with self._lock:
+            parsed_info = self._parsed.get(key)
+        if parsed_info is not None:
+            log.debug("Shared schema hit for {}".format(p4_name))
+            return parsed_info
+        if self.disk_cache is None:
+            return None
+        parsed_info = self.disk_cache.load(p4_name, p4_json_data, non_p4_json_data)
+        if parsed_info is not None:
+            with self._lock:
+                parsed_info = self._parsed.setdefault(key, parsed_info)
+        return parsed_info
+
+    def store(self, p4_name, p4_json_data, non_p4_json_data, parsed_info):
+        with self._lock:
+            self._parsed.setdefault(self.key(p4_name, p4_json_data, non_p4_json_data), parsed_info)
+        if self.disk_cache is not None:
+            self.disk_cache.store(p4_name, p4_json_data, non_p4_json_data, parsed_info)
@@ -0,0 +1,799 @@
+# bfrt_controller/standin.py
+
+"""
+standin.py
+
+In-process stand-in for the BfRuntime gRPC server of a Tofino switch.
+
+StandInServer serves Write, Read, GetForwardingPipelineConfig,
+SetForwardingPipelineConfig and StreamChannel from in-memory tables described by a
+bf-rt.json fixture, so Controller, PortManager and the example scripts run (and can be
+benchmarked) on a machine without a switch:
+
+    server = StandInServer("build/bf-rt.json", latency=0.0002).start()
+    c = Controller("127.0.0.1", server.port)
+    ...
+    c.tear_down()
+    server.stop()
+
+The fixed tables $PORT, $PORT_STAT and $PORT_HDL_INFO are always present (see
+port_tables_json), $PORT_HDL_INFO filled from a synthetic front-panel to dev port map.
+
+What is modelled:
+
+    - entries keyed by their key fields, INSERT / MODIFY / MODIFY_INC / DELETE with the
+      error codes of the switch (ALREADY_EXISTS, NOT_FOUND, OUT_OF_RANGE, ...),
+      CONTINUE_ON_ERROR and ROLLBACK_ON_ERROR atomicity, per-update errors returned as
+      binary status details or, with the "error_in_resp" metadata, in the response
+    - wildcard, per-key and default entry reads, answered in chunks of read_chunk_size
+      entities per ReadResponse
+    - index tables ($REGISTER_INDEX, $COUNTER_INDEX, ...) holding every index up to the
+      table size, zero until written; register fields are read back like on the
+      switch, as one stream field per pipe with the id of the register field
+    - table attributes and operations (accepted, remembered, Sync is a no-op)
+    - subscriptions, digests (push_digest) and port status notifications
+      (set_port_status) on the StreamChannel
+
+and what is injected:
+
+    - latency -- fixed delay per RPC, plus latency_per_entity per update/read entity
+    - error_rate -- fraction of updates failing with INTERNAL, drawn from seed
+    - fail_next(rpc) -- the next RPCs of a method fail with a given gRPC status code
+"""
+
+import argparse
+import json
+import queue
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent import futures
+
+import grpc
+import google.rpc.code_pb2 as code_pb2
+import google.rpc.status_pb2 as status_pb2
+
+from bfrt_controller.bfrt_grpc import bfruntime_pb2
+from bfrt_controller.bfrt_grpc import bfruntime_pb2_grpc
+
+from .logger import log
+
+DEFAULT_P4_NAME = "standin"
+DEFAULT_PIPES = 4
+# Entities per ReadResponse of a wildcard read
+DEFAULT_READ_CHUNK_SIZE = 1024
+
+PORT_TABLE_ID = 0x3F000001
+PORT_STAT_TABLE_ID = 0x3F000002
+PORT_HDL_INFO_TABLE_ID = 0x3F000003
+
+SPEEDS = ["BF_SPEED_NONE", "BF_SPEED_1G", "BF_SPEED_10G", "BF_SPEED_25G", "BF_SPEED_40G", "BF_SPEED_50G",
+          "BF_SPEED_100G", "BF_SPEED_200G", "BF_SPEED_400G"]
+FECS = ["BF_FEC_TYP_NONE", "BF_FEC_TYP_FC", "BF_FEC_TYP_RS"]
+AUTO_NEGOTIATIONS = ["PM_AN_DEFAULT", "PM_AN_FORCE_ENABLE", "PM_AN_FORCE_DISABLE"]
+
+# Counters of $PORT_STAT
+PORT_STAT_FIELDS = [
+    "$FramesReceivedOK", "$FramesReceivedAll", "$FramesReceivedwithFCSError", "$OctetsReceivedinGoodFrames",
+    "$OctetsReceived", "$FramesTransmittedOK", "$FramesTransmittedAll", "$FramesTransmittedwithError",
+    "$OctetsTransmittedwithouterror", "$OctetsTransmittedTotal",
+]
+
+
+def _field(field_id, name, type_, mandatory=False, read_only=False, choices=None):
+    type_json = {"type": type_}
+    if choices is not None:
+        type_json["choices"] = choices
+    return {"mandatory": mandatory, "read_only": read_only,
+            "singleton": {"id": field_id, "name": name, "repeated": False, "annotations": [], "type": type_json}}
+
+
+def _fixed_table(name, table_id, table_type, keys, data, size=512):
+    return {
+        "name": name, "id": table_id, "table_type": table_type, "size": size, "annotations": [], "depends_on": [],
+        "has_const_default_action": False, "supported_operations": [], "attributes": [],
+        "key": [{"id": i + 1, "name": key, "repeated": False, "annotations": [], "mandatory": True,
+                 "match_type": "Exact", "type": {"type": "uint32"}} for i, key in enumerate(keys)],
+        "data": data,
+    }
+
+
+def port_tables_json():
+    """Non-P4 bf-rt.json with the $PORT, $PORT_STAT and $PORT_HDL_INFO tables."""
+    port = _fixed_table("$PORT", PORT_TABLE_ID, "PortConfigure", ["$DEV_PORT"], [
+        _field(1, "$SPEED", "string", mandatory=True, choices=SPEEDS),
+        _field(2, "$FEC", "string", mandatory=True, choices=FECS),
+        _field(3, "$AUTO_NEGOTIATION", "string", choices=AUTO_NEGOTIATIONS),
+        _field(4, "$PORT_ENABLE", "bool"),
+        _field(5, "$PORT_UP", "bool", read_only=True),
+    ])
+    port["attributes"] = ["port_status_notif_cb"]
+    stat = _fixed_table("$PORT_STAT", PORT_STAT_TABLE_ID, "PortStat", ["$DEV_PORT"],
+                        [_field(i + 1, name, "uint64") for i, name in enumerate(PORT_STAT_FIELDS)])
+    stat["attributes"] = ["poll_intvl_ms"]
+    hdl = _fixed_table("$PORT_HDL_INFO", PORT_HDL_INFO_TABLE_ID, "PortHdlInfo", ["$CONN_ID", "$CHNL_ID"],
+                       [_field(1, "$DEV_PORT", "uint32", read_only=True)])
+    return json.dumps({"tables": [port, stat, hdl]}).encode()
+
+
+def default_port_map(connectors=32, lanes=4):
+    """Synthetic (front panel port, lane) -> dev port map: 16 connectors per pipe,
+    pipe p starting at dev port 128 * p, 8 dev ports per connector.
+    """
+    return OrderedDict(((conn, lane), 128 * ((conn - 1) // 16) + 8 * ((conn - 1) % 16) + lane)
+                       for conn in range(1, connectors + 1) for lane in range(lanes))
+
+
+def _read_json(data):
+    """bytes of a bf-rt.json given as bytes, str (path) or dict."""
+    if data is None:
+        return json.dumps({"tables": []}).encode()
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, dict):
+        return json.dumps(data).encode()
+    with open(data, "rb") as f:
+        return f.read()
+
+
+def _width(type_json):
+    """Byte width of an integer field, None for other types."""
+    if type_json is None:
+        return None
+    ftype = type_json.get("type")
+    if ftype == "bytes":
+        return (int(type_json["width"]) + 7) // 8
+    return {"uint64": 8, "uint32": 4, "uint16": 2, "uint8": 1}.get(ftype)
+
+
+def _singletons(data_json):
+    """Flat list of the field json of a "data" list (singletons and oneofs)."""
+    fields = []
+    for field in data_json:
+        if "singleton" in field:
+            fields.append(field["singleton"])
+        elif "oneof" in field:
+            fields.extend(field["oneof"])
+        else:
+            fields.append(field)
+    return fields
+
+
+class _UpdateError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class _TableState:
+    """Schema and entries of one table."""
+
+    def __init__(self, table_json):
+        self.name = table_json["name"]
+        self.id = table_json["id"]
+        self.type = table_json["table_type"]
+        self.size = table_json["size"]
+        self.key_ids = OrderedDict((k["name"], k["id"]) for k in table_json["key"])
+        self.key_widths = OrderedDict((k["id"], _width(k.get("type")) or 4) for k in table_json["key"])
+        self.fields = OrderedDict((f["name"], f) for f in _singletons(table_json.get("data", [])))
+        self.field_ids = OrderedDict((f["name"], f["id"]) for f in self.fields.values())
+        # Register fields are written as one value and read back as one value per pipe
+        self.register_ids = {f["id"] for f in self.fields.values()
+                             if {"name": "$bfrt_field_class", "value": "register_data"} in f.get("annotations", [])}
+        self.operations = table_json.get("supported_operations", [])
+        # Index tables have a single $..._INDEX key and hold every index below size
+        self.index_id = None
+        if len(self.key_ids) == 1:
+            key_name, key_id = next(iter(self.key_ids.items()))
+            if key_name.startswith("$") and key_name.endswith("_INDEX"):
+                self.index_id = key_id
+        self.entries = OrderedDict()
+        self.default_entry = None
+        self.attributes = {}
+
+    def key_of(self, table_key):
+        """Hashable key of a TableKey, independent of the order of its fields."""
+        return tuple(sorted((f.field_id, f.SerializeToString()) for f in table_key.fields))
+
+    def index_of(self, table_key):
+        for f in table_key.fields:
+            if f.field_id == self.index_id:
+                return int.from_bytes(f.exact.value, "big")
+        return None
+
+    def make_key(self, values):
+        """TableKey of exact key values given as {key name: int}."""
+        table_key = bfruntime_pb2.TableKey()
+        for name, value in values.items():
+            key_id = self.key_ids[name]
+            f = table_key.fields.add()
+            f.field_id = key_id
+            f.exact.value = int(value).to_bytes(self.key_widths[key_id], "big")
+        return table_key
+
+    def zero_data(self, pipes):
+        """TableData of an index table entry not written yet."""
+        data = bfruntime_pb2.TableData()
+        for field in self.fields.values():
+            width = _width(field.get("type"))
+            if field["id"] in self.register_ids:
+                # One stream field per pipe, like the switch
+                for _ in range(pipes):
+                    f = data.fields.add()
+                    f.field_id = field["id"]
+                    f.stream = bytes(width or 0)
+            elif width is not None:
+                f = data.fields.add()
+                f.field_id = field["id"]
+                f.stream = bytes(width)
+        return data
+
+
+class _Stream:
+    """One open StreamChannel and the notifications its client subscribed to."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.client_id = None
+        self.notifications = None
+
+    def wants(self, kind):
+        n = self.notifications
+        if n is None:
+            return False
+        return {"digest": n.enable_learn_notifications,
+                "idle_timeout_notification": n.enable_idletimeout_notifications,
+                "port_status_change_notification": n.enable_port_status_change_notifications}[kind]
+
+
+class BfRuntimeStandIn(bfruntime_pb2_grpc.BfRuntimeServicer):
+    """BfRuntime servicer with in-memory tables.
+
+    Keyword arguments:
+        p4_json -- bf-rt.json of the program, as a path, bytes or dict; None for no P4 tables
+        non_p4_json -- bf-rt.json of the fixed tables; port_tables_json() by default
+        p4_name -- program name reported by GetForwardingPipelineConfig
+        pipes -- number of pipes, i.e. of values per register field
+        port_map -- (front panel port, lane) -> dev port; default_port_map() by default
+        latency -- delay of every Write and Read in seconds
+        latency_per_entity -- additional delay per update or read entity in seconds
+        error_rate -- fraction of updates failing with INTERNAL
+        seed -- seed of the error injection
+        read_chunk_size -- entities per ReadResponse
+    """
+
+    def __init__(self, p4_json=None, non_p4_json=None, p4_name=DEFAULT_P4_NAME, pipes=DEFAULT_PIPES, port_map=None,
+                 latency=0.0, latency_per_entity=0.0, error_rate=0.0, seed=None,
+                 read_chunk_size=DEFAULT_READ_CHUNK_SIZE):
+        self.p4_name = p4_name
+        self.pipes = pipes
+        self.latency = latency
+        self.latency_per_entity = latency_per_entity
+        self.error_rate = error_rate
+        self.read_chunk_size = read_chunk_size
+        self.random = random.Random(seed)
+        self.port_map = port_map if port_map is not None else default_port_map()
+        self.rpc_counts = Counter()
+        self.digest_acks = 0
+        self._failures = {}
+        self._streams = []
+        self._list_id = 0
+        self._lock = threading.RLock()
+        self.load(p4_json, non_p4_json)
+
+    def load(self, p4_json=None, non_p4_json=None):
+        """Replaces all tables with those of the given bf-rt.json documents."""
+        p4_json = _read_json(p4_json)
+        non_p4_json = _read_json(non_p4_json) if non_p4_json is not None else port_tables_json()
+        p4 = json.loads(p4_json.decode("utf-8"))
+        non_p4 = json.loads(non_p4_json.decode("utf-8"))
+        with self._lock:
+            self.p4_json = p4_json
+            self.non_p4_json = non_p4_json
+            self.tables = OrderedDict()
+            for table_json in p4["tables"] + non_p4["tables"]:
+                self.tables[table_json["id"]] = _TableState(table_json)
+            self.table_ids = {t.name: t.id for t in self.tables.values()}
+            self.learns = OrderedDict((l["name"], l) for l in p4.get("learn_filters", []))
+            self.port_stats = {}
+            hdl = self.table("$PORT_HDL_INFO")
+            if hdl is not None:
+                dev_port_id = hdl.field_ids["$DEV_PORT"]
+                for (conn, lane), dev_port in self.port_map.items():
+                    entry = bfruntime_pb2.TableEntry(table_id=hdl.id)
+                    entry.key.CopyFrom(hdl.make_key({"$CONN_ID": conn, "$CHNL_ID": lane}))
+                    f = entry.data.fields.add()
+                    f.field_id = dev_port_id
+                    f.stream = dev_port.to_bytes(4, "big")
+                    hdl.entries[hdl.key_of(entry.key)] = entry
+
+    def table(self, name):
+        """_TableState of a table by name, None if unknown."""
+        table_id = self.table_ids.get(name)
+        return self.tables[table_id] if table_id is not None else None
+
+    def entries(self, name):
+        """List of the TableEntry messages written to a table."""
+        with self._lock:
+            return list(self.table(name).entries.values())
+
+    def fail_next(self, rpc, code=grpc.StatusCode.UNAVAILABLE, count=1):
+        """Makes the next count calls of rpc ("Write", "Read", ...) fail with code."""
+        with self._lock:
+            self._failures[rpc] = (code, count)
+
+    def stats(self):
+        """Number of calls per RPC."""
+        with self._lock:
+            return dict(self.rpc_counts)
+
+    def _enter(self, rpc, context, n_entities=0):
+        """Counts the call, applies latency and whole-RPC failures."""
+        with self._lock:
+            self.rpc_counts[rpc] += 1
+            code, count = self._failures.get(rpc, (None, 0))
+            if count:
+                self._failures[rpc] = (code, count - 1)
+        delay = self.latency + self.latency_per_entity * n_entities
+        if delay > 0:
+            time.sleep(delay)
+        if count:
+            context.abort(code, "Injected {} failure".format(rpc))
+
+    @staticmethod
+    def _abort_with_errors(context, errors):
+        """Fails the RPC the way the switch does: UNKNOWN with one Error per update as
+        binary details."""
+        status = status_pb2.Status(code=code_pb2.UNKNOWN, message="Batch failed")
+        for error in errors:
+            status.details.add().Pack(error)
+        context.set_trailing_metadata((("grpc-status-details-bin", status.SerializeToString()),))
+        context.abort(grpc.StatusCode.UNKNOWN, "Batch failed")
+
+    # Pipeline config
+
+    def GetForwardingPipelineConfig(self, request, context):
+        self._enter("GetForwardingPipelineConfig", context)
+        resp = bfruntime_pb2.GetForwardingPipelineConfigResponse()
+        config = resp.config.add()
+        config.p4_name = self.p4_name
+        config.bfruntime_info = self.p4_json
+        resp.non_p4_config.bfruntime_info = self.non_p4_json
+        return resp
+
+    def SetForwardingPipelineConfig(self, request, context):
+        self._enter("SetForwardingPipelineConfig", context)
+        if request.config and request.config[0].bfruntime_info:
+            self.p4_name = request.config[0].p4_name or self.p4_name
+            self.load(request.config[0].bfruntime_info, self.non_p4_json)
+        elif request.config and request.config[0].p4_name not in ("", self.p4_name):
+            context.abort(grpc.StatusCode.NOT_FOUND, "Unknown program {}".format(request.config[0].p4_name))
+        return bfruntime_pb2.SetForwardingPipelineConfigResponse()
+
+    # Write
+
+    def Write(self, request, context):
+        self._enter("Write", context, len(request.updates))
+        errors = []
+        with self._lock:
+            undo = [] if request.atomicity != bfruntime_pb2.WriteRequest.CONTINUE_ON_ERROR else None
+            for update in request.updates:
+                error = bfruntime_pb2.Error(canonical_code=code_pb2.OK)
+                try:
+                    if self.error_rate and self.random.random() < self.error_rate:
+                        raise _UpdateError(code_pb2.INTERNAL, "Injected error")
+                    self._update(update, undo)
+                except _UpdateError as e:
+                    error.canonical_code = e.code
+                    error.message = e.message
+                errors.append(error)
+            failed = any(e.canonical_code != code_pb2.OK for e in errors)
+            if failed and undo is not None:
+                self._rollback(undo)
+        metadata = dict(context.invocation_metadata())
+        if metadata.get("error_in_resp") == "1":
+            return bfruntime_pb2.WriteResponse(status=errors)
+        if failed:
+            self._abort_with_errors(context, errors)
+        return bfruntime_pb2.WriteResponse()
+
+    def _table_of(self, table_id):
+        table = self.tables.get(table_id)
+        if table is None:
+            raise _UpdateError(code_pb2.NOT_FOUND, "Unknown table id {}".format(table_id))
+        return table
+
+    def _update(self, update, undo=None):
+        entity = update.entity
+        which = entity.WhichOneof("entity")
+        if which == "table_entry":
+            self._update_entry(update.type, entity.table_entry, undo)
+        elif which == "table_attribute":
+            table = self._table_of(entity.table_attribute.table_id)
+            attribute = entity.table_attribute.WhichOneof("attribute")
+            table.attributes[attribute] = getattr(entity.table_attribute, attribute)
+        elif which == "table_operation":
+            table = self._table_of(entity.table_operation.table_id)
+            if entity.table_operation.table_operations_type not in table.operations:
+                raise _UpdateError(code_pb2.UNIMPLEMENTED, "Operation {} not supported by {}".format(
+                    entity.table_operation.table_operations_type, table.name))
+        else:
+            raise _UpdateError(code_pb2.UNIMPLEMENTED, "Write of {} not supported".format(which))
+
+    def _rollback(self, undo):
+        """Reverts the changes recorded by _update_entry, last first."""
+        for table, key, old in reversed(undo):
+            if key is None:
+                table.default_entry = old
+            elif old is None:
+                table.entries.pop(key, None)
+            else:
+                table.entries[key] = old
+
+    def _update_entry(self, update_type, entry, undo=None):
+        table = self._table_of(entry.table_id)
+        if undo is not None:
+            # Record the previous state of what this update touches
+            if entry.is_default_entry:
+                undo.append((table, None, table.default_entry))
+            elif entry.HasField("key"):
+                key = table.key_of(entry.key)
+                old = table.entries.get(key)
+                if old is not None:
+                    old_copy = bfruntime_pb2.TableEntry()
+                    old_copy.CopyFrom(old)
+                    old = old_copy
+                undo.append((table, key, old))
+            else:
+                undo.extend((table, key, old) for key, old in table.entries.items())
+        if entry.is_default_entry:
+            if update_type == bfruntime_pb2.Update.DELETE:
+                table.default_entry = None
+            else:
+                table.default_entry = bfruntime_pb2.TableEntry()
+                table.default_entry.CopyFrom(entry)
+            return
+        if update_type == bfruntime_pb2.Update.DELETE and not entry.HasField("key"):
+            # Wildcard delete
+            table.entries.clear()
+            return
+        key = table.key_of(entry.key)
+        exists = key in table.entries
+        if table.index_id is not None:
+            index = table.index_of(entry.key)
+            if index is None or index >= table.size:
+                raise _UpdateError(code_pb2.OUT_OF_RANGE, "Index {} out of range of {}".format(index, table.name))
+            # Every index of an index table exists
+            if update_type == bfruntime_pb2.Update.DELETE:
+                table.entries.pop(key, None)
+                return
+            update_type = bfruntime_pb2.Update.MODIFY_INC if exists else bfruntime_pb2.Update.INSERT
+        if table.name == "$PORT" and update_type == bfruntime_pb2.Update.INSERT:
+            self._check_port(table, entry)
+
+        if update_type == bfruntime_pb2.Update.INSERT:
+            if exists:
+                raise _UpdateError(code_pb2.ALREADY_EXISTS, "Entry already exists in {}".format(table.name))
+            if len(table.entries) >= table.size:
+                raise _UpdateError(code_pb2.RESOURCE_EXHAUSTED, "Table {} is full".format(table.name))
+            stored = bfruntime_pb2.TableEntry()
+            stored.CopyFrom(entry)
+            stored.ClearField("table_flags")
+            table.entries[key] = stored
+        elif update_type in (bfruntime_pb2.Update.MODIFY, bfruntime_pb2.Update.MODIFY_INC):
+            if not exists:
+                raise _UpdateError(code_pb2.NOT_FOUND, "Entry not found in {}".format(table.name))
+            stored = table.entries[key]
+            if update_type == bfruntime_pb2.Update.MODIFY and entry.data.action_id:
+                stored.data.CopyFrom(entry.data)
+            else:
+                # Only the given fields change
+                fields = OrderedDict((f.field_id, f) for f in stored.data.fields)
+                for f in entry.data.fields:
+                    fields[f.field_id] = f
+                data = bfruntime_pb2.TableData(action_id=entry.data.action_id or stored.data.action_id)
+                data.fields.extend(fields.values())
+                stored.data.CopyFrom(data)
+        elif update_type == bfruntime_pb2.Update.DELETE:
+            if not exists:
+                raise _UpdateError(code_pb2.NOT_FOUND, "Entry not found in {}".format(table.name))
+            del table.entries[key]
+            if table.name == "$PORT":
+                self.port_stats.pop(int.from_bytes(entry.key.fields[0].exact.value, "big"), None)
+        else:
+            raise _UpdateError(code_pb2.INVALID_ARGUMENT, "Invalid update type {}".format(update_type))
+
+    def _check_port(self, table, entry):
+        dev_port = int.from_bytes(entry.key.fields[0].exact.value, "big")
+        if dev_port not in self.port_map.values():
+            raise _UpdateError(code_pb2.INVALID_ARGUMENT, "Invalid dev port {}".format(dev_port))
+        up_id = table.field_ids["$PORT_UP"]
+        if not any(f.field_id == up_id for f in entry.data.fields):
+            f = entry.data.fields.add()
+            f.field_id = up_id
+            f.bool_val = False
+
+    # Read
+
+    def Read(self, request, context):
+        self._enter("Read", context, len(request.entities))
+        resp = bfruntime_pb2.ReadResponse()
+        try:
+            for entity in request.entities:
+                for out in self._read_entity(entity):
+                    resp.entities.add().CopyFrom(out)
+                    if len(resp.entities) >= self.read_chunk_size:
+                        yield resp
+                        resp = bfruntime_pb2.ReadResponse()
+        except _UpdateError as e:
+            self._abort_with_errors(context, [bfruntime_pb2.Error(canonical_code=e.code, message=e.message)])
+        if len(resp.entities) or not request.entities:
+            yield resp
+
+    def _read_entity(self, entity):
+        """Yields the entities answering one entity of a ReadRequest."""
+        which = entity.WhichOneof("entity")
+        if which == "table_attribute":
+            table = self._table_of(entity.table_attribute.table_id)
+            with self._lock:
+                attributes = list(table.attributes.items())
+            for name, value in attributes:
+                out = bfruntime_pb2.Entity()
+                out.table_attribute.table_id = table.id
+                getattr(out.table_attribute, name).CopyFrom(value)
+                yield out
+            return
+        if which == "table_usage":
+            table = self._table_of(entity.table_usage.table_id)
+            out = bfruntime_pb2.Entity()
+            out.table_usage.table_id = table.id
+            out.table_usage.usage = len(table.entries)
+            yield out
+            return
+        if which != "table_entry":
+            raise _UpdateError(code_pb2.UNIMPLEMENTED, "Read of {} not supported".format(which))
+
+        request = entity.table_entry
+        table = self._table_of(request.table_id)
+        if request.is_default_entry:
+            with self._lock:
+                default_entry = table.default_entry
+            if default_entry is not None:
+                yield bfruntime_pb2.Entity(table_entry=default_entry)
+            return
+        if request.HasField("key") and len(request.key.fields):
+            with self._lock:
+                entry = self._entry(table, table.key_of(request.key), request.key)
+            if entry is None:
+                raise _UpdateError(code_pb2.NOT_FOUND, "Entry not found in {}".format(table.name))
+            yield bfruntime_pb2.Entity(table_entry=entry)
+            return
+        for entry in self._all_entries(table):
+            yield bfruntime_pb2.Entity(table_entry=entry)
+
+    def _entry(self, table, key, table_key):
+        """Entry of a key as returned by a read, None if there is none."""
+        if table.name == "$PORT_STAT":
+            return self._port_stat_entry(table, table_key)
+        stored = table.entries.get(key)
+        if table.index_id is not None:
+            index = table.index_of(table_key)
+            if index is None or index >= table.size:
+                return None
+            if stored is None:
+                entry = bfruntime_pb2.TableEntry(table_id=table.id)
+                entry.key.CopyFrom(table_key)
+                entry.data.CopyFrom(table.zero_data(self.pipes))
+                return entry
+        if stored is None:
+            return None
+        if table.register_ids:
+            return self._per_pipe(table, stored)
+        return stored
+
+    def _per_pipe(self, table, stored):
+        """Written register values are read back once per pipe, as one stream field per
+        pipe with the field id of the register field."""
+        entry = bfruntime_pb2.TableEntry()
+        entry.CopyFrom(stored)
+        del entry.data.fields[:]
+        for f in stored.data.fields:
+            copies = self.pipes if f.field_id in table.register_ids else 1
+            for _ in range(copies):
+                entry.data.fields.add().CopyFrom(f)
+        return entry
+
+    def _all_entries(self, table):
+        """Entries of a wildcard read, in key order for index tables."""
+        if table.name == "$PORT_STAT":
+            with self._lock:
+                entries = [self._port_stat_entry(table, entry.key) for entry in self.table("$PORT").entries.values()]
+            for entry in entries:
+                yield entry
+            return
+        if table.index_id is None:
+            with self._lock:
+                stored = list(table.entries.values())
+            for entry in stored:
+                yield self._per_pipe(table, entry) if table.register_ids else entry
+            return
+        key_name = next(iter(table.key_ids))
+        for index in range(table.size):
+            table_key = table.make_key({key_name: index})
+            with self._lock:
+                entry = self._entry(table, table.key_of(table_key), table_key)
+            yield entry
+
+    def _port_stat_entry(self, table, table_key):
+        dev_port = int.from_bytes(table_key.fields[0].exact.value, "big")
+        port = self.table("$PORT")
+        if port.key_of(table_key) not in port.entries:
+            raise _UpdateError(code_pb2.NOT_FOUND, "Port {} not added".format(dev_port))
+        values = self.port_stats.get(dev_port, {})
+        entry = bfruntime_pb2.TableEntry(table_id=table.id)
+        entry.key.CopyFrom(table_key)
+        for name, field_id in table.field_ids.items():
+            f = entry.data.fields.add()
+            f.field_id = field_id
+            f.stream = int(values.get(name, 0)).to_bytes(8, "big")
+        return entry
+
+    def add_port_stats(self, dev_port, **values):
+        """Adds to the $PORT_STAT counters of a port, given without the leading $
+        (e.g. FramesReceivedOK=10)."""
+        with self._lock:
+            stats = self.port_stats.setdefault(dev_port, {})
+            for name, value in values.items():
+                stats["$" + name] = stats.get("$" + name, 0) + value
+
+    # Stream
+
+    def StreamChannel(self, request_iterator, context):
+        self.rpc_counts["StreamChannel"] += 1
+        stream = _Stream()
+        with self._lock:
+            self._streams.append(stream)
+
+        def receive():
+            try:
+                for msg in request_iterator:
+                    if msg.HasField("subscribe"):
+                        stream.client_id = msg.client_id
+                        stream.notifications = msg.subscribe.notifications
+                        resp = bfruntime_pb2.StreamMessageResponse()
+                        resp.subscribe.CopyFrom(msg.subscribe)
+                        resp.subscribe.status.code = code_pb2.OK
+                        stream.queue.put(resp)
+                    elif msg.HasField("digest_ack"):
+                        with self._lock:
+                            self.digest_acks += 1
+            except grpc.RpcError:
+                pass
+            stream.queue.put(None)
+
+        threading.Thread(target=receive, name="bfrt-standin-stream", daemon=True).start()
+        context.add_callback(lambda: stream.queue.put(None))
+        try:
+            while True:
+                msg = stream.queue.get()
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            with self._lock:
+                self._streams.remove(stream)
+
+    def _notify(self, kind, msg):
+        """Sends msg to the streams subscribed to kind. Returns the number of streams."""
+        with self._lock:
+            streams = [s for s in self._streams if s.wants(kind)]
+        for stream in streams:
+            stream.queue.put(msg)
+        return len(streams)
+
+    def push_digest(self, learn_name, records):
+        """Sends one DigestList of a learn filter with the given records, dicts of
+        field name -> int, to the subscribed clients."""
+        learn = self.learns[learn_name]
+        fields = {f["name"]: f for f in _singletons(learn["fields"])}
+        msg = bfruntime_pb2.StreamMessageResponse()
+        msg.digest.digest_id = learn["id"]
+        with self._lock:
+            self._list_id += 1
+            msg.digest.list_id = self._list_id
+        for record in records:
+            data = msg.digest.data.add()
+            for name, value in record.items():
+                field = fields[name]
+                f = data.fields.add()
+                f.field_id = field["id"]
+                f.stream = int(value).to_bytes(_width(field.get("type")) or 4, "big")
+        return self._notify("digest", msg)
+
+    def set_port_status(self, dev_port, up):
+        """Changes $PORT_UP of an added port and notifies the clients subscribed to port
+        status changes, if notifications are enabled on $PORT.
+        """
+        port = self.table("$PORT")
+        table_key = port.make_key({"$DEV_PORT": dev_port})
+        with self._lock:
+            entry = port.entries.get(port.key_of(table_key))
+            if entry is None:
+                raise KeyError("Port {} not added".format(dev_port))
+            up_id = port.field_ids["$PORT_UP"]
+            for f in entry.data.fields:
+                if f.field_id == up_id:
+                    f.bool_val = up
+            notify = port.attributes.get("port_status_notify")
+            enabled = notify is not None and notify.enable
+        if not enabled:
+            return 0
+        msg = bfruntime_pb2.StreamMessageResponse()
+        msg.port_status_change_notification.table_entry.table_id = port.id
+        msg.port_status_change_notification.table_entry.key.CopyFrom(table_key)
+        msg.port_status_change_notification.port_up = up
+        return self._notify("port_status_change_notification", msg)
+
+
+class StandInServer:
+    """gRPC server running a BfRuntimeStandIn.
+
+    Keyword arguments:
+        p4_json -- bf-rt.json fixture, see BfRuntimeStandIn
+        host -- address to listen on
+        port -- port to listen on, 0 for a free one
+        max_workers -- number of server threads; every open StreamChannel holds one
+        **kwargs -- further BfRuntimeStandIn arguments (latency, error_rate, ...)
+
+    Attributes:
+        servicer -- the BfRuntimeStandIn, to inspect tables or inject errors
+        port -- port listened on, known once started
+    """
+
+    def __init__(self, p4_json=None, host="127.0.0.1", port=0, max_workers=16, **kwargs):
+        self.servicer = BfRuntimeStandIn(p4_json, **kwargs)
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers
+        self.server = None
+
+    @property
+    def address(self):
+        return "{}:{}".format(self.host, self.port)
+
+    def start(self):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                             thread_name_prefix="bfrt-standin"))
+        bfruntime_pb2_grpc.add_BfRuntimeServicer_to_server(self.servicer, self.server)
+        self.port = self.server.add_insecure_port(self.address)
+        self.server.start()
+        log.info("BfRuntime stand-in serving {} on {}".format(self.servicer.p4_name, self.address))
+        return self
+
+    def stop(self, grace=None):
+        if self.server is not None:
+            self.server.stop(grace)
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a bf-rt.json from memory in place of a switch.")
+    parser.add_argument("bfrt_json", nargs="?", help="bf-rt.json of the program")
+    parser.add_argument("--p4-name", default=DEFAULT_P4_NAME, help="Program name")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=50052, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay per Write/Read in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of failing updates")
+    args = parser.parse_args()
+
+    server = StandInServer(args.bfrt_json, host=args.host, port=args.port, p4_name=args.p4_name,
+                           latency=args.latency, error_rate=args.error_rate).start()
+    server.server.wait_for_termination()
@@ -8,6 +8,8 @@ Usage:
 import logging
 import sys
 
+import numpy as np
+
 sys.path.append("/home/n6saha/bfrt_controller")
 from bfrt_controller.controller import Controller
 
@@ -81,26 +83,25 @@ def main():
     c.setup_tables(["Ingress.QoSMeter.meter_table"])
     c.add_annotation("Ingress.QoSMeter.meter_table", "hdr.gtpu.teid", "hex")
 
-    entries = []
+    # One column per field: every (TEID, QFI) pair, QFIs varying fastest
+    teids = np.repeat(BASE_TEID + np.arange(UE_COUNT), len(QFIS))
+    qfis = np.tile(QFIS, UE_COUNT)
 
-    for ue in range(UE_COUNT):
-        teid = BASE_TEID + ue
-        for qfi in QFIS:
-            params = QFI_METER_PARAMS[qfi]
-            entry = (
-                [("hdr.gtpu.teid", teid), ("hdr.gtpu_ext_psc.qfi", qfi)],
-                "Ingress.QoSMeter.set_color",
-                [
-                    ("$METER_SPEC_CIR_KBPS", params["CIR_KBPS"]),
-                    ("$METER_SPEC_PIR_KBPS", params["PIR_KBPS"]),
-                    ("$METER_SPEC_CBS_KBITS", params["CBS_KBITS"]),
-                    ("$METER_SPEC_PBS_KBITS", params["PBS_KBITS"]),
-                ]
-            )
-            entries.append(entry)
+    def param(name):
+        return np.tile([QFI_METER_PARAMS[qfi][name] for qfi in QFIS], UE_COUNT)
 
-    logging.info(f"Installing {len(entries)} meter entries for {UE_COUNT} UEs × {len(QFIS)} QFIs")
-    c.program_table("Ingress.QoSMeter.meter_table", entries)
+    logging.info(f"Installing {len(teids)} meter entries for {UE_COUNT} UEs × {len(QFIS)} QFIs")
+    c.program_table_columns(
+        "Ingress.QoSMeter.meter_table",
+        keys={"hdr.gtpu.teid": teids, "hdr.gtpu_ext_psc.qfi": qfis},
+        action="Ingress.QoSMeter.set_color",
+        data={
+            "$METER_SPEC_CIR_KBPS": param("CIR_KBPS"),
+            "$METER_SPEC_PIR_KBPS": param("PIR_KBPS"),
+            "$METER_SPEC_CBS_KBITS": param("CBS_KBITS"),
+            "$METER_SPEC_PBS_KBITS": param("PBS_KBITS"),
+        },
+    )
     c.tear_down()
 
 
@@ -1,5 +1,7 @@
 import os
 import sys
+import time
+import numpy as np
 import pandas as pd
 import argparse
 import logging
@@ -15,28 +17,25 @@ logging.basicConfig(
 )
 
 def dump_register_df(c, reg_name: str, csv_path: str = None, top_k: int = 10, pipe: int = 0):
-    """Reads a register in batched mode, optionally writes non-zero entries to CSV, and prints summary stats."""
+    """Reads a register into NumPy arrays, optionally writes non-zero entries to CSV, and prints summary stats."""
     if not c.table_exists(reg_name):
         print(f"[WARN] Register '{reg_name}' does not exist.")
         return
 
     print(f"[INFO] Reading register: {reg_name}")
-    reg_values = c.read_register_batched(reg_name, pipe=pipe)
-    df = pd.DataFrame(reg_values, columns=["index", "value"])
+    reg = c.read_register_arrays(reg_name, pipe=pipe)
 
-    # Filter non-zero
-    df_nonzero = df[df["value"].apply(lambda v: v != 0 and v != (0, 0))]
-
-    if df_nonzero.empty:
+    # Filter non-zero and sort by value (sum of first/second for paired registers)
+    total = sum(col.astype(np.uint64) for col in reg.fields.values())
+    nonzero = np.flatnonzero(total)
+    if nonzero.size == 0:
         print(f"[INFO] No non-zero entries found in {reg_name}.")
         return
+    order = nonzero[np.argsort(total[nonzero], kind="stable")[::-1]]
 
-    # Sort by value (handle int or tuple)
-    df_sorted = df_nonzero.sort_values(
-        by="value",
-        key=lambda col: col.apply(lambda v: sum(v) if isinstance(v, tuple) else v),
-        ascending=False
-    )
+    df_sorted = pd.DataFrame({"index": reg.index[order]})
+    for name, col in reg.fields.items():
+        df_sorted[name] = col[order]
 
     if csv_path:
         df_sorted.to_csv(csv_path, index=False)
@@ -46,11 +45,20 @@ def dump_register_df(c, reg_name: str, csv_path: str = None, top_k: int = 10, pi
     print(df_sorted.head(top_k))
 
 
+def print_changes(change):
+    """Prints the indexes of a register that changed since the previous poll."""
+    print(f"[INFO] {change.name}: {len(change)} indexes changed in {change.interval:.2f}s")
+    for i, idx in enumerate(change.index.tolist()):
+        deltas = ", ".join(f"{name}={d[i].tolist()}" for name, d in change.deltas.items())
+        print(f"  {idx}: {deltas}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Clear or read telemetry registers.")
-    parser.add_argument("--mode", choices=["clear", "read"], default="clear", help="Operation mode")
+    parser.add_argument("--mode", choices=["clear", "read", "poll"], default="clear", help="Operation mode")
     parser.add_argument("--output", type=str, help="CSV file path to save register values (read mode only)")
     parser.add_argument("--top-k", type=int, default=10, help="Show top-K register entries (read mode only)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between polls (poll mode only)")
     args = parser.parse_args()
 
     c = Controller()
@@ -67,4 +75,13 @@ if __name__ == "__main__":
             out_path = args.output or f"{reg.replace('.', '_')}.csv"
             dump_register_df(c=c, reg_name=reg, csv_path=out_path, top_k=args.top_k)
 
+    elif args.mode == "poll":
+        poller = c.poller(interval=args.interval, on_change=print_changes, registers=register_names)
+        poller.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            poller.stop()
+
     c.tear_down()